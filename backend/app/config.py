@@ -13,8 +13,125 @@ class Settings(BaseSettings):
 
     auto_save_interval: int = 5
 
+    persist_flush_interval: float = 1.0
+    persist_flush_bytes: int = 256 * 1024
+    persist_batch_size: int = 100
+
+    oplog_capacity: int = 500
+    oplog_persist: bool = False
+    oplog_persist_bytes: int = 64 * 1024 * 1024
+
+    outbound_queue_size: int = 256
+    outbound_overflow_policy: str = "drop_stale"
+    outbound_send_timeout: float = 10.0
+
+    presence_tick_ms: int = 40
+
+    # Most queued edits a room applies and broadcasts as one batch
+    edit_batch_max: int = 64
+
+    # Patch parsing and formatting for patches at least diff_offload_patch_bytes
+    # long, and whole-document diffs over diff_offload_document_bytes, run on
+    # a "thread" or "process" pool instead of the event loop; "inline" never
+    # offloads
+    diff_executor: str = "thread"
+    diff_executor_workers: int = 2
+    diff_offload_patch_bytes: int = 32 * 1024
+    diff_offload_document_bytes: int = 256 * 1024
+
+    # While a room is edited its text is recorded every history_interval
+    # seconds as a compressed delta against the previous entry, with a full
+    # keyframe every history_keyframe_interval entries, so any entry is
+    # rebuilt from one keyframe and at most that many deltas
+    history_enabled: bool = True
+    history_interval: float = 60.0
+    history_keyframe_interval: int = 20
+    history_compression_level: int = 6
+    # Entries older than history_compact_after seconds are thinned to one per
+    # history_compact_spacing seconds, and entries older than
+    # history_retention_days are dropped; 0 turns either policy off
+    history_compact_after: float = 24 * 3600
+    history_compact_spacing: float = 3600
+    history_retention_days: float = 90
+    history_maintenance_interval: float = 3600
+
+    # Frames at least this large are deflated for connections that ask for
+    # compression; 0 never compresses
+    ws_compress_threshold: int = 4096
+    ws_compress_level: int = 1
+    ws_max_frame_bytes: int = 16 * 1024 * 1024
+
+    # The /admin endpoints are only mounted when a token is set, and every
+    # request to them must send it as "Authorization: Bearer <token>"
+    admin_token: str = ""
+
+    loop_lag_interval_ms: int = 250
+    # 0 leaves the slow handler profiler off; with admin_token set it can be
+    # switched on at runtime through PUT /admin/event-loop/profiler
+    slow_handler_threshold_ms: float = 0
+    slow_handler_max_entries: int = 200
+    slow_handler_stack_depth: int = 25
+
+    backplane: str = "memory"
+    backplane_url: str = "redis://localhost:6379/0"
+    backplane_request_timeout: float = 5.0
+    node_id: str = ""
+    room_lease_ttl: float = 15.0
+
     code_execution_timeout: int = 30
 
+    execution_workspace: str = "disk"
+    execution_workspace_dir: str = ""
+    execution_use_memfd: bool = False
+
+    # The pool is grown to the scheduler's concurrency when this is smaller;
+    # 0 turns it off. A run that finds every worker busy waits at most
+    # sandbox_acquire_wait_ms for one before running in a cold subprocess.
+    sandbox_pool_size: int = 2
+    sandbox_acquire_wait_ms: float = 5
+    sandbox_max_runs: int = 50
+    sandbox_spawn_timeout: float = 10.0
+    sandbox_preload_modules: list[str] = [
+        "bisect", "collections", "copy", "dataclasses", "datetime", "decimal",
+        "fractions", "functools", "heapq", "itertools", "json", "math",
+        "operator", "random", "re", "statistics", "string", "typing"
+    ]
+
+    execution_output_flush_ms: int = 25
+
+    # Per-run caps by language; 0 leaves a limit unset. "processes" is
+    # RLIMIT_NPROC, which counts every process of the server's uid, so only
+    # set it when runs execute under a uid of their own.
+    execution_limits: dict[str, dict[str, int]] = {
+        "python": {
+            "cpu_seconds": 10,
+            "memory_bytes": 512 * 1024 * 1024,
+            "processes": 0,
+            "file_bytes": 16 * 1024 * 1024,
+            "open_files": 64,
+            "output_bytes": 1024 * 1024
+        },
+        "cpp": {
+            "cpu_seconds": 10,
+            "memory_bytes": 512 * 1024 * 1024,
+            "processes": 0,
+            "file_bytes": 16 * 1024 * 1024,
+            "open_files": 64,
+            "output_bytes": 1024 * 1024
+        }
+    }
+
+    execution_max_concurrent: int = 0
+    execution_max_queued: int = 64
+    execution_max_queued_per_user: int = 4
+
+    execution_cache_ttl: float = 300.0
+    execution_cache_max_bytes: int = 16 * 1024 * 1024
+
+    cpp_compile_flags: list[str] = []
+    cpp_cache_dir: str = ""
+    cpp_cache_max_bytes: int = 256 * 1024 * 1024
+
     cors_origins: list[str] = ["http://localhost:3000"]
 
     @property
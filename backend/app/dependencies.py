@@ -1,11 +1,21 @@
-from typing import AsyncGenerator
-from fastapi import Depends
+import hmac
+from typing import AsyncGenerator, Optional
+from fastapi import Depends, Header, HTTPException, status
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
-from app.models.database import Database, RoomRepository
+from app.config import settings
+from app.models.database import Database, RoomRepository, OperationRepository, HistoryRepository
 from app.services.connection_manager import manager
+from app.services.document_store import DocumentStore, document_store
+from app.services.persistence_service import PersistenceService, persistence_service
+from app.services.presence_service import presence_service
+from app.services.room_cluster import room_cluster
 from app.services.sync_service import SyncService
 from app.services.execution_service import execution_service
+from app.services.execution_scheduler import execution_scheduler
+from app.services.loop_monitor import loop_monitor
+from app.services.handler_profiler import handler_profiler
+from app.services.history_service import history_service
 
 
 async def get_database() -> AsyncIOMotorDatabase:
@@ -18,15 +28,77 @@ async def get_room_repository(
     return RoomRepository(db)
 
 
+async def get_operation_repository(
+    db: AsyncIOMotorDatabase = Depends(get_database)
+) -> Optional[OperationRepository]:
+    return OperationRepository(db) if settings.oplog_persist else None
+
+
+async def get_history_repository(
+    db: AsyncIOMotorDatabase = Depends(get_database)
+) -> HistoryRepository:
+    return HistoryRepository(db)
+
+
+async def get_document_store() -> DocumentStore:
+    return document_store
+
+
+async def get_persistence_service() -> PersistenceService:
+    return persistence_service
+
+
 async def get_sync_service(
-    room_repo: RoomRepository = Depends(get_room_repository)
+    room_repo: RoomRepository = Depends(get_room_repository),
+    store: DocumentStore = Depends(get_document_store),
+    persistence: PersistenceService = Depends(get_persistence_service),
+    op_repo: Optional[OperationRepository] = Depends(get_operation_repository)
 ) -> SyncService:
-    return SyncService(room_repo)
+    return SyncService(room_repo, store, persistence, op_repo, history=history_service)
 
 
 async def get_connection_manager():
     return manager
 
 
+async def get_room_cluster():
+    return room_cluster
+
+
+async def get_presence_service():
+    return presence_service
+
+
 async def get_execution_service():
     return execution_service
+
+
+async def get_execution_scheduler():
+    return execution_scheduler
+
+
+async def get_loop_monitor():
+    return loop_monitor
+
+
+async def get_handler_profiler():
+    return handler_profiler
+
+
+async def get_history_service():
+    return history_service
+
+
+async def require_admin(authorization: str = Header("")) -> None:
+    scheme, _, token = authorization.partition(" ")
+
+    if (
+        not settings.admin_token
+        or scheme.lower() != "bearer"
+        or not hmac.compare_digest(token.encode(), settings.admin_token.encode())
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Admin token required",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
@@ -2,13 +2,26 @@ import asyncio
 import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.config import settings
 from app.models.database import Database
-from app.services.sync_service import SyncService
 from app.services.connection_manager import manager
-from app.routers import rooms, execution, websocket
+from app.services.persistence_service import persistence_service
+from app.services.snapshot_service import snapshot_service
+from app.services.presence_service import presence_service
+from app.services.room_cluster import room_cluster
+from app.services.sandbox_pool import sandbox_pool
+from app.services.compile_cache import compile_cache
+from app.services.execution_scheduler import execution_scheduler
+from app.services.result_cache import result_cache
+from app.services.metrics import metrics
+from app.services.loop_monitor import loop_monitor
+from app.services.handler_profiler import handler_profiler
+from app.services.diff_executor import diff_executor
+from app.services.history_service import history_service
+from app.routers import rooms, execution, websocket, admin
 
 logging.basicConfig(
     level=logging.INFO,
@@ -22,16 +35,31 @@ async def lifespan(app: FastAPI):
     logger.info("Starting CodeStream Engine...")
     await Database.connect()
     logger.info("Database connected")
+    persistence_service.start()
+    history_service.start()
+    await room_cluster.start()
+    logger.info(f"Joined backplane as node {room_cluster.node_id}")
+    await sandbox_pool.start()
     auto_save_task = asyncio.create_task(auto_save_loop())
+    loop_monitor.start()
+    handler_profiler.start()
 
     yield
 
     logger.info("Shutting down CodeStream Engine...")
+    await loop_monitor.stop()
+    handler_profiler.stop()
     auto_save_task.cancel()
     try:
         await auto_save_task
     except asyncio.CancelledError:
         pass
+    await sandbox_pool.stop()
+    await history_service.stop()
+    await room_cluster.stop()
+    diff_executor.stop()
+    await persistence_service.stop()
+    logger.info("Write-behind queue drained")
     await Database.disconnect()
     logger.info("Database disconnected")
 
@@ -40,12 +68,12 @@ async def auto_save_loop():
     while True:
         try:
             await asyncio.sleep(settings.auto_save_interval)
-            for room_id in list(manager.rooms.keys()):
-                db = Database.get_db()
-                from app.models.database import RoomRepository
-                repo = RoomRepository(db)
-                sync_service = SyncService(repo)
-                await sync_service.save_snapshot(room_id)
+            tick = await snapshot_service.run_tick()
+            if tick["saved"] or tick["failed"]:
+                logger.info(
+                    f"Auto-save: saved={tick['saved']} skipped={tick['skipped']} "
+                    f"failed={tick['failed']} in {tick['duration_ms']}ms"
+                )
         except asyncio.CancelledError:
             break
         except Exception as e:
@@ -69,6 +97,8 @@ app.add_middleware(
 
 app.include_router(rooms.router)
 app.include_router(execution.router)
+if settings.admin_token:
+    app.include_router(admin.router)
 app.include_router(websocket.router)
 
 
@@ -86,5 +116,22 @@ async def health_check():
     return {
         "status": "healthy",
         "database": "connected" if Database.db is not None else "disconnected",
-        "active_rooms": len(manager.rooms)
+        "active_rooms": len(manager.rooms),
+        "persistence": persistence_service.stats(),
+        "auto_save": snapshot_service.stats(),
+        "outbound": manager.outbound_stats(),
+        "presence": presence_service.stats(),
+        "cluster": room_cluster.stats(),
+        "sandbox": sandbox_pool.stats(),
+        "compile_cache": compile_cache.stats(),
+        "execution": execution_scheduler.stats(),
+        "result_cache": result_cache.stats(),
+        "event_loop": loop_monitor.stats(),
+        "diff_executor": diff_executor.stats(),
+        "history": history_service.stats()
     }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,12 +1,20 @@
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
-from typing import Optional, List, Dict, Any
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime
 import logging
 
 from app.config import settings
+from app.services.metrics import metrics, timed
 
 logger = logging.getLogger(__name__)
 
+DB_SECONDS = metrics.histogram(
+    "codestream_db_operation_seconds",
+    "MongoDB latency by collection and repository method",
+    ("collection", "method")
+)
+
 
 class Database:
     client: Optional[AsyncIOMotorClient] = None
@@ -22,11 +30,28 @@ class Database:
             await cls.db.rooms.create_index("created_at")
             await cls.db.rooms.create_index("name")
 
+            if settings.oplog_persist:
+                await cls._ensure_operation_log()
+
+            if settings.history_enabled:
+                await cls.db.room_history.create_index([("room_id", 1), ("version", 1)], unique=True)
+
             logger.info(f"Connected to MongoDB at {settings.mongo_url}")
         except Exception as e:
             logger.error(f"Failed to connect to MongoDB: {e}")
             raise
 
+    @classmethod
+    async def _ensure_operation_log(cls) -> None:
+        existing = await cls.db.list_collection_names()
+        if "room_operations" not in existing:
+            await cls.db.create_collection(
+                "room_operations",
+                capped=True,
+                size=settings.oplog_persist_bytes
+            )
+        await cls.db.room_operations.create_index([("room_id", 1), ("version", 1)])
+
     @classmethod
     async def disconnect(cls) -> None:
         if cls.client:
@@ -44,6 +69,7 @@ class RoomRepository:
     def __init__(self, db: AsyncIOMotorDatabase):
         self.collection = db.rooms
 
+    @timed(DB_SECONDS, "rooms")
     async def create_room(
         self,
         room_id: str,
@@ -66,9 +92,11 @@ class RoomRepository:
         logger.info(f"Created room: {room_id}")
         return room_doc
 
+    @timed(DB_SECONDS, "rooms")
     async def get_room(self, room_id: str) -> Optional[Dict[str, Any]]:
         return await self.collection.find_one({"room_id": room_id})
 
+    @timed(DB_SECONDS, "rooms")
     async def update_room_code(
         self,
         room_id: str,
@@ -76,7 +104,7 @@ class RoomRepository:
         version: int
     ) -> bool:
         result = await self.collection.update_one(
-            {"room_id": room_id, "version": version - 1},
+            {"room_id": room_id, "version": {"$lt": version}},
             {
                 "$set": {
                     "code": code,
@@ -87,6 +115,29 @@ class RoomRepository:
         )
         return result.modified_count > 0
 
+    @timed(DB_SECONDS, "rooms")
+    async def bulk_update_code(self, updates: List[Tuple[str, str, int]]) -> int:
+        if not updates:
+            return 0
+
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {"room_id": room_id, "version": {"$lt": version}},
+                {
+                    "$set": {
+                        "code": code,
+                        "version": version,
+                        "updated_at": now
+                    }
+                }
+            )
+            for room_id, code, version in updates
+        ]
+        result = await self.collection.bulk_write(operations, ordered=False)
+        return result.modified_count
+
+    @timed(DB_SECONDS, "rooms")
     async def add_user(self, room_id: str, user: Dict[str, Any]) -> bool:
         result = await self.collection.update_one(
             {"room_id": room_id},
@@ -94,6 +145,7 @@ class RoomRepository:
         )
         return result.modified_count > 0
 
+    @timed(DB_SECONDS, "rooms")
     async def remove_user(self, room_id: str, user_id: str) -> bool:
         result = await self.collection.update_one(
             {"room_id": room_id},
@@ -101,6 +153,7 @@ class RoomRepository:
         )
         return result.modified_count > 0
 
+    @timed(DB_SECONDS, "rooms")
     async def update_user_cursor(
         self,
         room_id: str,
@@ -117,6 +170,7 @@ class RoomRepository:
         )
         return result.modified_count > 0
 
+    @timed(DB_SECONDS, "rooms")
     async def list_rooms(self, limit: int = 50) -> List[Dict[str, Any]]:
         cursor = self.collection.find(
             {},
@@ -128,6 +182,147 @@ class RoomRepository:
             r["active_users"] = len(r.get("active_users") or [])
         return rooms
 
+    @timed(DB_SECONDS, "rooms")
     async def delete_room(self, room_id: str) -> bool:
         result = await self.collection.delete_one({"room_id": room_id})
         return result.deleted_count > 0
+
+
+class OperationRepository:
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.collection = db.room_operations
+
+    @timed(DB_SECONDS, "room_operations")
+    async def insert_operations(self, room_id: str, operations: List[Dict[str, Any]]) -> None:
+        if not operations:
+            return
+
+        await self.collection.insert_many(
+            [{"room_id": room_id, **op} for op in operations],
+            ordered=True
+        )
+
+    @timed(DB_SECONDS, "room_operations")
+    async def get_recent_operations(
+        self,
+        room_id: str,
+        max_version: int,
+        limit: int
+    ) -> List[Dict[str, Any]]:
+        cursor = self.collection.find(
+            {"room_id": room_id, "version": {"$lte": max_version}},
+            {"_id": 0, "version": 1, "diff": 1, "user_id": 1, "ops": 1}
+        ).sort("version", -1).limit(limit)
+
+        operations = await cursor.to_list(length=limit)
+        operations.reverse()
+        return operations
+
+
+# Room history entries: {room_id, version, depth, base_version, data, size,
+# length, created_at}. depth 0 is a keyframe holding the whole text; any
+# other entry holds a delta against the entry at base_version, which has
+# depth - 1.
+class HistoryRepository:
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.collection = db.room_history
+
+    @timed(DB_SECONDS, "room_history")
+    async def save_entries(self, entries: List[Dict[str, Any]]) -> None:
+        if not entries:
+            return
+
+        await self.collection.bulk_write(
+            [
+                ReplaceOne({"room_id": entry["room_id"], "version": entry["version"]}, entry, upsert=True)
+                for entry in entries
+            ],
+            ordered=False
+        )
+
+    # Replacements go first, so an interrupted rewrite never leaves a delta
+    # whose base is gone
+    @timed(DB_SECONDS, "room_history")
+    async def rewrite_entries(
+        self,
+        room_id: str,
+        entries: List[Dict[str, Any]],
+        drop_versions: List[int]
+    ) -> None:
+        requests: List[Any] = [
+            ReplaceOne({"room_id": room_id, "version": entry["version"]}, entry, upsert=True)
+            for entry in entries
+        ]
+        if drop_versions:
+            requests.append(DeleteMany({"room_id": room_id, "version": {"$in": drop_versions}}))
+
+        if requests:
+            await self.collection.bulk_write(requests, ordered=True)
+
+    @timed(DB_SECONDS, "room_history")
+    async def latest_entry(self, room_id: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one(
+            {"room_id": room_id},
+            {"_id": 0, "data": 0},
+            sort=[("version", -1)]
+        )
+
+    @timed(DB_SECONDS, "room_history")
+    async def list_versions(
+        self,
+        room_id: str,
+        limit: int = 50,
+        before: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        query: Dict[str, Any] = {"room_id": room_id}
+        if before is not None:
+            query["version"] = {"$lt": before}
+
+        cursor = self.collection.find(query, {"_id": 0, "data": 0}).sort("version", -1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    # Newest keyframe at or below max_version, or, with created_before,
+    # the newest one recorded before that time
+    @timed(DB_SECONDS, "room_history")
+    async def find_keyframe(
+        self,
+        room_id: str,
+        max_version: Optional[int] = None,
+        created_before: Optional[datetime] = None
+    ) -> Optional[Dict[str, Any]]:
+        query: Dict[str, Any] = {"room_id": room_id, "depth": 0}
+        if max_version is not None:
+            query["version"] = {"$lte": max_version}
+        if created_before is not None:
+            query["created_at"] = {"$lt": created_before}
+
+        return await self.collection.find_one(query, {"_id": 0, "data": 0}, sort=[("version", -1)])
+
+    @timed(DB_SECONDS, "room_history")
+    async def get_entries(
+        self,
+        room_id: str,
+        min_version: int,
+        max_version: int,
+        with_data: bool = True
+    ) -> List[Dict[str, Any]]:
+        projection = {"_id": 0} if with_data else {"_id": 0, "data": 0}
+        cursor = self.collection.find(
+            {"room_id": room_id, "version": {"$gte": min_version, "$lte": max_version}},
+            projection
+        ).sort("version", 1)
+        return await cursor.to_list(length=None)
+
+    @timed(DB_SECONDS, "room_history")
+    async def delete_before(self, room_id: str, version: int) -> int:
+        result = await self.collection.delete_many({"room_id": room_id, "version": {"$lt": version}})
+        return result.deleted_count
+
+    @timed(DB_SECONDS, "room_history")
+    async def delete_room(self, room_id: str) -> int:
+        result = await self.collection.delete_many({"room_id": room_id})
+        return result.deleted_count
+
+    @timed(DB_SECONDS, "room_history")
+    async def rooms_with_entries_before(self, created_before: datetime) -> List[str]:
+        return await self.collection.distinct("room_id", {"created_at": {"$lt": created_before}})
@@ -42,6 +42,22 @@ class RoomInfo(BaseModel):
     created_at: datetime
 
 
+class HistoryVersion(BaseModel):
+    version: int
+    created_at: datetime
+    keyframe: bool
+    # Compressed bytes stored for this entry and characters in the document
+    size: int
+    length: int
+
+
+class RoomVersion(BaseModel):
+    room_id: str
+    version: int
+    code: str
+    created_at: datetime
+
+
 class CursorUpdate(BaseModel):
     user_id: str
     username: str
@@ -60,12 +76,35 @@ class CodeExecutionRequest(BaseModel):
     code: str
     language: Language
     input: Optional[str] = ""
+    room_id: Optional[str] = None
+    user_id: Optional[str] = None
+    cache: bool = False
+
+
+class ResourceUsage(BaseModel):
+    cpu_user_ms: float
+    cpu_system_ms: float
+    max_rss_kb: int
 
 
 class CodeExecutionResponse(BaseModel):
     output: str
     error: Optional[str] = None
     execution_time: float
+    # Milliseconds per phase: write, compile, spawn, run, decode
+    phases: Dict[str, float] = {}
+    compile_cached: Optional[bool] = None
+    exit_code: Optional[int] = None
+    truncated: bool = False
+    streamed: bool = False
+    limit_exceeded: Optional[str] = None
+    usage: Optional[ResourceUsage] = None
+    cached: bool = False
+
+
+class ProfilerConfig(BaseModel):
+    # 0 turns the slow handler profiler off
+    threshold_ms: float = Field(..., ge=0)
 
 
 class WebSocketMessage(BaseModel):
@@ -0,0 +1,42 @@
+from typing import Dict, Any
+from fastapi import APIRouter, Depends, Query
+
+from app.models.schemas import ProfilerConfig
+from app.services.handler_profiler import HandlerProfiler
+from app.services.loop_monitor import LoopMonitor
+from app.dependencies import get_handler_profiler, get_loop_monitor, require_admin
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+
+@router.get("/event-loop")
+async def event_loop_report(
+    limit: int = Query(50, ge=1, le=1000),
+    monitor: LoopMonitor = Depends(get_loop_monitor),
+    profiler: HandlerProfiler = Depends(get_handler_profiler)
+) -> Dict[str, Any]:
+    entries = list(profiler.entries)
+
+    return {
+        "event_loop": monitor.stats(),
+        "profiler": profiler.stats(),
+        "rooms": profiler.slowest_rooms(),
+        "slow_handlers": entries[-limit:][::-1]
+    }
+
+
+@router.put("/event-loop/profiler")
+async def configure_profiler(
+    config: ProfilerConfig,
+    profiler: HandlerProfiler = Depends(get_handler_profiler)
+) -> Dict[str, Any]:
+    profiler.configure(config.threshold_ms)
+    return profiler.stats()
+
+
+@router.delete("/event-loop/profiler/entries")
+async def clear_profiler_entries(
+    profiler: HandlerProfiler = Depends(get_handler_profiler)
+) -> Dict[str, Any]:
+    profiler.entries.clear()
+    return profiler.stats()
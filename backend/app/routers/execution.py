@@ -1,12 +1,14 @@
 import logging
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 
 from app.models.schemas import (
     CodeExecutionRequest,
     CodeExecutionResponse
 )
-from app.services.execution_service import ExecutionService, execution_service
-from app.dependencies import get_execution_service
+from app.services.execution_scheduler import (
+    ExecutionJob, ExecutionScheduler, QueueFullError
+)
+from app.dependencies import get_execution_scheduler
 
 logger = logging.getLogger(__name__)
 
@@ -16,18 +18,24 @@ router = APIRouter(prefix="/run", tags=["execution"])
 @router.post("", response_model=CodeExecutionResponse)
 async def run_code(
     request: CodeExecutionRequest,
-    exec_service: ExecutionService = Depends(get_execution_service)
+    http_request: Request,
+    scheduler: ExecutionScheduler = Depends(get_execution_scheduler)
 ) -> CodeExecutionResponse:
     logger.info(f"Executing {request.language} code")
 
-    output, error, execution_time = await exec_service.execute(
-        code=request.code,
-        language=request.language,
-        input_data=request.input or ""
-    )
+    user_id = request.user_id or (http_request.client.host if http_request.client else "anonymous")
 
-    return CodeExecutionResponse(
-        output=output,
-        error=error,
-        execution_time=execution_time
-    )
+    try:
+        return await scheduler.submit(
+            code=request.code,
+            language=request.language,
+            input_data=request.input or "",
+            job=ExecutionJob(request.room_id, user_id),
+            cache=request.cache
+        )
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": "1"}
+        )
@@ -1,18 +1,28 @@
 import uuid
 import logging
-from typing import List
+from typing import List, Optional
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 
 from app.models.schemas import (
     RoomCreate,
     RoomResponse,
     RoomInfo,
+    HistoryVersion,
+    RoomVersion,
     Language
 )
-from app.models.database import RoomRepository
+from app.models.database import RoomRepository, HistoryRepository
 from app.services.connection_manager import ConnectionManager, manager
-from app.dependencies import get_room_repository, get_connection_manager
+from app.services.document_store import DocumentStore
+from app.services.history_service import HistoryService
+from app.dependencies import (
+    get_room_repository,
+    get_connection_manager,
+    get_document_store,
+    get_history_repository,
+    get_history_service
+)
 
 logger = logging.getLogger(__name__)
 
@@ -73,9 +83,11 @@ async def list_rooms(
 async def get_room(
     room_id: str,
     room_repo: RoomRepository = Depends(get_room_repository),
-    conn_manager: ConnectionManager = Depends(get_connection_manager)
+    conn_manager: ConnectionManager = Depends(get_connection_manager),
+    store: DocumentStore = Depends(get_document_store)
 ) -> RoomResponse:
-    room = await room_repo.get_room(room_id)
+    doc = store.get(room_id)
+    room = doc.to_room() if doc else await room_repo.get_room(room_id)
 
     if not room:
         raise HTTPException(
@@ -108,10 +120,56 @@ async def get_room(
     )
 
 
+@router.get("/{room_id}/history", response_model=List[HistoryVersion])
+async def list_room_versions(
+    room_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[int] = None,
+    history_repo: HistoryRepository = Depends(get_history_repository),
+    history: HistoryService = Depends(get_history_service)
+) -> List[HistoryVersion]:
+    entries = await history.list_versions(history_repo, room_id, limit, before)
+
+    return [
+        HistoryVersion(
+            version=entry["version"],
+            created_at=entry["created_at"],
+            keyframe=not entry["depth"],
+            size=entry["size"],
+            length=entry["length"]
+        )
+        for entry in entries
+    ]
+
+
+@router.get("/{room_id}/history/{version}", response_model=RoomVersion)
+async def get_room_version(
+    room_id: str,
+    version: int,
+    history_repo: HistoryRepository = Depends(get_history_repository),
+    history: HistoryService = Depends(get_history_service)
+) -> RoomVersion:
+    snapshot = await history.materialize(history_repo, room_id, version)
+
+    if not snapshot:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Version {version} of room {room_id} is not in its history"
+        )
+
+    return RoomVersion(
+        room_id=room_id,
+        version=snapshot["version"],
+        code=snapshot["code"],
+        created_at=snapshot["created_at"]
+    )
+
+
 @router.delete("/{room_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_room(
     room_id: str,
     room_repo: RoomRepository = Depends(get_room_repository),
+    history_repo: HistoryRepository = Depends(get_history_repository),
     conn_manager: ConnectionManager = Depends(get_connection_manager)
 ) -> None:
     active_users = await conn_manager.get_room_users(room_id)
@@ -130,4 +188,6 @@ async def delete_room(
             detail=f"Room {room_id} not found"
         )
 
+    await history_repo.delete_room(room_id)
+
     logger.info(f"Deleted room: {room_id}")
@@ -1,19 +1,45 @@
-import json
+import asyncio
 import logging
-from typing import Dict, Any, Optional
-from datetime import datetime
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
+from typing import Dict, Any, Optional, Set
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
 
 from app.models.schemas import Language
 from app.services.connection_manager import ConnectionManager
-from app.services.sync_service import SyncService
-from app.services.execution_service import ExecutionService
-from app.dependencies import get_sync_service, get_execution_service, get_connection_manager
+from app.services.room_cluster import RoomCluster
+from app.services.execution_output import OutputStream
+from app.services.execution_scheduler import ExecutionJob, ExecutionScheduler, QueueFullError
+from app.services.handler_profiler import HandlerProfiler
+from app.services.metrics import metrics
+from app.services.presence_service import PresenceService
+from app.services.wire_format import Frame, FrameError, envelope, negotiate
+from app.dependencies import (
+    get_room_cluster, get_execution_scheduler, get_connection_manager, get_presence_service,
+    get_handler_profiler
+)
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+EDIT_FORMATS = ("patch", "ops")
+MESSAGE_TYPES = ("diff", "ops", "cursor", "sync", "run")
+
+# Function each message type is handled in, as the profiler reports it and
+# looks for on the stack. Runs go to a task and edits to the room's edit
+# queue, so only their dispatch is timed.
+HANDLERS = {
+    "diff": "_handle_diff",
+    "ops": "_handle_ops",
+    "cursor": "_handle_cursor",
+    "sync": "_send_sync"
+}
+
+MESSAGES_IN = metrics.counter(
+    "codestream_ws_messages_in_total",
+    "Messages received from WebSocket clients by type",
+    ("type",)
+)
+
 
 @router.websocket("/ws/{room_id}")
 async def websocket_endpoint(
@@ -21,94 +47,132 @@ async def websocket_endpoint(
     room_id: str,
     user_id: str,
     username: str,
-    sync_service: SyncService = Depends(get_sync_service),
-    exec_service: ExecutionService = Depends(get_execution_service),
-    conn_manager: ConnectionManager = Depends(get_connection_manager)
+    last_version: Optional[int] = None,
+    edit_format: str = Query("patch", alias="format"),
+    encoding: str = "json",
+    compress: bool = False,
+    cluster: RoomCluster = Depends(get_room_cluster),
+    scheduler: ExecutionScheduler = Depends(get_execution_scheduler),
+    conn_manager: ConnectionManager = Depends(get_connection_manager),
+    presence: PresenceService = Depends(get_presence_service),
+    profiler: HandlerProfiler = Depends(get_handler_profiler)
 ):
-    await conn_manager.connect(websocket, room_id, user_id, username)
+    if edit_format not in EDIT_FORMATS:
+        edit_format = "patch"
+
+    wire = negotiate(encoding, compress)
+    await conn_manager.connect(websocket, room_id, user_id, username, edit_format, wire)
 
     user_info = conn_manager.connection_users.get(websocket, {})
     user_color = user_info.get("color", "#3B82F6")
+    document_opened = False
+    run_tasks: Set[asyncio.Task] = set()
 
     try:
-        doc_state = await sync_service.full_sync(room_id)
+        await cluster.join(room_id)
+        document_opened = True
 
-        await websocket.send_text(json.dumps({
-            "type": "sync",
-            "payload": {
-                "code": doc_state["code"],
-                "version": doc_state.get("version", 1),
-                "language": doc_state.get("language", "python"),
-                "name": doc_state.get("name", "")
-            },
-            "timestamp": datetime.utcnow().isoformat()
-        }))
+        with profiler.track("_send_sync", room_id, user_id, 0):
+            version = await _send_sync(
+                websocket, room_id, cluster, conn_manager, last_version, edit_format
+            )
 
-        await conn_manager.update_version(room_id, doc_state.get("version", 1))
+        await conn_manager.update_version(room_id, version)
 
         while True:
-            data = await websocket.receive_text()
+            data = await _receive_frame(websocket)
 
             try:
-                message = json.loads(data)
+                message = wire.decode(data)
                 msg_type = message.get("type")
                 payload = message.get("payload", {})
 
                 logger.debug(f"Received {msg_type} from {user_id}")
-
-                if msg_type == "diff":
-                    await _handle_diff(
-                        payload, user_id, room_id,
-                        sync_service, conn_manager
-                    )
-
-                elif msg_type == "cursor":
-                    await _handle_cursor(
-                        payload, user_id, username, user_color,
-                        room_id, conn_manager
-                    )
-
-                elif msg_type == "sync":
-                    doc_state = await sync_service.full_sync(room_id)
-                    await websocket.send_text(json.dumps({
-                        "type": "sync",
-                        "payload": doc_state,
-                        "timestamp": datetime.utcnow().isoformat()
-                    }))
-
-                elif msg_type == "run":
-                    await _handle_execution(
-                        payload, room_id, websocket,
-                        exec_service, conn_manager
-                    )
-
-                else:
-                    logger.warning(f"Unknown message type: {msg_type}")
-
-            except json.JSONDecodeError:
-                logger.error("Invalid JSON received")
+                MESSAGES_IN.inc(msg_type if msg_type in MESSAGE_TYPES else "unknown")
+
+                with profiler.track(
+                    HANDLERS.get(msg_type, "websocket_endpoint"), room_id, user_id, len(data)
+                ):
+                    if msg_type == "diff":
+                        _handle_diff(payload, user_id, room_id, cluster)
+
+                    elif msg_type == "ops":
+                        _handle_ops(payload, user_id, room_id, cluster)
+
+                    elif msg_type == "cursor":
+                        _handle_cursor(
+                            payload, user_id, username, user_color,
+                            room_id, presence
+                        )
+
+                    elif msg_type == "sync":
+                        await _send_sync(
+                            websocket, room_id, cluster, conn_manager,
+                            payload.get("last_version"), edit_format
+                        )
+
+                    elif msg_type == "run":
+                        # Runs can wait in the scheduler's queue, so they must not
+                        # hold up edits arriving on this socket
+                        task = asyncio.create_task(_handle_execution(
+                            payload, room_id, user_id, websocket,
+                            scheduler, conn_manager
+                        ))
+                        run_tasks.add(task)
+                        task.add_done_callback(run_tasks.discard)
+
+                    else:
+                        logger.warning(f"Unknown message type: {msg_type}")
+
+            except FrameError as e:
+                logger.error(f"Invalid frame received: {e}")
             except Exception as e:
                 logger.error(f"Error handling message: {e}")
-                await websocket.send_text(json.dumps({
-                    "type": "error",
-                    "payload": {"error": str(e)},
-                    "timestamp": datetime.utcnow().isoformat()
-                }))
+                await conn_manager.send(websocket, envelope("error", {"error": str(e)}))
 
     except WebSocketDisconnect:
         logger.info(f"WebSocket disconnected: {user_id}")
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
     finally:
+        for task in list(run_tasks):
+            task.cancel()
         await conn_manager.disconnect(websocket)
+        if document_opened:
+            await cluster.leave(room_id)
+
+
+async def _receive_frame(websocket: WebSocket) -> Frame:
+    message = await websocket.receive()
 
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
 
-async def _handle_diff(
+    if message.get("text") is not None:
+        return message["text"]
+    return message.get("bytes") or b""
+
+
+async def _send_sync(
+    websocket: WebSocket,
+    room_id: str,
+    cluster: RoomCluster,
+    conn_manager: ConnectionManager,
+    last_version: Optional[int] = None,
+    edit_format: str = "patch"
+) -> int:
+    message = await cluster.sync_message(room_id, last_version, edit_format)
+    await conn_manager.send(websocket, message)
+    return message["payload"]["version"]
+
+
+# Edits only join the room's edit queue here, so the socket goes straight
+# back to reading and a burst is applied, broadcast and acked as one batch
+def _handle_diff(
     payload: Dict[str, Any],
     user_id: str,
     room_id: str,
-    sync_service: SyncService,
-    conn_manager: ConnectionManager
+    cluster: RoomCluster
 ):
     diff = payload.get("diff")
     user_version = payload.get("version", 1)
@@ -116,36 +180,36 @@ async def _handle_diff(
     if not diff:
         return
 
-    success, new_version, new_code = await sync_service.apply_user_diff(
-        room_id, diff, user_version, user_id
-    )
+    cluster.submit_edit(room_id, user_id, user_version, diff=diff)
 
-    if success:
-        await conn_manager.update_version(room_id, new_version)
 
-        await conn_manager.broadcast_diff(
-            room_id, diff, user_id, new_version
-        )
+def _handle_ops(
+    payload: Dict[str, Any],
+    user_id: str,
+    room_id: str,
+    cluster: RoomCluster
+):
+    ops = payload.get("ops")
+    user_version = payload.get("version", 1)
+
+    if not ops:
+        return
 
-        await conn_manager.send_personal_message(user_id, {
-            "type": "ack",
-            "payload": {"version": new_version},
-            "timestamp": datetime.utcnow().isoformat()
-        })
+    cluster.submit_edit(room_id, user_id, user_version, ops=ops)
 
 
-async def _handle_cursor(
+def _handle_cursor(
     payload: Dict[str, Any],
     user_id: str,
     username: str,
     user_color: str,
     room_id: str,
-    conn_manager: ConnectionManager
+    presence: PresenceService
 ):
     position = payload.get("position", {"line": 1, "column": 1})
     selection = payload.get("selection")
 
-    await conn_manager.broadcast_cursor(
+    presence.update_cursor(
         room_id, user_id, username, user_color, position, selection
     )
 
@@ -153,8 +217,9 @@ async def _handle_cursor(
 async def _handle_execution(
     payload: Dict[str, Any],
     room_id: str,
+    user_id: str,
     websocket: WebSocket,
-    exec_service: ExecutionService,
+    scheduler: ExecutionScheduler,
     conn_manager: ConnectionManager
 ):
     code = payload.get("code", "")
@@ -164,23 +229,33 @@ async def _handle_execution(
     try:
         language = Language(language_str)
     except ValueError:
-        await websocket.send_text(json.dumps({
-            "type": "execution_result",
-            "payload": {"error": f"Unsupported language: {language_str}"},
-            "timestamp": datetime.utcnow().isoformat()
-        }))
+        await conn_manager.send(websocket, envelope(
+            "execution_result", {"error": f"Unsupported language: {language_str}"}
+        ))
         return
 
-    output, error, exec_time = await exec_service.execute(
-        code, language, input_data
-    )
+    job = ExecutionJob(room_id, user_id)
+    stream = OutputStream(lambda frame: conn_manager.send(websocket, frame), job.job_id)
 
-    await websocket.send_text(json.dumps({
-        "type": "execution_result",
-        "payload": {
-            "output": output,
-            "error": error,
-            "execution_time": exec_time
-        },
-        "timestamp": datetime.utcnow().isoformat()
+    try:
+        result = await scheduler.submit(
+            code, language, input_data,
+            job=job,
+            on_output=stream.write,
+            cache=bool(payload.get("cache", False))
+        )
+    except QueueFullError as e:
+        await conn_manager.send(websocket, envelope(
+            "execution_result", {"job_id": job.job_id, "error": str(e), "status": 429}
+        ))
+        return
+    finally:
+        await stream.close()
+
+    # Output and stderr already went out as execution_output frames; error
+    # here only carries what the run itself reported (timeout, truncation)
+    await conn_manager.send(websocket, envelope("execution_result", {
+        "job_id": job.job_id,
+        "output_frames": stream.seq,
+        **result.model_dump()
     }))
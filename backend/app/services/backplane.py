@@ -0,0 +1,302 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, Any, Optional, Callable, Awaitable, Set, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+RequestHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class Backplane(ABC):
+    def __init__(self, node_id: Optional[str] = None):
+        self.node_id = node_id or settings.node_id or default_node_id()
+        self._handlers: Dict[str, Handler] = {}
+        self._replies: Dict[str, asyncio.Future] = {}
+        self._request_handler: Optional[RequestHandler] = None
+        self._request_tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def node_channel(node_id: str) -> str:
+        return f"node:{node_id}"
+
+    async def start(self) -> None:
+        await self.subscribe(self.node_channel(self.node_id), self._on_node_message)
+
+    async def stop(self) -> None:
+        for task in list(self._request_tasks):
+            task.cancel()
+        for future in self._replies.values():
+            future.cancel()
+        self._replies.clear()
+
+    @abstractmethod
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    async def _subscribe(self, channel: str) -> None:
+        ...
+
+    @abstractmethod
+    async def _unsubscribe(self, channel: str) -> None:
+        ...
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        self._handlers[channel] = handler
+        await self._subscribe(channel)
+
+    async def unsubscribe(self, channel: str) -> None:
+        if self._handlers.pop(channel, None):
+            await self._unsubscribe(channel)
+
+    async def _dispatch(self, channel: str, message: Dict[str, Any]) -> None:
+        handler = self._handlers.get(channel)
+        if handler is None:
+            return
+
+        try:
+            await handler(message)
+        except Exception as e:
+            logger.error(f"Backplane handler for {channel} failed: {e}")
+
+    # Leases name the single node allowed to act for a key, such as the
+    # sequencer of a room. They expire unless renewed within ttl seconds.
+    @abstractmethod
+    async def claim(self, key: str, ttl: float) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def renew(self, key: str, ttl: float) -> bool:
+        ...
+
+    @abstractmethod
+    async def release(self, key: str) -> None:
+        ...
+
+    def on_request(self, handler: RequestHandler) -> None:
+        self._request_handler = handler
+
+    async def request(self, node_id: str, payload: Dict[str, Any], timeout: float) -> Any:
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._replies[request_id] = future
+
+        try:
+            await self.publish(self.node_channel(node_id), {
+                "request_id": request_id,
+                "reply_to": self.node_id,
+                "payload": payload
+            })
+            return await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            self._replies.pop(request_id, None)
+
+    async def _on_node_message(self, message: Dict[str, Any]) -> None:
+        request_id = message.get("request_id")
+
+        if "result" in message or "error" in message:
+            future = self._replies.get(request_id)
+            if future and not future.done():
+                if "error" in message:
+                    future.set_exception(RuntimeError(message["error"]))
+                else:
+                    future.set_result(message["result"])
+            return
+
+        # Requests run concurrently so a slow one can't hold up the channel;
+        # callers that need ordering wait for each reply before sending more
+        task = asyncio.create_task(self._serve_request(message))
+        self._request_tasks.add(task)
+        task.add_done_callback(self._request_tasks.discard)
+
+    async def _serve_request(self, message: Dict[str, Any]) -> None:
+        reply: Dict[str, Any] = {"request_id": message.get("request_id")}
+
+        try:
+            if self._request_handler is None:
+                raise RuntimeError("Node does not serve requests")
+            reply["result"] = await self._request_handler(message.get("payload", {}))
+        except Exception as e:
+            reply["error"] = str(e)
+
+        await self.publish(self.node_channel(message["reply_to"]), reply)
+
+
+class InProcessBroker:
+    def __init__(self):
+        self.subscribers: Dict[str, Set["InProcessBackplane"]] = {}
+        self.leases: Dict[str, Tuple[str, float]] = {}
+
+    def lease_owner(self, key: str) -> Optional[str]:
+        lease = self.leases.get(key)
+        if lease is None or lease[1] <= time.monotonic():
+            self.leases.pop(key, None)
+            return None
+        return lease[0]
+
+
+# Delivers within one process. Backplanes that share a broker behave like
+# separate nodes, which is how several workers are exercised in one process.
+class InProcessBackplane(Backplane):
+    def __init__(self, broker: Optional[InProcessBroker] = None, node_id: Optional[str] = None):
+        super().__init__(node_id)
+        self.broker = broker or InProcessBroker()
+        self._inbox: Optional[asyncio.Queue] = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._inbox = asyncio.Queue()
+        self._reader = asyncio.create_task(self._read())
+        await super().start()
+
+    async def stop(self) -> None:
+        await super().stop()
+
+        for subscribers in self.broker.subscribers.values():
+            subscribers.discard(self)
+
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        data = json.dumps(message)
+        for backplane in list(self.broker.subscribers.get(channel, ())):
+            backplane._inbox.put_nowait((channel, data))
+
+    async def _subscribe(self, channel: str) -> None:
+        self.broker.subscribers.setdefault(channel, set()).add(self)
+
+    async def _unsubscribe(self, channel: str) -> None:
+        subscribers = self.broker.subscribers.get(channel)
+        if subscribers is not None:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.broker.subscribers[channel]
+
+    async def _read(self) -> None:
+        while True:
+            channel, data = await self._inbox.get()
+            await self._dispatch(channel, json.loads(data))
+
+    async def claim(self, key: str, ttl: float) -> Optional[str]:
+        owner = self.broker.lease_owner(key)
+        if owner is None:
+            self.broker.leases[key] = (self.node_id, time.monotonic() + ttl)
+            return self.node_id
+        return owner
+
+    async def renew(self, key: str, ttl: float) -> bool:
+        if self.broker.lease_owner(key) != self.node_id:
+            return False
+        self.broker.leases[key] = (self.node_id, time.monotonic() + ttl)
+        return True
+
+    async def release(self, key: str) -> None:
+        if self.broker.lease_owner(key) == self.node_id:
+            del self.broker.leases[key]
+
+
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+# Speaks the Redis protocol, so it runs against Redis itself or any local
+# stand-in that implements PUBLISH/SUBSCRIBE, SET NX PX and EVAL.
+class RedisBackplane(Backplane):
+    def __init__(self, url: str, node_id: Optional[str] = None):
+        super().__init__(node_id)
+        self.url = url
+        self._client = None
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        import redis.asyncio as redis
+
+        self._client = redis.from_url(self.url, decode_responses=True)
+        self._pubsub = self._client.pubsub()
+        await super().start()
+        self._reader = asyncio.create_task(self._read())
+
+    async def stop(self) -> None:
+        await super().stop()
+
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+
+        if self._pubsub:
+            await self._pubsub.aclose()
+        if self._client:
+            await self._client.aclose()
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        await self._client.publish(channel, json.dumps(message))
+
+    async def _subscribe(self, channel: str) -> None:
+        await self._pubsub.subscribe(channel)
+
+    async def _unsubscribe(self, channel: str) -> None:
+        await self._pubsub.unsubscribe(channel)
+
+    async def _read(self) -> None:
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message and message["type"] == "message":
+                    await self._dispatch(message["channel"], json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Backplane read error: {e}")
+                await asyncio.sleep(1)
+
+    async def claim(self, key: str, ttl: float) -> Optional[str]:
+        if await self._client.set(key, self.node_id, nx=True, px=int(ttl * 1000)):
+            return self.node_id
+        return await self._client.get(key)
+
+    async def renew(self, key: str, ttl: float) -> bool:
+        return bool(await self._client.eval(_RENEW_SCRIPT, 1, key, self.node_id, int(ttl * 1000)))
+
+    async def release(self, key: str) -> None:
+        await self._client.eval(_RELEASE_SCRIPT, 1, key, self.node_id)
+
+
+def create_backplane() -> Backplane:
+    if settings.backplane == "redis":
+        return RedisBackplane(settings.backplane_url)
+    return InProcessBackplane()
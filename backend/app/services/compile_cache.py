@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.config import settings
+from app.services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class CompileError(Exception):
+    pass
+
+
+# The language is given explicitly so the source can be a /proc/self/fd path
+async def compile_cpp(
+    source_path: str,
+    exe_path: str,
+    flags: List[str],
+    pass_fds: Tuple[int, ...] = ()
+) -> None:
+    process = await asyncio.create_subprocess_exec(
+        "g++",
+        *flags,
+        "-o", exe_path,
+        "-x", "c++", source_path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        pass_fds=pass_fds
+    )
+
+    _, stderr = await process.communicate()
+
+    if process.returncode != 0:
+        raise CompileError(stderr.decode("utf-8", errors="replace"))
+
+
+# Content-addressed store of compiled binaries. The key covers the source,
+# the compiler build and the flags, so a binary is only reused for the exact
+# same inputs. Entries in use are pinned and never evicted.
+class CompileCache:
+    def __init__(self, directory: str, max_bytes: int, flags: List[str]):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.flags = flags
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._pins: Dict[str, int] = {}
+        self._inflight = SingleFlight()
+        self._compiler: Optional[str] = None
+        self._loaded = False
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.compile_errors = 0
+        self.total_compile_ms = 0.0
+
+    def _load(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        found: List[Tuple[float, str, int]] = []
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith("tmp-"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            found.append((stat.st_mtime, name, stat.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.total_bytes += size
+
+        self._loaded = True
+        self._evict()
+
+    async def _compiler_id(self) -> str:
+        if self._compiler is None:
+            process = await asyncio.create_subprocess_exec(
+                "g++", "--version",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            stdout, _ = await process.communicate()
+            self._compiler = stdout.decode("utf-8", errors="replace").split("\n", 1)[0]
+
+        return self._compiler
+
+    async def key_for(self, source: str) -> str:
+        digest = hashlib.sha256()
+        digest.update((await self._compiler_id()).encode())
+        digest.update(b"\0" + "\0".join(self.flags).encode() + b"\0")
+        digest.update(source.encode("utf-8"))
+        return digest.hexdigest()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    # Returns (key, path of the binary, whether it was cached). The entry is
+    # pinned until release(key); CompileError carries the compiler output.
+    async def acquire(self, source: str) -> Tuple[str, str, bool]:
+        if not self._loaded:
+            self._load()
+
+        key = await self.key_for(source)
+        path = self.path_for(key)
+        self._pins[key] = self._pins.get(key, 0) + 1
+
+        try:
+            if key in self._entries:
+                if os.path.exists(path):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return key, path, True
+                self.total_bytes -= self._entries.pop(key)
+
+            async def miss() -> None:
+                self.misses += 1
+                await self._compile(key, source)
+
+            _, shared = await self._inflight.run(key, miss)
+            if shared:
+                self.coalesced += 1
+            return key, path, shared
+        except BaseException:
+            self.release(key)
+            raise
+
+    def release(self, key: str) -> None:
+        pins = self._pins.get(key, 0) - 1
+
+        if pins > 0:
+            self._pins[key] = pins
+            return
+
+        self._pins.pop(key, None)
+        self._evict()
+
+    async def _compile(self, key: str, source: str) -> None:
+        token = uuid.uuid4().hex[:8]
+        source_path = os.path.join(self.directory, f"tmp-{token}.cpp")
+        exe_path = os.path.join(self.directory, f"tmp-{token}")
+        start = time.perf_counter()
+
+        try:
+            with open(source_path, "w", encoding="utf-8") as f:
+                f.write(source)
+
+            try:
+                await compile_cpp(source_path, exe_path, self.flags)
+            except CompileError:
+                self.compile_errors += 1
+                raise
+
+            os.replace(exe_path, self.path_for(key))
+        finally:
+            self.total_compile_ms += (time.perf_counter() - start) * 1000
+            for path in (source_path, exe_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        size = os.path.getsize(self.path_for(key))
+        self._entries[key] = size
+        self.total_bytes += size
+        self._evict()
+
+    def _evict(self) -> None:
+        for key in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key in self._pins:
+                continue
+
+            self.total_bytes -= self._entries.pop(key)
+            self.evictions += 1
+
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "compile_errors": self.compile_errors,
+            "avg_compile_ms": round(self.total_compile_ms / self.misses, 2) if self.misses else 0.0
+        }
+
+
+compile_cache = CompileCache(
+    settings.cpp_cache_dir or os.path.join(tempfile.gettempdir(), "codestream_cpp_cache"),
+    settings.cpp_cache_max_bytes,
+    settings.cpp_compile_flags
+)
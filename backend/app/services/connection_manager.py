@@ -1,15 +1,38 @@
 import asyncio
 import logging
-from typing import Dict, Set, Optional, Any, List
+from typing import Dict, Set, Optional, Any, List, Callable, Tuple
 from datetime import datetime
-import json
+import time
 import uuid
 import random
 
 from fastapi import WebSocket
 
+from app.config import settings
+from app.services import operations
+from app.services.backplane import Backplane
+from app.services.metrics import metrics
+from app.services.outbound_queue import OutboundQueue
+from app.services.wire_format import Frame, WireFormat, JSON_WIRE, envelope
+
 logger = logging.getLogger(__name__)
 
+MESSAGES_OUT = metrics.counter(
+    "codestream_ws_messages_out_total",
+    "Frames queued to WebSocket clients by message type",
+    ("type",)
+)
+FANOUT_SECONDS = metrics.histogram(
+    "codestream_broadcast_seconds",
+    "Time to build and queue one broadcast for every connection in a room",
+    ("type",)
+)
+MEMBERSHIP_FRAMES = metrics.counter(
+    "codestream_membership_frame_lookups_total",
+    "users_update and room_state frame lookups by whether the encoded frame was cached",
+    ("type", "result")
+)
+
 
 class ConnectionManager:
     CURSOR_COLORS = [
@@ -23,14 +46,41 @@ class ConnectionManager:
         self.connection_rooms: Dict[WebSocket, str] = {}
         self.connection_users: Dict[WebSocket, Dict[str, Any]] = {}
         self.user_connections: Dict[str, WebSocket] = {}
+        self.connection_formats: Dict[WebSocket, str] = {}
+        self.connection_wires: Dict[WebSocket, WireFormat] = {}
+        self.outbound: Dict[WebSocket, OutboundQueue] = {}
         self.room_versions: Dict[str, int] = {}
         self._lock = asyncio.Lock()
+        self.backplane: Optional[Backplane] = None
+        # room_id -> node_id -> (users on that node, when they were announced)
+        self.remote_users: Dict[str, Dict[str, Tuple[List[Dict[str, Any]], float]]] = {}
+        self._room_watchers: Dict[str, int] = {}
+        # room_id -> message type -> (room version, wire key -> encoded frame)
+        self._membership_frames: Dict[str, Dict[str, Tuple[int, Dict[Tuple, Frame]]]] = {}
+        self.slow_disconnects = 0
+        self.closed_dropped = 0
+        self.closed_coalesced = 0
+
+    def attach_backplane(self, backplane: Backplane) -> None:
+        self.backplane = backplane
+
+    @staticmethod
+    def room_channel(room_id: str) -> str:
+        return f"room:{room_id}"
 
     @classmethod
     def get_random_color(cls) -> str:
         return random.choice(cls.CURSOR_COLORS)
 
-    async def connect(self, websocket: WebSocket, room_id: str, user_id: str, username: str) -> bool:
+    async def connect(
+        self,
+        websocket: WebSocket,
+        room_id: str,
+        user_id: str,
+        username: str,
+        edit_format: str = "patch",
+        wire: WireFormat = JSON_WIRE
+    ) -> bool:
         await websocket.accept()
 
         async with self._lock:
@@ -53,19 +103,28 @@ class ConnectionManager:
                 "connected_at": datetime.utcnow().isoformat()
             }
             self.connection_users[websocket] = user_info
+            self.connection_formats[websocket] = edit_format
+            self.connection_wires[websocket] = wire
             self.user_connections[user_id] = websocket
+            self._membership_changed(room_id)
+
+            queue = OutboundQueue(
+                websocket,
+                settings.outbound_queue_size,
+                settings.outbound_overflow_policy,
+                settings.outbound_send_timeout
+            )
+            queue.start()
+            self.outbound[websocket] = queue
 
             logger.info(f"User {user_id} ({username}) connected to room {room_id}")
+            first_in_room = len(self.rooms[room_id]) == 1
 
-        await self.broadcast_to_room(
-            room_id,
-            {
-                "type": "user_joined",
-                "payload": user_info,
-                "timestamp": datetime.utcnow().isoformat()
-            },
-            exclude_user=user_id
-        )
+        if first_in_room:
+            await self.watch_room(room_id)
+        await self.publish_presence(room_id)
+
+        await self.broadcast_to_room(room_id, envelope("user_joined", user_info), exclude_user=user_id)
 
         await self._send_room_state(websocket, room_id)
         await self._broadcast_active_users(room_id)
@@ -95,21 +154,28 @@ class ConnectionManager:
 
         self.connection_rooms.pop(websocket, None)
         self.connection_users.pop(websocket, None)
+        self.connection_formats.pop(websocket, None)
+        self.connection_wires.pop(websocket, None)
+
+        queue = self.outbound.pop(websocket, None)
+        if queue is not None:
+            await queue.close()
+            self.slow_disconnects += queue.slow
+            self.closed_dropped += queue.dropped
+            self.closed_coalesced += queue.coalesced
 
         if user_id:
             self.user_connections.pop(user_id, None)
 
+        self._membership_changed(room_id)
+        await self.publish_presence(room_id)
+        if room_id not in self.rooms:
+            await self.unwatch_room(room_id)
+
         if user_id:
             logger.info(f"User {user_id} disconnected from room {room_id}")
 
-            await self._broadcast_message(
-                room_id,
-                {
-                    "type": "user_left",
-                    "payload": {"user_id": user_id},
-                    "timestamp": datetime.utcnow().isoformat()
-                }
-            )
+            await self._broadcast_message(room_id, envelope("user_left", {"user_id": user_id}))
 
             await self._broadcast_active_users(room_id)
 
@@ -125,28 +191,80 @@ class ConnectionManager:
         self,
         room_id: str,
         message: Dict[str, Any],
-        exclude_user: Optional[str] = None
+        exclude_user: Optional[str] = None,
+        key: Optional[str] = None,
+        publish: bool = True
     ) -> None:
+        if publish:
+            await self._publish(room_id, {
+                "event": "message",
+                "message": message,
+                "exclude_user": exclude_user,
+                "key": key
+            })
+
         if room_id not in self.rooms:
             return
 
-        message_str = json.dumps(message)
-        disconnected = []
+        frames: Dict[Tuple, Frame] = {}
+
+        def frame_for(websocket: WebSocket) -> Frame:
+            wire = self.connection_wires.get(websocket, JSON_WIRE)
+            if wire.key not in frames:
+                frames[wire.key] = wire.encode(message)
+            return frames[wire.key]
+
+        await self._send_to_room(
+            room_id, message.get("type", "unknown"), frame_for, exclude_user, key
+        )
 
-        for websocket in self.rooms[room_id]:
+    # Frames are queued on each connection and written by its own task, so a
+    # slow socket never holds up the rest of the room or the caller.
+    async def _send_to_room(
+        self,
+        room_id: str,
+        message_type: str,
+        frame_for: Callable[[WebSocket], Optional[Frame]],
+        exclude_user: Optional[str] = None,
+        key: Optional[str] = None
+    ) -> None:
+        start = time.perf_counter()
+        queued = 0
+
+        for websocket in list(self.rooms.get(room_id, ())):
             user_info = self.connection_users.get(websocket, {})
 
             if exclude_user and user_info.get("user_id") == exclude_user:
                 continue
 
-            try:
-                await websocket.send_text(message_str)
-            except Exception as e:
-                logger.error(f"Error sending message: {e}")
-                disconnected.append(websocket)
+            frame = frame_for(websocket)
+            if frame is None:
+                continue
+
+            queue = self.outbound.get(websocket)
+            if queue is not None and queue.put(frame, key):
+                queued += 1
 
-        for ws in disconnected:
-            await self._remove_connection(ws, room_id)
+        MESSAGES_OUT.inc(message_type, amount=queued)
+        FANOUT_SECONDS.observe(time.perf_counter() - start, message_type)
+
+    async def send(self, websocket: WebSocket, message: Dict[str, Any]) -> bool:
+        if websocket not in self.outbound:
+            return False
+
+        return self._queue_frame(
+            websocket, message.get("type", "unknown"),
+            self.connection_wires.get(websocket, JSON_WIRE).encode(message)
+        )
+
+    def _queue_frame(self, websocket: WebSocket, message_type: str, frame: Frame) -> bool:
+        queue = self.outbound.get(websocket)
+
+        if queue is None:
+            return False
+
+        MESSAGES_OUT.inc(message_type)
+        return queue.put(frame)
 
     async def send_personal_message(self, user_id: str, message: Dict[str, Any]) -> bool:
         websocket = self.user_connections.get(user_id)
@@ -154,56 +272,122 @@ class ConnectionManager:
         if not websocket:
             return False
 
-        try:
-            await websocket.send_text(json.dumps(message))
-            return True
-        except Exception as e:
-            logger.error(f"Error sending personal message: {e}")
-            return False
+        return await self.send(websocket, message)
+
+    def has_format(self, room_id: str, edit_format: str) -> bool:
+        return any(
+            self.connection_formats.get(ws) == edit_format
+            for ws in self.rooms.get(room_id, ())
+        )
 
     async def broadcast_diff(
         self,
         room_id: str,
-        diff: str,
+        diff: Optional[str],
         user_id: str,
-        version: int
+        version: int,
+        ops: Optional[operations.Operation] = None,
+        publish: bool = True
     ) -> None:
-        await self._broadcast_message(
-            room_id,
-            {
-                "type": "diff",
-                "payload": {
-                    "diff": diff,
-                    "user_id": user_id,
-                    "version": version
-                },
-                "timestamp": datetime.utcnow().isoformat()
-            }
-        )
+        if publish:
+            await self._publish(room_id, {
+                "event": "diff",
+                "diff": diff,
+                "ops": operations.to_wire(ops) if ops is not None else None,
+                "user_id": user_id,
+                "version": version
+            })
+
+        if room_id not in self.rooms:
+            return
+
+        frames: Dict[Tuple, Optional[Frame]] = {}
+
+        def frame_for(websocket: WebSocket) -> Optional[Frame]:
+            edit_format = "ops" if ops is not None and self.connection_formats.get(websocket) == "ops" else "patch"
+            wire = self.connection_wires.get(websocket, JSON_WIRE)
+            frame_key = (edit_format,) + wire.key
+
+            if frame_key not in frames:
+                if edit_format == "ops":
+                    payload = {"ops": operations.to_wire(ops), "user_id": user_id, "version": version}
+                elif diff is not None:
+                    payload = {"diff": diff, "user_id": user_id, "version": version}
+                else:
+                    # Joined after the edit was applied; its sync already has it
+                    frames[frame_key] = None
+                    return None
+
+                frames[frame_key] = wire.encode(envelope("ops" if edit_format == "ops" else "diff", payload))
+
+            return frames[frame_key]
+
+        await self._send_to_room(room_id, "ops" if ops is not None else "diff", frame_for)
 
-    async def broadcast_cursor(
+    # A batch of edits applied together, as one frame carrying the version
+    # range; entries are {"user_id", "version", "diff", "ops"} in version
+    # order. A batch of one goes out as the usual diff or ops frame.
+    async def broadcast_edits(
         self,
         room_id: str,
-        user_id: str,
-        username: str,
-        color: str,
-        position: Dict[str, int],
-        selection: Optional[Dict[str, Any]] = None
+        entries: List[Dict[str, Any]],
+        publish: bool = True
     ) -> None:
-        await self._broadcast_message(
-            room_id,
-            {
-                "type": "cursor",
-                "payload": {
-                    "user_id": user_id,
-                    "username": username,
-                    "color": color,
-                    "position": position,
-                    "selection": selection
-                },
-                "timestamp": datetime.utcnow().isoformat()
-            }
-        )
+        if len(entries) == 1:
+            entry = entries[0]
+            await self.broadcast_diff(
+                room_id, entry["diff"], entry["user_id"], entry["version"], ops=entry["ops"], publish=publish
+            )
+            return
+
+        if publish:
+            await self._publish(room_id, {
+                "event": "edits",
+                "edits": [
+                    {**entry, "ops": operations.to_wire(entry["ops"]) if entry["ops"] is not None else None}
+                    for entry in entries
+                ]
+            })
+
+        if room_id not in self.rooms:
+            return
+
+        frames: Dict[Tuple, Optional[Frame]] = {}
+        has_ops = all(entry["ops"] is not None for entry in entries)
+
+        def frame_for(websocket: WebSocket) -> Optional[Frame]:
+            edit_format = "ops" if has_ops and self.connection_formats.get(websocket) == "ops" else "patch"
+            wire = self.connection_wires.get(websocket, JSON_WIRE)
+            frame_key = (edit_format,) + wire.key
+
+            if frame_key not in frames:
+                if edit_format == "ops":
+                    diffs = [
+                        {"version": e["version"], "ops": operations.to_wire(e["ops"]), "user_id": e["user_id"]}
+                        for e in entries
+                    ]
+                elif all(entry["diff"] is not None for entry in entries):
+                    diffs = [
+                        {"version": e["version"], "diff": e["diff"], "user_id": e["user_id"]}
+                        for e in entries
+                    ]
+                else:
+                    frames[frame_key] = None
+                    return None
+
+                # Same shape as a catchup
+                frames[frame_key] = wire.encode(envelope("edits", {
+                    "from_version": entries[0]["version"] - 1,
+                    "version": entries[-1]["version"],
+                    "diffs": diffs
+                }))
+
+            return frames[frame_key]
+
+        await self._send_to_room(room_id, "edits", frame_for)
+
+    async def broadcast_cursors(self, room_id: str, cursors: List[Dict[str, Any]]) -> None:
+        await self._broadcast_message(room_id, envelope("cursors", {"cursors": cursors}), key="cursors")
 
     async def update_version(self, room_id: str, version: int) -> None:
         async with self._lock:
@@ -213,6 +397,17 @@ class ConnectionManager:
         return self.room_versions.get(room_id, 1)
 
     async def get_room_users(self, room_id: str) -> List[Dict[str, Any]]:
+        return self._room_users(room_id)
+
+    def _room_users(self, room_id: str) -> List[Dict[str, Any]]:
+        users = self._local_users(room_id)
+
+        for node_users in self._live_remote_users(room_id):
+            users.extend(node_users)
+
+        return users
+
+    def _local_users(self, room_id: str) -> List[Dict[str, Any]]:
         users = []
 
         if room_id in self.rooms:
@@ -223,31 +418,191 @@ class ConnectionManager:
 
         return users
 
+    def _live_remote_users(self, room_id: str) -> List[List[Dict[str, Any]]]:
+        nodes = self.remote_users.get(room_id, {})
+        cutoff = time.monotonic() - settings.room_lease_ttl
+
+        for node_id, (_, seen_at) in list(nodes.items()):
+            if seen_at < cutoff:
+                del nodes[node_id]
+                self._membership_changed(room_id)
+
+        return [users for users, _ in nodes.values()]
+
+    # A node listens to a room's channel while it has sockets there or owns
+    # the room, whichever lasts longer
+    async def watch_room(self, room_id: str) -> None:
+        self._room_watchers[room_id] = self._room_watchers.get(room_id, 0) + 1
+
+        if self.backplane and self._room_watchers[room_id] == 1:
+            await self.backplane.subscribe(
+                self.room_channel(room_id),
+                lambda event: self._on_room_event(room_id, event)
+            )
+            await self._publish(room_id, {"event": "presence_query"}, force=True)
+
+    async def unwatch_room(self, room_id: str) -> None:
+        watchers = self._room_watchers.get(room_id, 0) - 1
+
+        if watchers > 0:
+            self._room_watchers[room_id] = watchers
+            return
+
+        self._room_watchers.pop(room_id, None)
+        self.remote_users.pop(room_id, None)
+        self._membership_frames.pop(room_id, None)
+
+        if self.backplane:
+            await self.backplane.unsubscribe(self.room_channel(room_id))
+
+    def has_remote_users(self, room_id: str) -> bool:
+        return bool(self._live_remote_users(room_id))
+
+    # Other nodes only hear about rooms where they announced users, so a
+    # single node never pays for publishing
+    async def _publish(self, room_id: str, event: Dict[str, Any], force: bool = False) -> None:
+        if self.backplane is None or not (force or self.remote_users.get(room_id)):
+            return
+
+        event["origin"] = self.backplane.node_id
+
+        try:
+            await self.backplane.publish(self.room_channel(room_id), event)
+        except Exception as e:
+            logger.error(f"Failed to publish {event['event']} for room {room_id}: {e}")
+
+    async def publish_presence(self, room_id: str) -> None:
+        await self._publish(room_id, {"event": "presence", "users": self._local_users(room_id)}, force=True)
+
+    async def _on_room_event(self, room_id: str, event: Dict[str, Any]) -> None:
+        origin = event.get("origin")
+        if origin == self.backplane.node_id:
+            return
+
+        kind = event.get("event")
+
+        if kind == "message":
+            await self._broadcast_message(
+                room_id, event["message"], event.get("exclude_user"), event.get("key"), publish=False
+            )
+        elif kind == "diff":
+            ops = operations.from_wire(event["ops"]) if event.get("ops") is not None else None
+            if room_id in self.rooms:
+                self.room_versions[room_id] = event["version"]
+            await self.broadcast_diff(
+                room_id, event.get("diff"), event["user_id"], event["version"], ops=ops, publish=False
+            )
+        elif kind == "edits":
+            entries = [
+                {**entry, "ops": operations.from_wire(entry["ops"]) if entry.get("ops") is not None else None}
+                for entry in event["edits"]
+            ]
+            if room_id in self.rooms:
+                self.room_versions[room_id] = entries[-1]["version"]
+            await self.broadcast_edits(room_id, entries, publish=False)
+        elif kind == "presence":
+            nodes = self.remote_users.setdefault(room_id, {})
+            previous = nodes.get(origin, ([], 0.0))[0]
+
+            if event.get("users"):
+                nodes[origin] = (event["users"], time.monotonic())
+            else:
+                nodes.pop(origin, None)
+
+            if event.get("users", []) != previous:
+                self._membership_changed(room_id)
+                await self._broadcast_active_users(room_id)
+        elif kind == "presence_query":
+            await self.publish_presence(room_id)
+
+    def _membership_changed(self, room_id: str) -> None:
+        self._membership_frames.pop(room_id, None)
+
+    # users_update and room_state only change when someone joins or leaves
+    # (room_state also with the version), so each is encoded once per wire
+    # format and reused until then. Their timestamp is when the user list
+    # last changed.
+    def _membership_frame(
+        self,
+        websocket: WebSocket,
+        room_id: str,
+        message_type: str,
+        version: int,
+        build: Callable[[], Dict[str, Any]]
+    ) -> Frame:
+        frames = self._membership_frames.setdefault(room_id, {})
+        cached_version, encoded = frames.get(message_type, (version, {}))
+        if cached_version != version:
+            encoded = {}
+        frames[message_type] = (version, encoded)
+
+        wire = self.connection_wires.get(websocket, JSON_WIRE)
+        frame = encoded.get(wire.key)
+
+        if frame is None:
+            MEMBERSHIP_FRAMES.inc(message_type, "miss")
+            frame = encoded[wire.key] = wire.encode(build())
+        else:
+            MEMBERSHIP_FRAMES.inc(message_type, "hit")
+
+        return frame
+
     async def _send_room_state(self, websocket: WebSocket, room_id: str) -> None:
-        users = await self.get_room_users(room_id)
+        # Expires remote nodes that went quiet, dropping cached frames that list them
+        self._live_remote_users(room_id)
         version = self.get_version(room_id)
 
-        await websocket.send_text(json.dumps({
-            "type": "room_state",
-            "payload": {
-                "room_id": room_id,
-                "users": users,
-                "version": version
-            },
-            "timestamp": datetime.utcnow().isoformat()
+        frame = self._membership_frame(websocket, room_id, "room_state", version, lambda: envelope("room_state", {
+            "room_id": room_id,
+            "users": self._room_users(room_id),
+            "version": version
         }))
+        self._queue_frame(websocket, "room_state", frame)
 
+    # Each node builds the user list from its own sockets plus the presence
+    # other nodes announce, so the list itself is never published
     async def _broadcast_active_users(self, room_id: str) -> None:
-        users = await self.get_room_users(room_id)
+        if room_id not in self.rooms:
+            return
 
-        await self._broadcast_message(
+        self._live_remote_users(room_id)
+        await self._send_to_room(
             room_id,
-            {
-                "type": "users_update",
-                "payload": {"users": users},
-                "timestamp": datetime.utcnow().isoformat()
-            }
+            "users_update",
+            lambda websocket: self._membership_frame(
+                websocket, room_id, "users_update", 0,
+                lambda: envelope("users_update", {"users": self._room_users(room_id)})
+            ),
+            key="users"
         )
 
+    def outbound_stats(self) -> Dict[str, Any]:
+        connections = []
+
+        for websocket, queue in list(self.outbound.items()):
+            user_info = self.connection_users.get(websocket, {})
+            connections.append({
+                "user_id": user_info.get("user_id"),
+                "room_id": self.connection_rooms.get(websocket),
+                **queue.stats()
+            })
+
+        return {
+            "policy": settings.outbound_overflow_policy,
+            "queued_frames": sum(c["depth"] for c in connections),
+            "max_depth": max((c["max_depth"] for c in connections), default=0),
+            "dropped": self.closed_dropped + sum(c["dropped"] for c in connections),
+            "coalesced": self.closed_coalesced + sum(c["coalesced"] for c in connections),
+            "slow_disconnects": self.slow_disconnects,
+            "connections": connections
+        }
+
 
 manager = ConnectionManager()
+
+metrics.gauge(
+    "codestream_room_connections",
+    "Open WebSocket connections per room on this node",
+    ("room_id",),
+    lambda: {(room_id,): len(sockets) for room_id, sockets in manager.rooms.items()}
+)
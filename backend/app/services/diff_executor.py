@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from diff_match_patch import patch_obj
+
+from app.config import settings
+from app.services import operations
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MODES = ("inline", "thread", "process")
+
+DIFF_WORK = metrics.counter(
+    "codestream_diff_work_total",
+    "Diff work by operation and whether it ran inline or on the diff executor",
+    ("operation", "mode")
+)
+DIFF_WORK_SECONDS = metrics.histogram(
+    "codestream_diff_work_seconds",
+    "Time spent on diff work; offloaded work is time the event loop did not spend on it",
+    ("operation", "mode")
+)
+OFFLOAD_OVERHEAD_SECONDS = metrics.histogram(
+    "codestream_diff_offload_overhead_seconds",
+    "Round trip of offloaded diff work beyond the work itself (queueing, pickling, wakeup)",
+    ("operation",)
+)
+
+
+def _timed_call(func: Callable[..., Any], *args: Any) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+# Runs diff work whose cost follows the size of its input on a thread or
+# process pool once that input is large enough, and inline otherwise, so a
+# big paste costs the event loop a hand-off instead of its parse. Only
+# strings and patches cross to the pool: patches are cut out of the
+# document on the loop, where that is a few rope slices, so a process pool
+# never needs a copy of the document. Threads still share the GIL with the
+# loop, but the loop gets it back every switch interval instead of waiting
+# out the whole parse; processes take the work off the loop entirely.
+class DiffExecutor:
+    def __init__(self, mode: str, workers: int, patch_bytes: int, document_bytes: int):
+        if mode not in MODES:
+            logger.warning(f"Unknown diff executor {mode!r}, running diff work inline")
+            mode = "inline"
+
+        self.mode = mode
+        self.workers = max(workers, 1)
+        self.patch_bytes = patch_bytes
+        self.document_bytes = document_bytes
+        self._executor: Optional[Executor] = None
+
+        self.inline = 0
+        self.offloaded = 0
+        self.fallbacks = 0
+        self.offloaded_seconds = 0.0
+        self.overhead_seconds = 0.0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.mode == "process":
+                # Forking a process that already runs the loop, motor and the
+                # profiler's threads can copy held locks into the workers
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="diff")
+            logger.info(f"Started {self.mode} diff executor with {self.workers} workers")
+
+        return self._executor
+
+    def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def run(
+        self,
+        operation: str,
+        func: Callable[..., Any],
+        *args: Any,
+        size: int,
+        threshold: int
+    ) -> Any:
+        if self.mode != "inline" and size >= threshold:
+            start = time.perf_counter()
+
+            try:
+                result, work = await asyncio.get_running_loop().run_in_executor(
+                    self._get_executor(), _timed_call, func, *args
+                )
+            except BrokenProcessPool:
+                logger.error(f"Diff executor broke during {operation}, restarting it")
+                self._executor = None
+                self.fallbacks += 1
+            else:
+                overhead = max(time.perf_counter() - start - work, 0.0)
+
+                self.offloaded += 1
+                self.offloaded_seconds += work
+                self.overhead_seconds += overhead
+
+                DIFF_WORK.inc(operation, self.mode)
+                DIFF_WORK_SECONDS.observe(work, operation, self.mode)
+                OFFLOAD_OVERHEAD_SECONDS.observe(overhead, operation)
+                return result
+
+        result, work = _timed_call(func, *args)
+
+        self.inline += 1
+        DIFF_WORK.inc(operation, "inline")
+        DIFF_WORK_SECONDS.observe(work, operation, "inline")
+        return result
+
+    async def parse_patches(self, patch_text: str) -> List[patch_obj]:
+        return await self.run(
+            "parse", operations.parse_patch_text, patch_text,
+            size=len(patch_text), threshold=self.patch_bytes
+        )
+
+    async def format_patches(self, patches: List[patch_obj], size: int) -> str:
+        return await self.run(
+            "format", operations.format_patches, patches,
+            size=size, threshold=self.patch_bytes
+        )
+
+    async def make_patch(self, old_text: str, new_text: str) -> str:
+        return await self.run(
+            "make", operations.make_patch_text, old_text, new_text,
+            size=max(len(old_text), len(new_text)), threshold=self.document_bytes
+        )
+
+    async def make_delta(self, old_text: str, new_text: str) -> operations.Operation:
+        return await self.run(
+            "delta", operations.make_delta, old_text, new_text,
+            size=max(len(old_text), len(new_text)), threshold=self.document_bytes
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "inline": self.inline,
+            "offloaded": self.offloaded,
+            "fallbacks": self.fallbacks,
+            "loop_ms_saved": round(self.offloaded_seconds * 1000, 3),
+            "overhead_ms": round(self.overhead_seconds * 1000, 3)
+        }
+
+
+diff_executor = DiffExecutor(
+    settings.diff_executor,
+    settings.diff_executor_workers,
+    settings.diff_offload_patch_bytes,
+    settings.diff_offload_document_bytes
+)
@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+import logging
+from typing import AsyncIterator, Dict, Optional, Any, List, Callable, Awaitable
+from datetime import datetime
+
+from app.config import settings
+from app.models.database import RoomRepository
+from app.services.operation_log import OperationLog
+from app.services.rope import Rope
+
+logger = logging.getLogger(__name__)
+
+
+class RoomDocument:
+    def __init__(
+        self,
+        room_id: str,
+        code: str = "",
+        version: int = 1,
+        language: str = "python",
+        name: str = "",
+        created_at: Optional[datetime] = None,
+        updated_at: Optional[datetime] = None
+    ):
+        now = datetime.utcnow()
+        self.room_id = room_id
+        self.text = Rope(code)
+        self.version = version
+        self.language = language
+        self.name = name
+        self.created_at = created_at or now
+        self.updated_at = updated_at or now
+        self.persisted_version = version
+        self.oplog = OperationLog(settings.oplog_capacity)
+        self.connections = 0
+        self.lock = asyncio.Lock()
+
+    @property
+    def code(self) -> str:
+        return str(self.text)
+
+    @code.setter
+    def code(self, code: str) -> None:
+        self.text = Rope(code)
+
+    @classmethod
+    def from_room(cls, room: Dict[str, Any]) -> "RoomDocument":
+        return cls(
+            room_id=room["room_id"],
+            code=room.get("code", ""),
+            version=room.get("version", 1),
+            language=room.get("language", "python"),
+            name=room.get("name", ""),
+            created_at=room.get("created_at"),
+            updated_at=room.get("updated_at")
+        )
+
+    def to_room(self) -> Dict[str, Any]:
+        return {
+            "room_id": self.room_id,
+            "name": self.name,
+            "language": self.language,
+            "code": self.code,
+            "version": self.version,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
+        }
+
+    def to_sync_payload(self) -> Dict[str, Any]:
+        return {
+            "code": self.code,
+            "version": self.version,
+            "language": self.language,
+            "name": self.name
+        }
+
+
+class DocumentStore:
+    def __init__(self):
+        self._documents: Dict[str, RoomDocument] = {}
+        self._lock = asyncio.Lock()
+        self._room_locks: Dict[str, List[Any]] = {}
+
+    def get(self, room_id: str) -> Optional[RoomDocument]:
+        return self._documents.get(room_id)
+
+    def documents(self) -> List[RoomDocument]:
+        return list(self._documents.values())
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    # Serialises loading and evicting one room; the entry is dropped once
+    # nobody holds or waits for it
+    @contextlib.asynccontextmanager
+    async def _room_lock(self, room_id: str) -> AsyncIterator[None]:
+        entry = self._room_locks.get(room_id)
+        if entry is None:
+            entry = self._room_locks[room_id] = [asyncio.Lock(), 0]
+
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._room_locks[room_id]
+
+    # The store-wide lock only covers the dict and the connection counts;
+    # database reads and eviction flushes hold just their own room's lock,
+    # so a slow room never holds up joins and leaves in the others
+    async def acquire(
+        self,
+        room_id: str,
+        room_repo: RoomRepository,
+        on_load: Optional[Callable[[RoomDocument], Awaitable[Any]]] = None
+    ) -> RoomDocument:
+        async with self._lock:
+            doc = self._documents.get(room_id)
+            if doc is not None:
+                doc.connections += 1
+                return doc
+
+        async with self._room_lock(room_id):
+            async with self._lock:
+                # Loaded by another join while this one waited
+                doc = self._documents.get(room_id)
+                if doc is not None:
+                    doc.connections += 1
+                    return doc
+
+            room = await room_repo.get_room(room_id)
+            doc = RoomDocument.from_room(room) if room else RoomDocument(room_id)
+            if on_load:
+                await on_load(doc)
+
+            async with self._lock:
+                self._documents[room_id] = doc
+                doc.connections += 1
+
+        logger.info(f"Loaded document for room {room_id} (version {doc.version})")
+        return doc
+
+    async def release(
+        self,
+        room_id: str,
+        on_evict: Optional[Callable[[RoomDocument], Awaitable[Any]]] = None
+    ) -> None:
+        async with self._lock:
+            doc = self._documents.get(room_id)
+
+            if doc is None:
+                return
+
+            doc.connections -= 1
+
+            if doc.connections > 0:
+                return
+
+        async with self._room_lock(room_id):
+            while True:
+                async with self._lock:
+                    # Rejoined, or already evicted by an earlier release
+                    if doc.connections > 0 or self._documents.get(room_id) is not doc:
+                        return
+                version = doc.version
+
+                if on_evict:
+                    await on_evict(doc)
+
+                async with self._lock:
+                    if doc.connections > 0:
+                        return
+                    # Edits made by a join that came and went during the
+                    # flush need flushing too
+                    if doc.version == version:
+                        del self._documents[room_id]
+                        break
+
+        logger.info(f"Evicted document for room {room_id} (version {doc.version})")
+
+
+document_store = DocumentStore()
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Any, List, Optional, Tuple
+
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = metrics.histogram(
+    "codestream_edit_batch_size",
+    "Edits applied together by a room's edit queue",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+
+# An edit ({"user_id", "version", "diff" or "ops"}) and, for callers that
+# wait on it, the future that gets its (success, version)
+PendingEdit = Tuple[Dict[str, Any], Optional[asyncio.Future]]
+
+
+# Edits for one room, in arrival order. A single task drains whatever has
+# queued up since the last pass and hands it to flush as one batch, so a
+# burst costs one apply pass, one broadcast and one ack per author instead
+# of one of each per edit. Batches are flushed one at a time, which keeps
+# every socket's edits in the order they were sent.
+class EditQueue:
+    def __init__(
+        self,
+        room_id: str,
+        flush: Callable[[str, List[PendingEdit]], Awaitable[None]],
+        max_batch: int
+    ):
+        self.room_id = room_id
+        self.flush = flush
+        self.max_batch = max(max_batch, 1)
+
+        self._edits: Deque[PendingEdit] = deque()
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.closed = False
+        self.batches = 0
+        self.edits = 0
+        self.largest_batch = 0
+
+    def __len__(self) -> int:
+        return len(self._edits)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def put(self, edit: Dict[str, Any], future: Optional[asyncio.Future] = None) -> None:
+        self._edits.append((edit, future))
+        self._ready.set()
+
+    # Stops taking new batches once everything already queued is flushed
+    async def close(self) -> None:
+        self.closed = True
+        self._ready.set()
+
+        if self._task and self._task is not asyncio.current_task():
+            await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            if not self._edits:
+                if self.closed:
+                    return
+                await self._ready.wait()
+                self._ready.clear()
+                continue
+
+            batch = [self._edits.popleft() for _ in range(min(len(self._edits), self.max_batch))]
+
+            self.batches += 1
+            self.edits += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            BATCH_SIZE.observe(len(batch))
+
+            try:
+                await self.flush(self.room_id, batch)
+            except Exception as e:
+                logger.error(f"Failed to flush {len(batch)} edits for room {self.room_id}: {e}")
+                for _, future in batch:
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": len(self._edits),
+            "batches": self.batches,
+            "edits": self.edits,
+            "largest_batch": self.largest_batch
+        }
@@ -0,0 +1,124 @@
+import asyncio
+import codecs
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+
+from app.config import settings
+from app.services.wire_format import envelope
+
+logger = logging.getLogger(__name__)
+
+OutputCallback = Callable[[str, str], Awaitable[None]]
+FrameSender = Callable[[Dict[str, Any]], Awaitable[bool]]
+
+STREAMS = ("stdout", "stderr")
+
+
+# Gathers a run's stdout and stderr up to max_bytes. With on_output the text
+# is handed on as it arrives instead of being kept.
+class OutputCollector:
+    def __init__(self, max_bytes: int, on_output: Optional[OutputCallback] = None):
+        self.max_bytes = max_bytes
+        self.on_output = on_output
+        self.size = 0
+        self.truncated = False
+        self.decode_ns = 0
+        self._chunks: Dict[str, List[str]] = {stream: [] for stream in STREAMS}
+        self._decoders = {
+            stream: codecs.getincrementaldecoder("utf-8")(errors="replace")
+            for stream in STREAMS
+        }
+
+    @property
+    def streamed(self) -> bool:
+        return self.on_output is not None
+
+    @property
+    def remaining(self) -> int:
+        return max(self.max_bytes - self.size, 0)
+
+    # Returns False once the cap is reached; the caller should stop the run
+    async def feed(self, stream: str, data: bytes) -> bool:
+        if self.truncated:
+            return False
+
+        if len(data) > self.remaining:
+            data = data[:self.remaining]
+            self.truncated = True
+
+        self.size += len(data)
+        start = time.perf_counter_ns()
+        text = self._decoders[stream].decode(data, final=self.truncated)
+        self.decode_ns += time.perf_counter_ns() - start
+
+        await self._write(stream, text)
+        return not self.truncated
+
+    async def finish(self) -> None:
+        for stream, decoder in self._decoders.items():
+            await self._write(stream, decoder.decode(b"", final=True))
+
+    async def _write(self, stream: str, text: str) -> None:
+        if not text:
+            return
+
+        if self.on_output is not None:
+            await self.on_output(stream, text)
+        else:
+            self._chunks[stream].append(text)
+
+    def text(self, stream: str) -> str:
+        return "".join(self._chunks[stream])
+
+
+# Turns a run's output into execution_output frames. The first chunk after a
+# quiet spell goes out at once, then at most one frame per flush interval
+# carrying everything written since, in order.
+class OutputStream:
+    def __init__(self, send: FrameSender, job_id: str, flush_ms: Optional[int] = None):
+        self.send = send
+        self.job_id = job_id
+        self.flush_ms = settings.execution_output_flush_ms if flush_ms is None else flush_ms
+        self.seq = 0
+        self._chunks: List[List[str]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def write(self, stream: str, text: str) -> None:
+        if self._chunks and self._chunks[-1][0] == stream:
+            self._chunks[-1][1] += text
+        else:
+            self._chunks.append([stream, text])
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        try:
+            while self._chunks:
+                await self.flush()
+                await asyncio.sleep(self.flush_ms / 1000)
+        except Exception as e:
+            logger.error(f"Output stream for job {self.job_id} failed: {e}")
+        finally:
+            self._task = None
+
+    async def flush(self) -> None:
+        chunks, self._chunks = self._chunks, []
+
+        if not chunks:
+            return
+
+        self.seq += 1
+
+        await self.send(envelope("execution_output", {"job_id": self.job_id, "seq": self.seq, "chunks": chunks}))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        await self.flush()
@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Any, List, Optional, Set
+
+from app.config import settings
+from app.models.schemas import Language, CodeExecutionResponse
+from app.services.connection_manager import ConnectionManager, manager
+from app.services.execution_output import OutputCallback
+from app.services.execution_service import ExecutionService, execution_service
+from app.services.metrics import metrics
+from app.services.result_cache import ResultCache, result_cache
+from app.services.wire_format import envelope
+
+logger = logging.getLogger(__name__)
+
+QUEUE_WAIT_SECONDS = metrics.histogram(
+    "codestream_execution_queue_wait_seconds",
+    "Time a run waited in the scheduler before it started"
+)
+QUEUE_REJECTED = metrics.counter(
+    "codestream_execution_rejected_total",
+    "Runs turned away because the queue was full"
+)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class ExecutionJob:
+    def __init__(self, room_id: Optional[str], user_id: str):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.room_id = room_id
+        self.user_id = user_id
+        self.enqueued_at = time.monotonic()
+        self.ready = asyncio.get_running_loop().create_future()
+        self.position = 0
+
+
+# Caps concurrent runs and queues the rest. Queued jobs are taken round-robin
+# across rooms and, within a room, across users, so one busy room or one
+# user hammering Run can't starve everyone else. Runs submitted with cache
+# go through the result cache first, so identical ones share one slot.
+class ExecutionScheduler:
+    def __init__(
+        self,
+        executor: ExecutionService,
+        connection_manager: ConnectionManager,
+        max_concurrent: int,
+        max_queued: int,
+        max_queued_per_user: int,
+        result_cache: Optional[ResultCache] = None
+    ):
+        self.executor = executor
+        self.manager = connection_manager
+        self.result_cache = result_cache
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+
+        # room -> user -> jobs waiting, in service order
+        self._queues: "OrderedDict[str, OrderedDict[str, Deque[ExecutionJob]]]" = OrderedDict()
+        self._queued = 0
+        self._queued_per_user: Dict[str, int] = {}
+        self.running = 0
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.max_depth = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    async def submit(
+        self,
+        code: str,
+        language: Language,
+        input_data: str = "",
+        job: Optional[ExecutionJob] = None,
+        on_output: Optional[OutputCallback] = None,
+        cache: bool = False
+    ) -> CodeExecutionResponse:
+        job = job or ExecutionJob(None, "anonymous")
+
+        if cache and self.result_cache is not None:
+            key = self.result_cache.key_for(code, language, input_data)
+            # Everyone sharing the run gets its whole output in the result,
+            # so it isn't streamed to just the first requester
+            return await self.result_cache.get_or_run(
+                key, lambda: self._run(code, language, input_data, job, None)
+            )
+
+        return await self._run(code, language, input_data, job, on_output)
+
+    async def _run(
+        self,
+        code: str,
+        language: Language,
+        input_data: str,
+        job: ExecutionJob,
+        on_output: Optional[OutputCallback]
+    ) -> CodeExecutionResponse:
+        self.submitted += 1
+
+        if self.running < self.max_concurrent and not self._queued:
+            self.running += 1
+        else:
+            self._enqueue(job)
+            await self._announce_positions()
+
+            try:
+                await job.ready
+            except asyncio.CancelledError:
+                if not job.ready.done() or job.ready.cancelled():
+                    self._remove(job)
+                    await self._announce_positions()
+                else:
+                    self._release()
+                raise
+
+        wait_ms = (time.monotonic() - job.enqueued_at) * 1000
+        QUEUE_WAIT_SECONDS.observe(wait_ms / 1000)
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+        try:
+            await self._notify(job, "execution_started", {"wait_ms": round(wait_ms, 1)})
+            return await self.executor.execute(code, language, input_data, on_output)
+        finally:
+            self.completed += 1
+            self._release()
+
+    def _enqueue(self, job: ExecutionJob) -> None:
+        if self._queued >= self.max_queued:
+            self.rejected += 1
+            QUEUE_REJECTED.inc()
+            raise QueueFullError(f"Execution queue is full ({self.max_queued} runs waiting)")
+
+        user_key = f"{job.room_id}:{job.user_id}"
+        if self._queued_per_user.get(user_key, 0) >= self.max_queued_per_user:
+            self.rejected += 1
+            QUEUE_REJECTED.inc()
+            raise QueueFullError(f"Too many runs waiting for this user ({self.max_queued_per_user})")
+
+        room = self._queues.setdefault(job.room_id or "", OrderedDict())
+        room.setdefault(job.user_id, deque()).append(job)
+        self._queued += 1
+        self._queued_per_user[user_key] = self._queued_per_user.get(user_key, 0) + 1
+        self.max_depth = max(self.max_depth, self._queued)
+
+    def _remove(self, job: ExecutionJob) -> None:
+        room = self._queues.get(job.room_id or "")
+        jobs = room.get(job.user_id) if room else None
+
+        if jobs is None or job not in jobs:
+            return
+
+        jobs.remove(job)
+        if not jobs:
+            del room[job.user_id]
+        if not room:
+            del self._queues[job.room_id or ""]
+        self._dequeued(job)
+
+    def _dequeued(self, job: ExecutionJob) -> None:
+        self._queued -= 1
+        user_key = f"{job.room_id}:{job.user_id}"
+        remaining = self._queued_per_user.get(user_key, 0) - 1
+        if remaining > 0:
+            self._queued_per_user[user_key] = remaining
+        else:
+            self._queued_per_user.pop(user_key, None)
+
+    def _pop_next(self) -> ExecutionJob:
+        room_key, room = next(iter(self._queues.items()))
+        user_id, jobs = next(iter(room.items()))
+        job = jobs.popleft()
+
+        # Both the user and the room go to the back of their rotations
+        del room[user_id]
+        if jobs:
+            room[user_id] = jobs
+        del self._queues[room_key]
+        if room:
+            self._queues[room_key] = room
+
+        self._dequeued(job)
+        return job
+
+    def _release(self) -> None:
+        self.running -= 1
+        started = False
+
+        while self._queued and self.running < self.max_concurrent:
+            job = self._pop_next()
+            if job.ready.done():
+                continue
+            self.running += 1
+            job.ready.set_result(None)
+            started = True
+
+        if started:
+            task = asyncio.create_task(self._announce_positions())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _service_order(self) -> List[ExecutionJob]:
+        rooms = [[deque(jobs) for jobs in room.values()] for room in self._queues.values()]
+        order: List[ExecutionJob] = []
+
+        while rooms:
+            next_rooms = []
+            for users in rooms:
+                jobs = users.pop(0)
+                order.append(jobs.popleft())
+                if jobs:
+                    users.append(jobs)
+                if users:
+                    next_rooms.append(users)
+            rooms = next_rooms
+
+        return order
+
+    async def _announce_positions(self) -> None:
+        for position, job in enumerate(self._service_order(), start=1):
+            if job.position != position:
+                job.position = position
+                await self._notify(job, "execution_queued", {
+                    "position": position,
+                    "queued": self._queued
+                })
+
+    async def _notify(self, job: ExecutionJob, event: str, payload: Dict[str, Any]) -> None:
+        if job.room_id is None:
+            return
+
+        try:
+            await self.manager.broadcast_to_room(job.room_id, envelope(
+                event, {"job_id": job.job_id, "user_id": job.user_id, **payload}
+            ))
+        except Exception as e:
+            logger.error(f"Failed to send {event} for job {job.job_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "running": self.running,
+            "queued": self._queued,
+            "max_queued": self.max_queued,
+            "max_depth": self.max_depth,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "avg_wait_ms": round(self.total_wait_ms / self.completed, 1) if self.completed else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 1)
+        }
+
+
+execution_scheduler = ExecutionScheduler(
+    execution_service,
+    manager,
+    settings.execution_max_concurrent or os.cpu_count() or 1,
+    settings.execution_max_queued,
+    settings.execution_max_queued_per_user,
+    result_cache
+)
@@ -1,162 +1,411 @@
 import asyncio
 import logging
 import subprocess
-import tempfile
 import os
-import shutil
-from typing import Optional, Tuple
-from datetime import datetime
-import uuid
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Sequence
 
-from app.models.schemas import Language
+from app.models.schemas import Language, CodeExecutionResponse, ResourceUsage
 from app.config import settings
+from app.services.compile_cache import CompileCache, CompileError, compile_cache, compile_cpp
+from app.services.execution_output import OutputCallback, OutputCollector
+from app.services.metrics import metrics
+from app.services.resource_limits import UsageReport, describe_kill, limits_for, output_limit
+from app.services.sandbox_pool import SandboxPool, sandbox_pool
+from app.services.workspace import Workspace, execution_workspace
 
 logger = logging.getLogger(__name__)
 
+READ_SIZE = 65536
 
-class ExecutionService:
+PHASE_SECONDS = metrics.histogram(
+    "codestream_execution_phase_seconds",
+    "Time spent in each phase of a run",
+    ("language", "phase")
+)
+RUN_SECONDS = metrics.histogram(
+    "codestream_execution_seconds",
+    "Wall time of a run from submission to result",
+    ("language",)
+)
+COMPILE_LOOKUPS = metrics.counter(
+    "codestream_compile_cache_lookups_total",
+    "C++ compile cache lookups by result",
+    ("result",)
+)
+
+
+def timeout_message() -> str:
+    return f"Execution timed out ({settings.code_execution_timeout}s limit)"
+
+
+# Nanoseconds spent per phase of one run: write, compile, spawn, run, decode
+class PhaseTimer:
     def __init__(self):
-        self.temp_dir = tempfile.mkdtemp(prefix="codestream_")
-        logger.info(f"Created execution temp directory: {self.temp_dir}")
+        self.phases: Dict[str, int] = {}
+        self.compile_cached: Optional[bool] = None
+
+    def add(self, phase: str, elapsed_ns: int) -> None:
+        self.phases[phase] = self.phases.get(phase, 0) + max(elapsed_ns, 0)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter_ns() - start)
+
+    def milliseconds(self) -> Dict[str, float]:
+        return {phase: round(ns / 1e6, 3) for phase, ns in self.phases.items()}
+
+
+# How a run ended. message is appended to the run's stderr.
+class RunStatus:
+    def __init__(
+        self,
+        exit_code: Optional[int] = None,
+        message: Optional[str] = None,
+        limit_exceeded: Optional[str] = None,
+        usage: Optional[ResourceUsage] = None
+    ):
+        self.exit_code = exit_code
+        self.message = message
+        self.limit_exceeded = limit_exceeded
+        self.usage = usage
+
+    @classmethod
+    def exited(
+        cls,
+        exit_code: int,
+        limits: Dict[str, int],
+        usage: Optional[ResourceUsage] = None
+    ) -> "RunStatus":
+        if exit_code >= 0:
+            return cls(exit_code, usage=usage)
+
+        limit, message = describe_kill(-exit_code, limits, usage)
+        return cls(exit_code, message, limit, usage)
+
+
+class ExecutionService:
+    def __init__(
+        self,
+        pool: Optional[SandboxPool] = None,
+        compile_cache: Optional[CompileCache] = None,
+        workspace: Optional[Workspace] = None
+    ):
+        self.pool = pool
+        self.compile_cache = compile_cache
+        self.workspace = workspace or Workspace()
 
     async def execute(
         self,
         code: str,
         language: Language,
-        input_data: str = ""
-    ) -> Tuple[str, Optional[str], float]:
-        start_time = datetime.utcnow()
+        input_data: str = "",
+        on_output: Optional[OutputCallback] = None
+    ) -> CodeExecutionResponse:
+        start = time.perf_counter_ns()
+        limits = limits_for(language)
+        output = OutputCollector(output_limit(limits), on_output)
+        timer = PhaseTimer()
+        status = RunStatus()
 
         try:
             if language == Language.PYTHON:
-                result = await self._execute_python(code, input_data)
+                status = await self._execute_python(code, input_data, output, limits, timer)
             elif language == Language.CPP:
-                result = await self._execute_cpp(code, input_data)
+                status = await self._execute_cpp(code, input_data, output, limits, timer)
             else:
-                result = ("", f"Unsupported language: {language}", 0.0)
+                status = RunStatus(message=f"Unsupported language: {language}")
 
-            execution_time = (datetime.utcnow() - start_time).total_seconds()
-
-            return (*result, execution_time)
+            await output.finish()
 
         except Exception as e:
             logger.error(f"Execution error: {e}")
-            execution_time = (datetime.utcnow() - start_time).total_seconds()
-            return ("", str(e), execution_time)
-
-    async def _execute_python(
+            status = RunStatus(message=str(e))
+
+        execution_ns = time.perf_counter_ns() - start
+
+        # Output is decoded while the program runs, so it comes out of run
+        if output.decode_ns:
+            if "run" in timer.phases:
+                timer.phases["run"] = max(timer.phases["run"] - output.decode_ns, 0)
+            timer.add("decode", output.decode_ns)
+
+        self._record(language, execution_ns, timer)
+        message = status.message
+
+        if output.truncated:
+            truncated = f"Output truncated at {output.max_bytes} bytes"
+            message = f"{message}\n{truncated}" if message else truncated
+            status.limit_exceeded = status.limit_exceeded or "output_bytes"
+
+        error = output.text("stderr")
+        if message:
+            error = f"{error}\n{message}" if error else message
+
+        return CodeExecutionResponse(
+            output=output.text("stdout"),
+            error=error or None,
+            execution_time=execution_ns / 1e9,
+            phases=timer.milliseconds(),
+            compile_cached=timer.compile_cached,
+            exit_code=status.exit_code,
+            truncated=output.truncated,
+            streamed=output.streamed,
+            limit_exceeded=status.limit_exceeded,
+            usage=status.usage
+        )
+
+    def _record(self, language: Language, execution_ns: int, timer: PhaseTimer) -> None:
+        RUN_SECONDS.observe(execution_ns / 1e9, language.value)
+        for phase, elapsed_ns in timer.phases.items():
+            PHASE_SECONDS.observe(elapsed_ns / 1e9, language.value, phase)
+        if timer.compile_cached is not None:
+            COMPILE_LOOKUPS.inc("hit" if timer.compile_cached else "miss")
+
+    # Reads both pipes as the process writes them, so output can be streamed
+    # and capped instead of buffered whole until exit
+    async def _communicate(
         self,
-        code: str,
-        input_data: str
-    ) -> Tuple[str, Optional[str]]:
-        execution_id = str(uuid.uuid4())[:8]
-        filename = f"temp_{execution_id}.py"
-        filepath = os.path.join(self.temp_dir, filename)
+        process: asyncio.subprocess.Process,
+        input_data: str,
+        output: OutputCollector,
+        limits: Dict[str, int],
+        report: Optional[UsageReport] = None
+    ) -> RunStatus:
+        def kill() -> None:
+            if report is not None and report.pid is not None:
+                report.kill()
+            else:
+                process.kill()
+
+        async def feed() -> None:
+            try:
+                if input_data:
+                    process.stdin.write(input_data.encode())
+                    await process.stdin.drain()
+                process.stdin.close()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        async def pump(reader: asyncio.StreamReader, stream: str) -> None:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    return
+                if not await output.feed(stream, data):
+                    kill()
+                    return
 
         try:
-            with open(filepath, "w", encoding="utf-8") as f:
-                f.write(code)
-
-            process = await asyncio.create_subprocess_exec(
-                "python",
-                filepath,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=self.temp_dir
-            )
-
-            stdout, stderr = await asyncio.wait_for(
-                process.communicate(input=input_data.encode() if input_data else None),
-                timeout=settings.code_execution_timeout
+            async with asyncio.timeout(settings.code_execution_timeout):
+                await asyncio.gather(
+                    feed(),
+                    pump(process.stdout, "stdout"),
+                    pump(process.stderr, "stderr")
+                )
+                exit_code = await process.wait()
+        except asyncio.TimeoutError:
+            kill()
+            await process.wait()
+            reported = report.result() if report else None
+            return RunStatus(
+                message=timeout_message(),
+                limit_exceeded="timeout",
+                usage=reported[1] if reported else None
             )
+        finally:
+            if process.returncode is None:
+                kill()
 
-            output = stdout.decode("utf-8", errors="replace")
-            error = stderr.decode("utf-8", errors="replace")
+        usage = None
+        reported = report.result() if report else None
+        if reported:
+            exit_code, usage = reported
 
-            return output, error if error else None
+        # Killed here for overflowing its output, not by a limit
+        if output.truncated:
+            return RunStatus(exit_code, usage=usage)
 
-        except asyncio.TimeoutError:
-            process.kill()
-            return ("", "Execution timed out (30s limit)")
+        return RunStatus.exited(exit_code, limits, usage)
 
-        except Exception as e:
-            return ("", str(e))
+    # Runs argv in a fresh subprocess. Where it can, the child forks the
+    # program and reaps it itself, so the run still gets its rusage.
+    async def _run_cold(
+        self,
+        argv: List[str],
+        run_dir: str,
+        input_data: str,
+        output: OutputCollector,
+        limits: Dict[str, int],
+        timer: PhaseTimer,
+        pass_fds: Sequence[int] = ()
+    ) -> RunStatus:
+        report = UsageReport() if UsageReport.supported else None
 
+        try:
+            with timer.phase("spawn"):
+                process = await asyncio.create_subprocess_exec(
+                    *argv,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    cwd=run_dir,
+                    pass_fds=(*pass_fds, report.write_fd) if report else pass_fds,
+                    preexec_fn=report.preexec(limits) if report else None
+                )
+                if report:
+                    report.started()
+
+            with timer.phase("run"):
+                return await self._communicate(process, input_data, output, limits, report)
         finally:
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            if report:
+                report.close()
 
-    async def _execute_cpp(
+    # Runs program in a pooled fork server. Returns None when the caller
+    # should fall back to a cold subprocess.
+    async def _run_pooled(
+        self,
+        program: Dict[str, Any],
+        input_data: str,
+        output: OutputCollector,
+        limits: Dict[str, int],
+        timer: PhaseTimer
+    ) -> Optional[RunStatus]:
+        if self.pool is None:
+            return None
+
+        start = time.perf_counter_ns()
+        dispatched_at = time.monotonic()
+        result = await self.pool.run(program, input_data, output, limits)
+        elapsed_ns = time.perf_counter_ns() - start
+
+        # The worker stamps when the child started (on the monotonic clock),
+        # which splits waiting for a worker and forking from the run itself
+        spawn_ns = elapsed_ns
+        if result is not None and result.get("started_at") is not None:
+            spawn_ns = min(int((result["started_at"] - dispatched_at) * 1e9), elapsed_ns)
+        timer.add("spawn", spawn_ns)
+        timer.add("run", elapsed_ns - spawn_ns)
+
+        if result is None:
+            # Rerunning would repeat whatever the failed worker already sent
+            if output.size:
+                return RunStatus(message="Sandbox worker failed during the run")
+            return None
+
+        usage = ResourceUsage(**result["usage"]) if result.get("usage") else None
+
+        if result["breach"] == "timeout":
+            return RunStatus(message=timeout_message(), limit_exceeded="timeout", usage=usage)
+        if result["breach"] == "output":
+            return RunStatus(result["exit_code"], usage=usage)
+
+        return RunStatus.exited(result["exit_code"], limits, usage)
+
+    async def _execute_python(
+        self,
+        code: str,
+        input_data: str,
+        output: OutputCollector,
+        limits: Dict[str, int],
+        timer: PhaseTimer
+    ) -> RunStatus:
+        status = await self._run_pooled({"code": code}, input_data, output, limits, timer)
+        if status is None:
+            status = await self._execute_python_cold(code, input_data, output, limits, timer)
+        return status
+
+    async def _execute_python_cold(
         self,
         code: str,
-        input_data: str
-    ) -> Tuple[str, Optional[str]]:
-        execution_id = str(uuid.uuid4())[:8]
-        source_file = f"temp_{execution_id}.cpp"
-        exe_file = f"temp_{execution_id}.exe"
+        input_data: str,
+        output: OutputCollector,
+        limits: Dict[str, int],
+        timer: PhaseTimer
+    ) -> RunStatus:
+        try:
+            with ExitStack() as stack:
+                run_dir = stack.enter_context(self.workspace.run_dir())
 
-        source_path = os.path.join(self.temp_dir, source_file)
-        exe_path = os.path.join(self.temp_dir, exe_file)
+                with timer.phase("write"):
+                    source_path, pass_fds = stack.enter_context(
+                        self.workspace.source(run_dir, "main.py", code)
+                    )
 
-        try:
-            with open(source_path, "w", encoding="utf-8") as f:
-                f.write(code)
-
-            compile_process = await asyncio.create_subprocess_exec(
-                "g++",
-                "-o", exe_path,
-                source_path,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
+                return await self._run_cold(
+                    ["python", source_path], run_dir, input_data, output, limits, timer, pass_fds
+                )
 
-            _, compile_stderr = await compile_process.communicate()
+        except Exception as e:
+            return RunStatus(message=str(e))
 
-            if compile_process.returncode != 0:
-                error = compile_stderr.decode("utf-8", errors="replace")
-                return ("", f"Compilation error:\n{error}")
+    async def _execute_cpp(
+        self,
+        code: str,
+        input_data: str,
+        output: OutputCollector,
+        limits: Dict[str, int],
+        timer: PhaseTimer
+    ) -> RunStatus:
+        cache_key = None
 
-            process = await asyncio.create_subprocess_exec(
-                exe_path,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=self.temp_dir
-            )
+        try:
+            with ExitStack() as stack:
+                run_dir = stack.enter_context(self.workspace.run_dir())
 
-            stdout, stderr = await asyncio.wait_for(
-                process.communicate(input=input_data.encode() if input_data else None),
-                timeout=settings.code_execution_timeout
-            )
+                if self.compile_cache:
+                    with timer.phase("compile"):
+                        cache_key, binary_path, timer.compile_cached = await self.compile_cache.acquire(code)
+                else:
+                    binary_path = os.path.join(run_dir, "main.exe")
 
-            output = stdout.decode("utf-8", errors="replace")
-            error = stderr.decode("utf-8", errors="replace")
+                    with timer.phase("write"):
+                        source_path, pass_fds = stack.enter_context(
+                            self.workspace.source(run_dir, "main.cpp", code)
+                        )
 
-            return output, error if error else None
+                    with timer.phase("compile"):
+                        await compile_cpp(source_path, binary_path, settings.cpp_compile_flags, pass_fds)
 
-        except asyncio.TimeoutError:
-            process.kill()
-            return ("", "Execution timed out (30s limit)")
+                return await self._run_binary(binary_path, run_dir, input_data, output, limits, timer)
+
+        except CompileError as e:
+            return RunStatus(message=f"Compilation error:\n{e}")
 
         except FileNotFoundError:
-            return ("", "g++ compiler not found. Please install MinGW or GCC.")
+            return RunStatus(message="g++ compiler not found. Please install MinGW or GCC.")
 
         except Exception as e:
-            return ("", str(e))
+            return RunStatus(message=str(e))
 
         finally:
-            for path in [source_path, exe_path]:
-                if os.path.exists(path):
-                    os.remove(path)
+            if cache_key:
+                self.compile_cache.release(cache_key)
+
+    async def _run_binary(
+        self,
+        binary_path: str,
+        run_dir: str,
+        input_data: str,
+        output: OutputCollector,
+        limits: Dict[str, int],
+        timer: PhaseTimer
+    ) -> RunStatus:
+        status = await self._run_pooled({"argv": [binary_path]}, input_data, output, limits, timer)
+        if status is not None:
+            return status
+
+        return await self._run_cold([binary_path], run_dir, input_data, output, limits, timer)
 
     def cleanup(self) -> None:
-        try:
-            if os.path.exists(self.temp_dir):
-                shutil.rmtree(self.temp_dir)
-            logger.info("Cleaned up execution temp directory")
-        except Exception as e:
-            logger.error(f"Failed to cleanup temp directory: {e}")
+        self.workspace.cleanup()
+        logger.info("Cleaned up execution workspace")
 
 
-execution_service = ExecutionService()
+execution_service = ExecutionService(sandbox_pool, compile_cache, execution_workspace)
@@ -0,0 +1,190 @@
+import contextlib
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional
+
+from app.config import settings
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SLOW_HANDLERS = metrics.counter(
+    "codestream_slow_handlers_total",
+    "WebSocket handlers that ran past slow_handler_threshold_ms",
+    ("handler",)
+)
+
+
+class HandlerRecord:
+    __slots__ = ("handler", "room_id", "user_id", "payload_bytes", "started_at", "stack")
+
+    def __init__(self, handler: str, room_id: str, user_id: str, payload_bytes: int):
+        self.handler = handler
+        self.room_id = room_id
+        self.user_id = user_id
+        self.payload_bytes = payload_bytes
+        self.started_at = time.perf_counter()
+        self.stack: Optional[List[str]] = None
+
+
+# Opt-in: while a threshold is set, every tracked handler is timed and a
+# watchdog thread samples the loop thread's stack once a handler has been
+# running for longer than the threshold. A sample is only kept if the
+# handler's own frame is on the stack, i.e. the handler is what holds the
+# loop rather than something it is awaiting. Handlers that finish over the
+# threshold are kept, newest last, for the admin endpoint.
+class HandlerProfiler:
+    def __init__(self, threshold_ms: float, max_entries: int, stack_depth: int):
+        self.threshold = threshold_ms / 1000
+        self.stack_depth = stack_depth
+        self.entries: deque = deque(maxlen=max_entries)
+
+        self._active: Dict[int, HandlerRecord] = {}
+        self._lock = threading.Lock()
+        self._loop_thread: Optional[int] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+        self.tracked = 0
+        self.slow = 0
+        self.sampled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def start(self) -> None:
+        self._loop_thread = threading.get_ident()
+
+        if self.enabled and self._watchdog is None:
+            self._stop.clear()
+            self._watchdog = threading.Thread(
+                target=self._watch, name="handler-profiler", daemon=True
+            )
+            self._watchdog.start()
+
+    def stop(self) -> None:
+        if self._watchdog is None:
+            return
+
+        self._stop.set()
+        self._watchdog.join()
+        self._watchdog = None
+
+    def configure(self, threshold_ms: float) -> None:
+        self.threshold = max(threshold_ms, 0) / 1000
+
+        if not self.enabled:
+            self.stop()
+        elif self._loop_thread is not None:
+            self.start()
+
+        logger.info(f"Slow handler threshold set to {threshold_ms}ms")
+
+    @contextlib.contextmanager
+    def track(self, handler: str, room_id: str, user_id: str, payload_bytes: int) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        record = HandlerRecord(handler, room_id, user_id, payload_bytes)
+        with self._lock:
+            self._active[id(record)] = record
+        self.tracked += 1
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._active[id(record)]
+
+            duration = time.perf_counter() - record.started_at
+            if self.enabled and duration >= self.threshold:
+                self._record_slow(record, duration)
+
+    def _record_slow(self, record: HandlerRecord, duration: float) -> None:
+        self.slow += 1
+        SLOW_HANDLERS.inc(record.handler)
+
+        self.entries.append({
+            "handler": record.handler,
+            "room_id": record.room_id,
+            "user_id": record.user_id,
+            "payload_bytes": record.payload_bytes,
+            "duration_ms": round(duration * 1000, 3),
+            # No sample means the time went to awaits, not to blocking the loop
+            "blocking": record.stack is not None,
+            "stack": record.stack,
+            "at": datetime.utcnow().isoformat()
+        })
+
+        logger.warning(
+            f"Slow handler {record.handler} in room {record.room_id}: "
+            f"{duration * 1000:.1f}ms, {record.payload_bytes} bytes"
+        )
+
+    def _watch(self) -> None:
+        while not self._stop.wait(max(self.threshold / 2, 0.001)):
+            now = time.perf_counter()
+
+            with self._lock:
+                overdue = [
+                    record for record in self._active.values()
+                    if record.stack is None and now - record.started_at >= self.threshold
+                ]
+
+            if not overdue:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+
+            stack = traceback.extract_stack(frame)
+            del frame
+            names = {entry.name for entry in stack}
+
+            for record in overdue:
+                if record.handler in names:
+                    record.stack = [
+                        f"{entry.filename}:{entry.lineno} in {entry.name}"
+                        for entry in stack[-self.stack_depth:]
+                    ]
+                    self.sampled += 1
+
+    def slowest_rooms(self, limit: int = 10) -> List[Dict[str, Any]]:
+        rooms: Dict[str, Dict[str, Any]] = {}
+
+        for entry in self.entries:
+            room = rooms.setdefault(entry["room_id"], {
+                "room_id": entry["room_id"], "slow": 0, "blocking": 0,
+                "total_ms": 0.0, "max_ms": 0.0
+            })
+            room["slow"] += 1
+            room["blocking"] += entry["blocking"]
+            room["total_ms"] = round(room["total_ms"] + entry["duration_ms"], 3)
+            room["max_ms"] = max(room["max_ms"], entry["duration_ms"])
+
+        return sorted(rooms.values(), key=lambda room: room["total_ms"], reverse=True)[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": round(self.threshold * 1000, 3),
+            "tracked": self.tracked,
+            "slow": self.slow,
+            "sampled": self.sampled,
+            "active": len(self._active)
+        }
+
+
+handler_profiler = HandlerProfiler(
+    settings.slow_handler_threshold_ms,
+    settings.slow_handler_max_entries,
+    settings.slow_handler_stack_depth
+)
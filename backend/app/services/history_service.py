@@ -0,0 +1,472 @@
+import asyncio
+import logging
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.config import settings
+from app.models.database import Database, HistoryRepository
+from app.services import operations
+from app.services.diff_executor import DiffExecutor, diff_executor
+from app.services.document_store import DocumentStore, RoomDocument, document_store
+from app.services.metrics import metrics
+from app.services.rope import Rope
+from app.services.wire_format import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+HISTORY_ENTRIES = metrics.counter(
+    "codestream_history_entries_total",
+    "Room history entries written, by kind",
+    ("kind",)
+)
+HISTORY_BYTES = metrics.counter(
+    "codestream_history_bytes_total",
+    "Compressed size of room history entries written, by kind",
+    ("kind",)
+)
+MATERIALIZE_SECONDS = metrics.histogram(
+    "codestream_history_materialize_seconds",
+    "Time to rebuild a room version from its keyframe and deltas"
+)
+
+
+# Entry payloads are plain functions of strings and bytes, so the diff
+# executor can run them on a worker process
+def encode_keyframe(text: str, level: int) -> bytes:
+    return zlib.compress(text.encode("utf-8"), level)
+
+
+def encode_delta(op: operations.Operation, level: int) -> bytes:
+    return zlib.compress(dumps(op).encode("utf-8"), level)
+
+
+def decode_keyframe(data: bytes) -> str:
+    return zlib.decompress(data).decode("utf-8")
+
+
+def decode_delta(data: bytes) -> operations.Operation:
+    return loads(zlib.decompress(data))
+
+
+# chain is a keyframe followed by the deltas leading to the wanted version
+def materialize_chain(chain: List[bytes]) -> str:
+    text = decode_keyframe(chain[0])
+    for data in chain[1:]:
+        text = operations.apply(text, decode_delta(data))
+    return text
+
+
+# Replays a run of entries, oldest first and starting at a keyframe, and
+# re-encodes only the versions in keep: each as a delta against the kept
+# version before it, with a keyframe every keyframe_interval entries. Texts
+# are dropped as soon as no later entry is based on them.
+def rebuild_entries(
+    entries: List[Dict[str, Any]],
+    keep: List[int],
+    keyframe_interval: int,
+    level: int
+) -> List[Dict[str, Any]]:
+    keep_versions = set(keep)
+    refs = Counter(entry["base_version"] for entry in entries if entry["depth"])
+    texts: Dict[int, str] = {}
+    rebuilt = []
+    previous: Optional[Tuple[int, str, int]] = None
+
+    for entry in entries:
+        version = entry["version"]
+
+        if not entry["depth"]:
+            text = decode_keyframe(entry["data"])
+        else:
+            base = entry["base_version"]
+            if base not in texts:
+                raise ValueError(f"History entry {version} is based on missing version {base}")
+            text = operations.apply(texts[base], decode_delta(entry["data"]))
+            refs[base] -= 1
+            if not refs[base]:
+                del texts[base]
+
+        if refs[version]:
+            texts[version] = text
+
+        if version not in keep_versions:
+            continue
+
+        if previous is None or previous[2] >= keyframe_interval:
+            depth, base_version = 0, None
+            data = encode_keyframe(text, level)
+        else:
+            depth, base_version = previous[2] + 1, previous[0]
+            data = encode_delta(operations.make_delta(previous[1], text), level)
+
+        rebuilt.append({
+            "version": version,
+            "depth": depth,
+            "base_version": base_version,
+            "data": data,
+            "length": len(text)
+        })
+        previous = (version, text, depth)
+
+    return rebuilt
+
+
+# The last entry recorded for a live room. The rope is shared with the
+# document rather than copied, so holding it costs little.
+class HistoryCursor:
+    __slots__ = ("version", "text", "depth")
+
+    def __init__(self, version: int, text: Rope, depth: int):
+        self.version = version
+        self.text = text
+        self.depth = depth
+
+
+# Records each changed room every history_interval seconds into the
+# room_history collection. An entry is a delta against the room's previous
+# entry, built by composing the operation log when it still covers the gap
+# and by diffing the two texts otherwise, and every
+# history_keyframe_interval entries it is a full keyframe instead. Any
+# version is then rebuilt from one keyframe and at most that many deltas.
+# Maintenance drops entries past retention and thins old ones, always
+# cutting at a keyframe so every remaining delta keeps its base.
+class HistoryService:
+    def __init__(self, document_store: DocumentStore, executor: DiffExecutor):
+        self.document_store = document_store
+        self.executor = executor
+
+        self._cursors: Dict[str, HistoryCursor] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._last_maintenance = time.monotonic()
+
+        self.keyframes = 0
+        self.deltas = 0
+        self.bytes_written = 0
+        self.write_failures = 0
+        self.materialized = 0
+        self.expired = 0
+        self.compacted = 0
+        self.last_maintenance: Dict[str, Any] = {}
+
+    def start(self) -> None:
+        if self._task is None and settings.history_enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.sleep(settings.history_interval)
+                repo = HistoryRepository(Database.get_db())
+                await self.run_tick(repo)
+
+                if time.monotonic() - self._last_maintenance >= settings.history_maintenance_interval:
+                    self._last_maintenance = time.monotonic()
+                    await self.run_maintenance(repo)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"History tick error: {e}")
+
+    async def run_tick(self, repo: HistoryRepository) -> int:
+        for room_id in list(self._cursors):
+            if self.document_store.get(room_id) is None:
+                del self._cursors[room_id]
+
+        changed = [
+            doc for doc in self.document_store.documents()
+            if doc.room_id not in self._cursors or doc.version > self._cursors[doc.room_id].version
+        ]
+        return await self.record(repo, changed)
+
+    # Last entry for a room whose document is being evicted
+    async def record_room(self, doc: RoomDocument) -> None:
+        if not settings.history_enabled:
+            return
+
+        try:
+            await self.record(HistoryRepository(Database.get_db()), [doc])
+        except Exception as e:
+            logger.error(f"Failed to record history for room {doc.room_id}: {e}")
+
+    async def record(self, repo: HistoryRepository, docs: List[RoomDocument]) -> int:
+        async with self._lock:
+            entries = []
+            cursors = {}
+
+            for doc in docs:
+                try:
+                    entry, cursor = await self._next_entry(repo, doc)
+                except Exception as e:
+                    logger.error(f"Failed to build history entry for room {doc.room_id}: {e}")
+                    continue
+
+                if entry is not None:
+                    entries.append(entry)
+                cursors[doc.room_id] = cursor
+
+            try:
+                await repo.save_entries(entries)
+            except Exception as e:
+                logger.error(f"Failed to write {len(entries)} history entries: {e}")
+                self.write_failures += 1
+                return 0
+
+            self._cursors.update(cursors)
+
+            for entry in entries:
+                if entry["depth"]:
+                    kind = "delta"
+                    self.deltas += 1
+                else:
+                    kind = "keyframe"
+                    self.keyframes += 1
+                self.bytes_written += entry["size"]
+                HISTORY_ENTRIES.inc(kind)
+                HISTORY_BYTES.inc(kind, amount=entry["size"])
+
+            return len(entries)
+
+    async def _next_entry(
+        self,
+        repo: HistoryRepository,
+        doc: RoomDocument
+    ) -> Tuple[Optional[Dict[str, Any]], HistoryCursor]:
+        text, version = doc.text, doc.version
+        cursor = self._cursors.get(doc.room_id)
+
+        if cursor is None:
+            latest = await repo.latest_entry(doc.room_id)
+            if latest is not None and latest["version"] == version:
+                # Recorded before a restart or by the room's previous owner
+                return None, HistoryCursor(version, text, latest["depth"])
+        elif cursor.version == version:
+            return None, cursor
+
+        level = settings.history_compression_level
+
+        if cursor is None or cursor.depth >= settings.history_keyframe_interval:
+            depth, base_version = 0, None
+            data = await self.executor.run(
+                "history_keyframe", encode_keyframe, str(text), level,
+                size=len(text), threshold=self.executor.document_bytes
+            )
+        else:
+            depth, base_version = cursor.depth + 1, cursor.version
+            op = self._logged_changes(doc, cursor.version, version)
+            if op is None:
+                op = await self.executor.make_delta(str(cursor.text), str(text))
+            data = await self.executor.run(
+                "history_delta", encode_delta, op, level,
+                size=operations.edit_size(op), threshold=self.executor.patch_bytes
+            )
+
+        entry = {
+            "room_id": doc.room_id,
+            "version": version,
+            "depth": depth,
+            "base_version": base_version,
+            "data": data,
+            "size": len(data),
+            "length": len(text),
+            "created_at": datetime.utcnow()
+        }
+        return entry, HistoryCursor(version, text, depth)
+
+    def _logged_changes(self, doc: RoomDocument, from_version: int, to_version: int) -> Optional[operations.Operation]:
+        entries = doc.oplog.since(from_version, to_version)
+        if (
+            entries is None
+            or len(entries) != to_version - from_version
+            or any(e.get("ops") is None for e in entries)
+        ):
+            return None
+
+        op: operations.Operation = []
+        for entry in entries:
+            op = operations.compose(op, entry["ops"])
+        return op
+
+    async def list_versions(
+        self,
+        repo: HistoryRepository,
+        room_id: str,
+        limit: int = 50,
+        before: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        return await repo.list_versions(room_id, limit, before)
+
+    async def materialize(self, repo: HistoryRepository, room_id: str, version: int) -> Optional[Dict[str, Any]]:
+        start = time.perf_counter()
+
+        keyframe = await repo.find_keyframe(room_id, max_version=version)
+        if keyframe is None:
+            return None
+
+        entries = {
+            entry["version"]: entry
+            for entry in await repo.get_entries(room_id, keyframe["version"], version)
+        }
+
+        target = entries.get(version)
+        if target is None:
+            return None
+
+        chain = [target]
+        while chain[-1]["depth"]:
+            base = entries.get(chain[-1]["base_version"])
+            if base is None:
+                logger.error(
+                    f"History for room {room_id} is missing version {chain[-1]['base_version']}, "
+                    f"the base of version {chain[-1]['version']}"
+                )
+                return None
+            chain.append(base)
+        chain.reverse()
+
+        code = await self.executor.run(
+            "history_materialize", materialize_chain, [entry["data"] for entry in chain],
+            size=target["length"], threshold=self.executor.document_bytes
+        )
+
+        self.materialized += 1
+        MATERIALIZE_SECONDS.observe(time.perf_counter() - start)
+
+        return {
+            "room_id": room_id,
+            "version": version,
+            "code": code,
+            "created_at": target["created_at"],
+            "deltas": len(chain) - 1
+        }
+
+    async def run_maintenance(self, repo: HistoryRepository) -> Dict[str, Any]:
+        start = time.monotonic()
+        now = datetime.utcnow()
+
+        retention_cutoff = None
+        if settings.history_retention_days > 0:
+            retention_cutoff = now - timedelta(days=settings.history_retention_days)
+
+        compact_cutoff = None
+        if settings.history_compact_after > 0 and settings.history_compact_spacing > 0:
+            compact_cutoff = now - timedelta(seconds=settings.history_compact_after)
+
+        cutoffs = [cutoff for cutoff in (retention_cutoff, compact_cutoff) if cutoff is not None]
+        expired = compacted = failed = 0
+
+        rooms = await repo.rooms_with_entries_before(max(cutoffs)) if cutoffs else []
+
+        for room_id in rooms:
+            try:
+                if retention_cutoff is not None:
+                    expired += await self.expire_room(repo, room_id, retention_cutoff)
+                if compact_cutoff is not None:
+                    compacted += await self.compact_room(repo, room_id, compact_cutoff)
+            except Exception as e:
+                logger.error(f"History maintenance failed for room {room_id}: {e}")
+                failed += 1
+
+        self.expired += expired
+        self.compacted += compacted
+        self.last_maintenance = {
+            "rooms": len(rooms),
+            "expired": expired,
+            "compacted": compacted,
+            "failed": failed,
+            "duration_ms": round((time.monotonic() - start) * 1000, 2)
+        }
+
+        if expired or compacted or failed:
+            logger.info(
+                f"History maintenance: expired={expired} compacted={compacted} "
+                f"failed={failed} across {len(rooms)} rooms"
+            )
+        return self.last_maintenance
+
+    # Drops everything before the newest keyframe older than the cutoff
+    async def expire_room(self, repo: HistoryRepository, room_id: str, cutoff: datetime) -> int:
+        keyframe = await repo.find_keyframe(room_id, created_before=cutoff)
+        if keyframe is None:
+            return 0
+        return await repo.delete_before(room_id, keyframe["version"])
+
+    # Thins entries before the newest keyframe older than the cutoff to one
+    # per history_compact_spacing, re-encoding from the keyframe at or
+    # before the first dropped entry so the already thinned past is left
+    # alone
+    async def compact_room(self, repo: HistoryRepository, room_id: str, cutoff: datetime) -> int:
+        boundary = await repo.find_keyframe(room_id, created_before=cutoff)
+        if boundary is None:
+            return 0
+
+        metas = await repo.get_entries(room_id, 0, boundary["version"] - 1, with_data=False)
+        spacing = timedelta(seconds=settings.history_compact_spacing)
+
+        keep = []
+        last_kept: Optional[datetime] = None
+        for meta in metas:
+            if last_kept is None or meta["created_at"] - last_kept >= spacing:
+                keep.append(meta["version"])
+                last_kept = meta["created_at"]
+
+        if len(keep) == len(metas):
+            return 0
+
+        kept = set(keep)
+        first_drop = next(i for i, meta in enumerate(metas) if meta["version"] not in kept)
+        start = next(
+            (meta for meta in reversed(metas[:first_drop]) if not meta["depth"]),
+            None
+        )
+        if start is None:
+            raise ValueError(f"no keyframe before version {metas[first_drop]['version']}")
+
+        metas = [meta for meta in metas if meta["version"] >= start["version"]]
+        entries = await repo.get_entries(room_id, start["version"], boundary["version"] - 1)
+
+        rebuilt = await self.executor.run(
+            "history_compact", rebuild_entries, entries,
+            [version for version in keep if version >= start["version"]],
+            settings.history_keyframe_interval, settings.history_compression_level,
+            size=sum(meta["length"] for meta in metas), threshold=self.executor.document_bytes
+        )
+
+        created_at = {meta["version"]: meta["created_at"] for meta in metas}
+        for entry in rebuilt:
+            entry["room_id"] = room_id
+            entry["size"] = len(entry["data"])
+            entry["created_at"] = created_at[entry["version"]]
+
+        dropped = [meta["version"] for meta in metas if meta["version"] not in kept]
+        await repo.rewrite_entries(room_id, rebuilt, dropped)
+        return len(dropped)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.history_enabled,
+            "rooms": len(self._cursors),
+            "keyframes": self.keyframes,
+            "deltas": self.deltas,
+            "bytes_written": self.bytes_written,
+            "write_failures": self.write_failures,
+            "materialized": self.materialized,
+            "expired": self.expired,
+            "compacted": self.compacted,
+            "last_maintenance": self.last_maintenance
+        }
+
+
+history_service = HistoryService(document_store, diff_executor)
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from typing import Dict, Any, Optional
+
+from app.config import settings
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+LOOP_LAG_SECONDS = metrics.histogram(
+    "codestream_event_loop_lag_seconds",
+    "How late the event loop woke a timer, sampled every loop_lag_interval_ms",
+    buckets=LAG_BUCKETS
+)
+
+
+# Sleeps for a fixed interval and records how much later than asked it woke
+# up. Anything holding the loop (a big diff, a large json.dumps) shows up as
+# lag for every room on the worker.
+class LoopMonitor:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+        self.samples = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0.0)
+
+            self.samples += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG_SECONDS.observe(lag)
+
+    def stats(self) -> Dict[str, Any]:
+        # Upper bound of the histogram bucket holding the 99th percentile
+        p99 = min(LOOP_LAG_SECONDS.quantile(0.99) or 0.0, self.max_lag)
+
+        return {
+            "samples": self.samples,
+            "last_lag_ms": round(self.last_lag * 1000, 3),
+            "p99_lag_ms": round(p99 * 1000, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3)
+        }
+
+
+loop_monitor = LoopMonitor(settings.loop_lag_interval_ms / 1000)
+
+metrics.gauge(
+    "codestream_event_loop_lag_last_seconds",
+    "Lag of the most recent event loop sample",
+    (),
+    lambda: {(): loop_monitor.last_lag}
+)
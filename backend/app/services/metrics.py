@@ -0,0 +1,212 @@
+import bisect
+import contextlib
+import functools
+import math
+import time
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+# Read only when rendered: collect returns the current value per label set,
+# so nothing is tracked on the hot path
+class Gauge:
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str],
+        collect: Callable[[], Dict[Tuple[str, ...], float]]
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in self.collect().items()
+        ]
+
+
+# Fixed buckets, counted per bucket on observe and only made cumulative
+# when rendered, so recording a sample is a bisect and two additions
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def count(self, *label_values: str) -> int:
+        series = self._series.get(label_values)
+        return series[2] if series else 0
+
+    def quantile(self, q: float, *label_values: str) -> Optional[float]:
+        series = self._series.get(label_values)
+        if not series or not series[2]:
+            return None
+
+        rank = q * series[2]
+        seen = 0
+        for bound, count in zip(self.buckets + (math.inf,), series[0]):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def samples(self) -> List[str]:
+        lines = []
+
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket
+                labels = _format_labels(self.labels, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+
+        return lines
+
+
+# Process-wide set of metrics, rendered in the Prometheus text format
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str],
+        collect: Callable[[], Dict[Tuple[str, ...], float]]
+    ) -> Gauge:
+        return self._register(Gauge(name, help_text, labels, collect))
+
+    def render(self) -> str:
+        lines = []
+
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+
+        return "\n".join(lines) + "\n"
+
+
+# Times a coroutine function into histogram, labelled with label_values and
+# then the function's name
+def timed(histogram: Histogram, *label_values: str):
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        labels = label_values + (func.__name__,)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs) -> T:
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+
+        return wrapper
+
+    return decorator
+
+
+metrics = MetricsRegistry()
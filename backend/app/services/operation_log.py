@@ -0,0 +1,63 @@
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, Any, List, Optional
+
+from app.services.operations import Operation
+
+
+class OperationLog:
+    def __init__(self, capacity: int):
+        self._entries: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+        self._saved_version = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def oldest_version(self) -> Optional[int]:
+        return self._entries[0]["version"] if self._entries else None
+
+    def append(
+        self,
+        version: int,
+        diff: str,
+        user_id: str,
+        ops: Optional[Operation] = None
+    ) -> None:
+        if self._entries and version != self._entries[-1]["version"] + 1:
+            self._entries.clear()
+
+        self._entries.append({
+            "version": version,
+            "diff": diff,
+            "user_id": user_id,
+            "ops": ops
+        })
+
+    def extend(self, entries: List[Dict[str, Any]]) -> None:
+        for entry in entries:
+            self.append(entry["version"], entry["diff"], entry["user_id"], entry.get("ops"))
+
+        if self._entries:
+            self._saved_version = self._entries[-1]["version"]
+
+    def since(self, version: int, current_version: int) -> Optional[List[Dict[str, Any]]]:
+        if version == current_version:
+            return []
+
+        oldest = self.oldest_version
+        if version > current_version or oldest is None or oldest > version + 1:
+            return None
+
+        return list(islice(self._entries, version + 1 - oldest, None))
+
+    def drain_unsaved(self, up_to_version: int) -> List[Dict[str, Any]]:
+        unsaved = [
+            e for e in self._entries
+            if self._saved_version < e["version"] <= up_to_version
+        ]
+
+        if unsaved:
+            self._saved_version = unsaved[-1]["version"]
+
+        return unsaved
@@ -0,0 +1,387 @@
+from typing import List, Tuple, Union, Optional, Any, Dict
+
+from diff_match_patch import diff_match_patch, patch_obj
+
+from app.services.rope import Rope
+
+# An operation is a list of components walked left to right over the
+# document: a positive int retains that many characters, a negative int
+# deletes that many, and a str inserts it. Anything past the last
+# component is implicitly retained.
+Component = Union[int, str]
+Operation = List[Component]
+Text = Union[str, Rope]
+
+
+def _push(op: Operation, component: Component) -> None:
+    if isinstance(component, str):
+        if not component:
+            return
+        if op and isinstance(op[-1], str):
+            op[-1] += component
+        elif op and op[-1] < 0:
+            # Keep inserts ahead of an adjacent delete so equal edits compare equal
+            if len(op) > 1 and isinstance(op[-2], str):
+                op[-2] += component
+            else:
+                op.insert(len(op) - 1, component)
+        else:
+            op.append(component)
+    elif component:
+        if op and not isinstance(op[-1], str) and (op[-1] > 0) == (component > 0):
+            op[-1] += component
+        else:
+            op.append(component)
+
+
+def normalize(op: Operation) -> Operation:
+    result: Operation = []
+    for component in op:
+        _push(result, component)
+    while result and not isinstance(result[-1], str) and result[-1] > 0:
+        result.pop()
+    return result
+
+
+def edit_size(op: Operation) -> int:
+    size = 0
+    for component in op:
+        if isinstance(component, str):
+            size += len(component)
+        elif component < 0:
+            size -= component
+    return size
+
+
+def from_wire(wire_ops: List[Dict[str, Any]]) -> Operation:
+    op: Operation = []
+
+    if not isinstance(wire_ops, list):
+        raise ValueError("ops must be a list")
+
+    for component in wire_ops:
+        if not isinstance(component, dict) or len(component) != 1:
+            raise ValueError(f"Invalid op component: {component!r}")
+
+        (kind, value), = component.items()
+
+        if kind == "insert" and isinstance(value, str):
+            _push(op, value)
+        elif kind in ("retain", "delete") and type(value) is int and value >= 0:
+            _push(op, value if kind == "retain" else -value)
+        else:
+            raise ValueError(f"Invalid op component: {component!r}")
+
+    return normalize(op)
+
+
+def to_wire(op: Operation) -> List[Dict[str, Any]]:
+    return [
+        {"insert": c} if isinstance(c, str) else {"retain": c} if c > 0 else {"delete": -c}
+        for c in op
+    ]
+
+
+def apply(text: str, op: Operation) -> str:
+    parts = []
+    pos = 0
+
+    for component in op:
+        if isinstance(component, str):
+            parts.append(component)
+        elif component > 0:
+            if pos + component > len(text):
+                raise ValueError("Retain past end of document")
+            parts.append(text[pos:pos + component])
+            pos += component
+        else:
+            if pos - component > len(text):
+                raise ValueError("Delete past end of document")
+            pos -= component
+
+    parts.append(text[pos:])
+    return "".join(parts)
+
+
+class _Cursor:
+    def __init__(self, op: Operation):
+        self.op = op
+        self.index = 0
+        self.offset = 0
+
+    def peek(self) -> Optional[Component]:
+        if self.index >= len(self.op):
+            return None
+        component = self.op[self.index]
+        if isinstance(component, str):
+            return component[self.offset:]
+        return component - self.offset if component > 0 else component + self.offset
+
+    def take(self, n: Optional[int] = None) -> None:
+        component = self.op[self.index]
+        size = len(component) if isinstance(component, str) else abs(component)
+        if n is None or size - self.offset == n:
+            self.index += 1
+            self.offset = 0
+        else:
+            self.offset += n
+
+
+# Returns (a', b') such that applying b' after a equals applying a' after b.
+# When both insert at the same position, a's text goes first.
+def transform(a: Operation, b: Operation) -> Tuple[Operation, Operation]:
+    a_prime: Operation = []
+    b_prime: Operation = []
+    ca, cb = _Cursor(a), _Cursor(b)
+
+    while True:
+        x, y = ca.peek(), cb.peek()
+
+        if x is None and y is None:
+            break
+
+        if isinstance(x, str):
+            _push(a_prime, x)
+            _push(b_prime, len(x))
+            ca.take()
+            continue
+
+        if isinstance(y, str):
+            _push(a_prime, len(y))
+            _push(b_prime, y)
+            cb.take()
+            continue
+
+        if x is None:
+            _push(b_prime, y)
+            if y > 0:
+                _push(a_prime, y)
+            cb.take()
+            continue
+
+        if y is None:
+            _push(a_prime, x)
+            if x > 0:
+                _push(b_prime, x)
+            ca.take()
+            continue
+
+        n = min(abs(x), abs(y))
+
+        if x > 0 and y > 0:
+            _push(a_prime, n)
+            _push(b_prime, n)
+        elif x < 0 < y:
+            _push(a_prime, -n)
+        elif y < 0 < x:
+            _push(b_prime, -n)
+
+        ca.take(n)
+        cb.take(n)
+
+    return normalize(a_prime), normalize(b_prime)
+
+
+# Returns a single operation equivalent to applying a and then b.
+def compose(a: Operation, b: Operation) -> Operation:
+    result: Operation = []
+    ca, cb = _Cursor(a), _Cursor(b)
+
+    while True:
+        x, y = ca.peek(), cb.peek()
+
+        if x is None and y is None:
+            break
+
+        if isinstance(x, int) and x < 0:
+            _push(result, x)
+            ca.take()
+            continue
+
+        if isinstance(y, str) or x is None:
+            _push(result, y)
+            cb.take()
+            continue
+
+        if y is None:
+            _push(result, x)
+            ca.take()
+            continue
+
+        n = min(len(x) if isinstance(x, str) else x, abs(y))
+
+        if isinstance(x, str):
+            if y > 0:
+                _push(result, x[:n])
+        else:
+            _push(result, n if y > 0 else -n)
+
+        ca.take(n)
+        cb.take(n)
+
+    return normalize(result)
+
+
+def transform_against(op: Operation, committed: List[Operation]) -> Operation:
+    for other in committed:
+        _, op = transform(other, op)
+    return op
+
+
+# Patch offsets are positions in the text with the earlier patches already
+# applied, so gaps between patches are unchanged runs and the context of
+# neighbouring patches may overlap. When base_text is given, context and
+# deleted text must match it exactly.
+def from_patches(patches: List[Any], base_text: Optional[Text] = None) -> Operation:
+    op: Operation = []
+    out_pos = 0
+    src_pos = 0
+
+    def check(text: str) -> None:
+        if base_text is not None and base_text[src_pos:src_pos + len(text)] != text:
+            raise ValueError("Patch context does not match document")
+
+    for patch in patches:
+        pos = patch.start2
+
+        for diff_type, text in patch.diffs:
+            if diff_type == diff_match_patch.DIFF_EQUAL:
+                end = pos + len(text)
+                if end > out_pos:
+                    gap = pos - out_pos
+                    if gap > 0:
+                        _push(op, gap)
+                        src_pos += gap
+                    fresh = text[max(-gap, 0):]
+                    check(fresh)
+                    _push(op, len(fresh))
+                    src_pos += len(fresh)
+                    out_pos = end
+                pos = end
+                continue
+
+            if pos < out_pos:
+                # The edit falls inside the previous patch's trailing context
+                back = out_pos - pos
+                if not op or isinstance(op[-1], str) or op[-1] < back:
+                    raise ValueError("Overlapping patches")
+                op[-1] -= back
+                if not op[-1]:
+                    op.pop()
+                out_pos -= back
+                src_pos -= back
+
+            _push(op, pos - out_pos)
+            src_pos += pos - out_pos
+            out_pos = pos
+
+            if diff_type == diff_match_patch.DIFF_INSERT:
+                _push(op, text)
+                out_pos += len(text)
+                pos += len(text)
+            else:
+                check(text)
+                _push(op, -len(text))
+                src_pos += len(text)
+
+    if base_text is not None and src_pos > len(base_text):
+        raise ValueError("Patch extends past end of document")
+
+    return normalize(op)
+
+
+# Builds the patches straight from the op, cutting context out of base_text
+# by slicing, so the cost follows the size of the edit rather than the size
+# of the document.
+def to_patches(base_text: Text, op: Operation, margin: int) -> List[patch_obj]:
+    edits: List[List[Any]] = []
+    pos = 0
+
+    for component in op:
+        if isinstance(component, int) and component > 0:
+            pos += component
+            continue
+
+        if edits and edits[-1][0] + edits[-1][1] == pos:
+            edit = edits[-1]
+        else:
+            edit = [pos, 0, ""]
+            edits.append(edit)
+
+        if isinstance(component, str):
+            edit[2] += component
+        else:
+            edit[1] -= component
+            pos -= component
+
+    groups: List[List[List[Any]]] = []
+    for edit in edits:
+        if groups and edit[0] - (groups[-1][-1][0] + groups[-1][-1][1]) <= 2 * margin:
+            groups[-1].append(edit)
+        else:
+            groups.append([edit])
+
+    patches = []
+    shift = 0
+
+    for group in groups:
+        start = max(group[0][0] - margin, 0)
+        end = min(group[-1][0] + group[-1][1] + margin, len(base_text))
+        diffs = []
+        cursor = start
+
+        for edit_pos, deleted, inserted in group:
+            if edit_pos > cursor:
+                diffs.append((diff_match_patch.DIFF_EQUAL, base_text[cursor:edit_pos]))
+            if deleted:
+                diffs.append((diff_match_patch.DIFF_DELETE, base_text[edit_pos:edit_pos + deleted]))
+            if inserted:
+                diffs.append((diff_match_patch.DIFF_INSERT, inserted))
+            cursor = edit_pos + deleted
+
+        if end > cursor:
+            diffs.append((diff_match_patch.DIFF_EQUAL, base_text[cursor:end]))
+
+        patch = patch_obj()
+        patch.diffs = diffs
+        patch.start1 = patch.start2 = start + shift
+        patch.length1 = end - start
+        patch.length2 = patch.length1 + sum(len(e[2]) - e[1] for e in group)
+        shift += patch.length2 - patch.length1
+        patches.append(patch)
+
+    return patches
+
+
+def to_patch_text(dmp: diff_match_patch, base_text: Text, op: Operation) -> str:
+    return dmp.patch_toText(to_patches(base_text, op, dmp.Patch_Margin))
+
+
+# Plain functions of strings and patches, so the diff executor can hand them
+# to a worker process without shipping a document along
+_dmp = diff_match_patch()
+
+
+def parse_patch_text(patch_text: str) -> List[patch_obj]:
+    return _dmp.patch_fromText(patch_text)
+
+
+def format_patches(patches: List[patch_obj]) -> str:
+    return _dmp.patch_toText(patches)
+
+
+def make_patch_text(old_text: str, new_text: str) -> str:
+    return _dmp.patch_toText(_dmp.patch_make(old_text, new_text))
+
+
+# An op taking old_text to new_text, for when only the two texts are known
+def make_delta(old_text: str, new_text: str) -> Operation:
+    op: Operation = []
+
+    for diff_type, text in _dmp.diff_main(old_text, new_text, False):
+        if diff_type == diff_match_patch.DIFF_INSERT:
+            _push(op, text)
+        else:
+            _push(op, len(text) if diff_type == diff_match_patch.DIFF_EQUAL else -len(text))
+
+    return normalize(op)
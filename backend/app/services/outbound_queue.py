@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Any, Optional, Tuple
+
+from fastapi import WebSocket
+
+from app.services.metrics import metrics
+from app.services.wire_format import Frame
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DELAY_SECONDS = metrics.histogram(
+    "codestream_outbound_delay_seconds",
+    "Time a frame waits in a connection's outbound queue before it is written"
+)
+
+OVERFLOW_POLICIES = ("drop_stale", "coalesce", "disconnect")
+
+# Close code for a consumer that fell too far behind; the client reconnects
+# and catches up from the operation log
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class OutboundQueue:
+    def __init__(
+        self,
+        websocket: WebSocket,
+        max_size: int,
+        policy: str = "drop_stale",
+        send_timeout: float = 10.0
+    ):
+        self.websocket = websocket
+        self.max_size = max_size
+        self.policy = policy if policy in OVERFLOW_POLICIES else "drop_stale"
+        self.send_timeout = send_timeout
+
+        # (key, frame, queued at). Frames with a key are superseded by the
+        # next frame with the same key (a user's cursor, the user list) and
+        # may be dropped or merged.
+        self._frames: Deque[Tuple[Optional[str], Frame, float]] = deque()
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.closed = False
+        self.slow = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def put(self, frame: Frame, key: Optional[str] = None) -> bool:
+        if self.closed:
+            return False
+
+        if len(self._frames) >= self.max_size and not self._make_room(key):
+            if key is not None:
+                self.dropped += 1
+                return False
+
+            self._disconnect_slow(f"outbound queue full ({self.max_size} frames)")
+            return False
+
+        self._frames.append((key, frame, time.perf_counter()))
+        self.max_depth = max(self.max_depth, len(self._frames))
+        self._ready.set()
+        return True
+
+    def _make_room(self, key: Optional[str]) -> bool:
+        if self.policy == "drop_stale":
+            for i, (queued_key, _, _) in enumerate(self._frames):
+                if queued_key is not None:
+                    del self._frames[i]
+                    self.dropped += 1
+                    return True
+            return False
+
+        if self.policy == "coalesce":
+            kept: Deque[Tuple[Optional[str], Frame, float]] = deque()
+            seen = {key}
+
+            for entry in reversed(self._frames):
+                queued_key = entry[0]
+                if queued_key is not None:
+                    if queued_key in seen:
+                        self.coalesced += 1
+                        continue
+                    seen.add(queued_key)
+                kept.appendleft(entry)
+
+            self._frames = kept
+            return len(self._frames) < self.max_size
+
+        return False
+
+    def _disconnect_slow(self, reason: str) -> None:
+        if self.closed:
+            return
+
+        logger.warning(f"Disconnecting slow consumer: {reason}")
+        self.slow = True
+        self.closed = True
+        self.dropped += len(self._frames)
+        self._frames.clear()
+        self._ready.set()
+
+    async def close(self) -> None:
+        self.closed = True
+        self._frames.clear()
+
+        if self._task and self._task is not asyncio.current_task():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        try:
+            while not self.closed:
+                await self._ready.wait()
+                self._ready.clear()
+
+                while self._frames and not self.closed:
+                    _, frame, queued_at = self._frames.popleft()
+                    async with asyncio.timeout(self.send_timeout):
+                        if isinstance(frame, bytes):
+                            await self.websocket.send_bytes(frame)
+                        else:
+                            await self.websocket.send_text(frame)
+                    self.sent += 1
+                    QUEUE_DELAY_SECONDS.observe(time.perf_counter() - queued_at)
+        except asyncio.TimeoutError:
+            self._disconnect_slow(f"send blocked for over {self.send_timeout}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"Outbound writer stopped: {e}")
+            self.closed = True
+            self._frames.clear()
+
+        if self.slow:
+            try:
+                await asyncio.wait_for(
+                    self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE),
+                    timeout=self.send_timeout
+                )
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": len(self._frames),
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced
+        }
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.config import settings
+from app.models.database import Database, RoomRepository, OperationRepository
+from app.services.document_store import RoomDocument
+
+logger = logging.getLogger(__name__)
+
+
+class PersistenceService:
+    def __init__(self):
+        self._dirty: Dict[str, Tuple[RoomDocument, float]] = {}
+        self._dirty_bytes = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.flushes = 0
+        self.rooms_written = 0
+        self.versions_coalesced = 0
+        self.write_failures = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def mark_dirty(self, doc: RoomDocument, nbytes: int) -> None:
+        if doc.room_id not in self._dirty:
+            self._dirty[doc.room_id] = (doc, time.monotonic())
+
+        self._dirty_bytes += nbytes
+
+        if self._wakeup and self._dirty_bytes >= settings.persist_flush_bytes:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        while self._dirty:
+            if not await self.flush():
+                logger.error(f"Dropping {len(self._dirty)} unsaved rooms on shutdown")
+                break
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(),
+                        timeout=settings.persist_flush_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+                self._wakeup.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Write-behind flush error: {e}")
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+
+            pending = [
+                entry for entry in self._dirty.values()
+                if entry[0].version > entry[0].persisted_version
+            ]
+            self._dirty = {}
+            self._dirty_bytes = 0
+
+            written = 0
+            batch_size = settings.persist_batch_size
+            for i in range(0, len(pending), batch_size):
+                written += await self._write_batch(pending[i:i + batch_size])
+
+            return written
+
+    async def flush_room(self, room_id: str) -> bool:
+        async with self._flush_lock:
+            entry = self._dirty.pop(room_id, None)
+
+            if entry is None or entry[0].version <= entry[0].persisted_version:
+                return True
+
+            return await self._write_batch([entry]) > 0
+
+    async def _write_batch(self, batch: List[Tuple[RoomDocument, float]]) -> int:
+        updates = [(doc.room_id, doc.code, doc.version) for doc, _ in batch]
+        start = time.monotonic()
+
+        try:
+            db = Database.get_db()
+            await RoomRepository(db).bulk_update_code(updates)
+        except Exception as e:
+            logger.error(f"Write-behind batch of {len(batch)} rooms failed: {e}")
+            self.write_failures += 1
+            for doc, dirty_since in batch:
+                self._dirty.setdefault(doc.room_id, (doc, dirty_since))
+            return 0
+
+        if settings.oplog_persist:
+            await self._write_operations(OperationRepository(db), batch, updates)
+
+        now = time.monotonic()
+        elapsed_ms = (now - start) * 1000
+
+        for (doc, dirty_since), (_, _, version) in zip(batch, updates):
+            self.versions_coalesced += max(version - doc.persisted_version - 1, 0)
+            doc.persisted_version = max(doc.persisted_version, version)
+            self.max_lag_ms = max(self.max_lag_ms, (now - dirty_since) * 1000)
+
+        self.flushes += 1
+        self.rooms_written += len(batch)
+        self.last_batch_size = len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+        self.last_flush_ms = elapsed_ms
+        self.total_flush_ms += elapsed_ms
+
+        logger.debug(f"Write-behind flushed {len(batch)} rooms in {elapsed_ms:.1f}ms")
+        return len(batch)
+
+    async def _write_operations(
+        self,
+        op_repo: OperationRepository,
+        batch: List[Tuple[RoomDocument, float]],
+        updates: List[Tuple[str, str, int]]
+    ) -> None:
+        for (doc, _), (_, _, version) in zip(batch, updates):
+            try:
+                await op_repo.insert_operations(doc.room_id, doc.oplog.drain_unsaved(version))
+            except Exception as e:
+                logger.error(f"Failed to persist operation log for room {doc.room_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        oldest = min((since for _, since in self._dirty.values()), default=now)
+
+        return {
+            "pending_rooms": len(self._dirty),
+            "pending_bytes": self._dirty_bytes,
+            "current_lag_ms": round((now - oldest) * 1000, 2),
+            "max_lag_ms": round(self.max_lag_ms, 2),
+            "flushes": self.flushes,
+            "rooms_written": self.rooms_written,
+            "versions_coalesced": self.versions_coalesced,
+            "write_failures": self.write_failures,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0
+        }
+
+
+persistence_service = PersistenceService()
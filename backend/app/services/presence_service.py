@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from typing import Dict, Any, Optional
+
+from app.config import settings
+from app.services.connection_manager import ConnectionManager, manager
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceService:
+    def __init__(self, connection_manager: ConnectionManager):
+        self.manager = connection_manager
+        self._pending: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+        self.updates_received = 0
+        self.updates_coalesced = 0
+        self.frames_sent = 0
+
+    def update_cursor(
+        self,
+        room_id: str,
+        user_id: str,
+        username: str,
+        color: str,
+        position: Dict[str, int],
+        selection: Optional[Dict[str, Any]] = None
+    ) -> None:
+        pending = self._pending.setdefault(room_id, {})
+
+        self.updates_received += 1
+        if user_id in pending:
+            self.updates_coalesced += 1
+
+        pending[user_id] = {
+            "user_id": user_id,
+            "username": username,
+            "color": color,
+            "position": position,
+            "selection": selection
+        }
+
+        if room_id not in self._tasks:
+            self._tasks[room_id] = asyncio.create_task(self._run(room_id))
+
+    # Sends the first move after a quiet spell right away, then at most one
+    # frame per tick, and stops once a whole tick passes with no movement
+    async def _run(self, room_id: str) -> None:
+        try:
+            while self._pending.get(room_id):
+                try:
+                    await self.flush(room_id)
+                except Exception as e:
+                    logger.error(f"Cursor flush failed for room {room_id}: {e}")
+                await asyncio.sleep(settings.presence_tick_ms / 1000)
+        finally:
+            self._tasks.pop(room_id, None)
+
+    async def flush(self, room_id: str) -> None:
+        pending = self._pending.pop(room_id, None)
+
+        if not pending or room_id not in self.manager.rooms:
+            return
+
+        # Skip users who left while their last move was waiting
+        present = {
+            self.manager.connection_users.get(ws, {}).get("user_id")
+            for ws in self.manager.rooms[room_id]
+        }
+        cursors = [cursor for user_id, cursor in pending.items() if user_id in present]
+
+        if cursors:
+            await self.manager.broadcast_cursors(room_id, cursors)
+            self.frames_sent += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tick_ms": settings.presence_tick_ms,
+            "updates_received": self.updates_received,
+            "updates_coalesced": self.updates_coalesced,
+            "frames_sent": self.frames_sent,
+            "pending_rooms": len(self._pending)
+        }
+
+
+presence_service = PresenceService(manager)
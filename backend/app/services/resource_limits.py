@@ -0,0 +1,189 @@
+import os
+import signal
+import struct
+import sys
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; runs there only get the wall-clock timeout
+    resource = None
+
+from app.config import settings
+from app.models.schemas import Language, ResourceUsage
+
+# RLIMIT_NPROC counts every process the uid owns, not just the run's own,
+# and root ignores it. It only caps a run when runs have a uid to themselves.
+RLIMITS = {
+    "cpu_seconds": "RLIMIT_CPU",
+    "memory_bytes": "RLIMIT_AS",
+    "processes": "RLIMIT_NPROC",
+    "file_bytes": "RLIMIT_FSIZE",
+    "open_files": "RLIMIT_NOFILE"
+}
+
+# Signals the kernel sends when a run goes over one of its rlimits
+LIMIT_SIGNALS = {
+    getattr(signal, name): limit
+    for name, limit in (("SIGXCPU", "cpu_seconds"), ("SIGXFSZ", "file_bytes"))
+    if hasattr(signal, name)
+}
+
+
+def limits_for(language: Language) -> Dict[str, int]:
+    return settings.execution_limits.get(language.value, {})
+
+
+def output_limit(limits: Dict[str, int]) -> int:
+    return limits.get("output_bytes") or sys.maxsize
+
+
+# (resource, soft, hard) triples for the limits that are set. The CPU limit
+# leaves a second between SIGXCPU and the kernel's SIGKILL.
+def rlimits(limits: Dict[str, int]) -> List[Tuple[int, int, int]]:
+    if resource is None:
+        return []
+
+    result = []
+    for name, attr in RLIMITS.items():
+        value = limits.get(name, 0)
+        if value > 0:
+            hard = value + 1 if name == "cpu_seconds" else value
+            result.append((getattr(resource, attr), value, hard))
+
+    return result
+
+
+# Runs in the child between fork and exec. Limits can only be lowered, so
+# anything above the current hard limit is clamped to it.
+def apply_rlimits(limits: List[Tuple[int, int, int]]) -> None:
+    for res, soft, hard in limits:
+        _, max_hard = resource.getrlimit(res)
+        if max_hard != resource.RLIM_INFINITY:
+            soft, hard = min(soft, max_hard), min(hard, max_hard)
+        resource.setrlimit(res, (soft, hard))
+
+
+PID = struct.Struct("=i")
+# Wait status, user and system CPU seconds, max RSS in KB
+EXIT = struct.Struct("=iddq")
+
+
+# Runs in the child between fork and exec for a cold run, which has no fork
+# server to reap it. The child forks again: the grandchild leads its own
+# session, takes the limits and goes on to exec the program, while the
+# child stays behind to wait4 for it. The child writes the program's pid
+# to report_fd before anything else, then its wait status and rusage once
+# it exits.
+def fork_and_report(report_fd: int, limits: List[Tuple[int, int, int]]) -> None:
+    pid = os.fork()
+    if pid == 0:
+        os.close(report_fd)
+        os.setsid()
+        apply_rlimits(limits)
+        return
+
+    try:
+        os.write(report_fd, PID.pack(pid))
+        # Popen waits for every copy of its exec error pipe to close, so
+        # only report_fd is kept
+        os.closerange(0, report_fd)
+        os.closerange(report_fd + 1, os.sysconf("SC_OPEN_MAX"))
+
+        _, wait_status, rusage = os.wait4(pid, 0)
+        os.write(report_fd, EXIT.pack(wait_status, rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss))
+    finally:
+        os._exit(0)
+
+
+# The parent's end of fork_and_report for one cold run
+class UsageReport:
+    supported = resource is not None and hasattr(os, "fork")
+
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        self.pid: Optional[int] = None
+
+    def preexec(self, limits: Dict[str, int]) -> Callable[[], None]:
+        return partial(fork_and_report, self.write_fd, rlimits(limits))
+
+    # The pid is written before the exec error pipe closes, so it is
+    # already waiting once the process has started
+    def started(self) -> None:
+        os.close(self.write_fd)
+        self.write_fd = -1
+        os.set_blocking(self.read_fd, False)
+
+        try:
+            data = os.read(self.read_fd, PID.size)
+        except BlockingIOError:
+            return
+        if len(data) == PID.size:
+            (self.pid,) = PID.unpack(data)
+
+    # Takes out the program and anything it left running, while the reaper
+    # survives to report how it exited
+    def kill(self) -> None:
+        if self.pid is None:
+            return
+
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            # Not its own session leader yet
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    # (exit code, usage) once the reaper has exited, or None when it died
+    # without reporting
+    def result(self) -> Optional[Tuple[int, ResourceUsage]]:
+        try:
+            data = os.read(self.read_fd, EXIT.size)
+        except BlockingIOError:
+            return None
+        if len(data) != EXIT.size:
+            return None
+
+        wait_status, user, system, max_rss = EXIT.unpack(data)
+        usage = ResourceUsage(
+            cpu_user_ms=round(user * 1000, 3),
+            cpu_system_ms=round(system * 1000, 3),
+            max_rss_kb=max_rss
+        )
+        return os.waitstatus_to_exitcode(wait_status), usage
+
+    def close(self) -> None:
+        for fd in (self.read_fd, self.write_fd):
+            if fd >= 0:
+                os.close(fd)
+        self.read_fd = self.write_fd = -1
+
+
+# Returns (limit exceeded, message) for a run killed by signum
+def describe_kill(
+    signum: int,
+    limits: Dict[str, int],
+    usage: Optional[ResourceUsage] = None
+) -> Tuple[Optional[str], str]:
+    limit = LIMIT_SIGNALS.get(signum)
+
+    if limit is None and signum == getattr(signal, "SIGKILL", None) and usage is not None:
+        cpu_seconds = limits.get("cpu_seconds", 0)
+        if cpu_seconds and (usage.cpu_user_ms + usage.cpu_system_ms) / 1000 >= cpu_seconds:
+            limit = "cpu_seconds"
+
+    if limit == "cpu_seconds":
+        return limit, f"CPU time limit exceeded ({limits.get(limit)}s)"
+    if limit == "file_bytes":
+        return limit, f"File size limit exceeded ({limits.get(limit)} bytes)"
+
+    try:
+        name = signal.Signals(signum).name
+    except ValueError:
+        name = f"signal {signum}"
+
+    return None, f"Process killed ({name})"
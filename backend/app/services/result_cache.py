@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Any, Tuple
+
+from app.config import settings
+from app.models.schemas import Language, CodeExecutionResponse
+from app.services.resource_limits import limits_for
+from app.services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+# Results of runs that asked to be cached, keyed by everything that can
+# change what a deterministic program prints. Identical runs arriving while
+# one is in flight wait for it instead of running again.
+class ResultCache:
+    def __init__(self, ttl: float, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # key -> (expires at, size, result), oldest use first
+        self._entries: "OrderedDict[str, Tuple[float, int, CodeExecutionResponse]]" = OrderedDict()
+        self._inflight = SingleFlight()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def key_for(self, code: str, language: Language, input_data: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(json.dumps({
+            "language": language.value,
+            "limits": limits_for(language),
+            "timeout": settings.code_execution_timeout,
+            "flags": settings.cpp_compile_flags if language == Language.CPP else []
+        }, sort_keys=True).encode())
+        digest.update(b"\0" + hashlib.sha256(code.encode("utf-8")).digest())
+        digest.update(b"\0" + hashlib.sha256(input_data.encode("utf-8")).digest())
+        return digest.hexdigest()
+
+    async def get_or_run(
+        self,
+        key: str,
+        run: Callable[[], Awaitable[CodeExecutionResponse]]
+    ) -> CodeExecutionResponse:
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            expires_at, size, result = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result.model_copy(update={"cached": True})
+            self._drop(key)
+            self.expired += 1
+
+        async def miss() -> CodeExecutionResponse:
+            self.misses += 1
+            return await run()
+
+        result, shared = await self._inflight.run(key, miss)
+        if shared:
+            self.coalesced += 1
+            return result.model_copy(update={"cached": True})
+
+        # A run that didn't finish (timeout, worker failure, compile error)
+        # says nothing about the program's output
+        if result.exit_code is not None:
+            self._store(key, result)
+
+        return result
+
+    def _store(self, key: str, result: CodeExecutionResponse) -> None:
+        size = len(result.output) + len(result.error or "")
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._drop(key)
+
+        self._entries[key] = (time.monotonic() + self.ttl, size, result)
+        self.total_bytes += size
+
+        while self.total_bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions
+        }
+
+
+result_cache = ResultCache(settings.execution_cache_ttl, settings.execution_cache_max_bytes)
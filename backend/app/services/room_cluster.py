@@ -0,0 +1,353 @@
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Callable, Tuple, Set
+
+from app.config import settings
+from app.services.backplane import Backplane, create_backplane
+from app.services.connection_manager import ConnectionManager, manager
+from app.services.edit_queue import EditQueue, PendingEdit
+from app.services.sync_service import SyncService, create_sync_service
+from app.services.wire_format import envelope
+
+logger = logging.getLogger(__name__)
+
+
+class RoomNotOwnedError(RuntimeError):
+    pass
+
+
+# Every room has one owning node, chosen by a lease on the backplane. The
+# owner holds the document and sequences all edits; other nodes forward sync
+# and edit requests to it and relay the resulting broadcasts to their own
+# sockets.
+class RoomCluster:
+    def __init__(
+        self,
+        connection_manager: ConnectionManager,
+        backplane: Backplane,
+        sync_factory: Callable[[], SyncService]
+    ):
+        self.manager = connection_manager
+        self.backplane = backplane
+        self.sync_factory = sync_factory
+        self.owned: Set[str] = set()
+        self._owners: Dict[str, str] = {}
+        self._members: Dict[str, int] = {}
+        self._edit_queues: Dict[str, EditQueue] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.forwarded = 0
+        self.served = 0
+        self.handoffs = 0
+        self.edit_batches = 0
+        self.queued_edits = 0
+
+    @property
+    def node_id(self) -> str:
+        return self.backplane.node_id
+
+    @staticmethod
+    def lease_key(room_id: str) -> str:
+        return f"room-owner:{room_id}"
+
+    async def start(self) -> None:
+        await self.backplane.start()
+        self.backplane.on_request(self._serve)
+        self.manager.attach_backplane(self.backplane)
+        self._task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for room_id in list(self._edit_queues):
+            await self._close_edit_queue(room_id)
+
+        for room_id in list(self.owned):
+            await self._give_up(room_id)
+
+        await self.backplane.stop()
+
+    async def join(self, room_id: str) -> None:
+        self._members[room_id] = self._members.get(room_id, 0) + 1
+        await self._resolve_owner(room_id)
+
+    async def leave(self, room_id: str) -> None:
+        members = self._members.get(room_id, 0) - 1
+
+        if members > 0:
+            self._members[room_id] = members
+            return
+
+        self._members.pop(room_id, None)
+        await self._close_edit_queue(room_id)
+        self._owners.pop(room_id, None)
+
+        if room_id in self.owned and not self.manager.has_remote_users(room_id):
+            await self._give_up(room_id)
+
+    async def _resolve_owner(self, room_id: str) -> str:
+        async with self._lock:
+            if room_id in self.owned:
+                return self.node_id
+
+            owner = None
+            for _ in range(3):
+                owner = await self.backplane.claim(self.lease_key(room_id), settings.room_lease_ttl)
+                if owner:
+                    break
+
+            if owner is None:
+                raise RuntimeError(f"Could not resolve an owner for room {room_id}")
+
+            if owner == self.node_id:
+                try:
+                    await self.sync_factory().open_document(room_id)
+                except Exception:
+                    await self.backplane.release(self.lease_key(room_id))
+                    raise
+                self.owned.add(room_id)
+                await self.manager.watch_room(room_id)
+                logger.info(f"Node {self.node_id} now owns room {room_id}")
+
+            self._owners[room_id] = owner
+            return owner
+
+    async def _give_up(self, room_id: str) -> None:
+        async with self._lock:
+            if room_id not in self.owned:
+                return
+
+            self.owned.discard(room_id)
+            self._owners.pop(room_id, None)
+            await self.manager.unwatch_room(room_id)
+
+            try:
+                await self.sync_factory().close_document(room_id)
+            finally:
+                await self.backplane.release(self.lease_key(room_id))
+
+            self.handoffs += 1
+            logger.info(f"Node {self.node_id} released room {room_id}")
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.sleep(settings.room_lease_ttl / 3)
+                await self._heartbeat()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Room lease heartbeat error: {e}")
+
+    async def _heartbeat(self) -> None:
+        for room_id in list(self.owned):
+            if room_id not in self._members and not self.manager.has_remote_users(room_id):
+                await self._give_up(room_id)
+            elif not await self.backplane.renew(self.lease_key(room_id), settings.room_lease_ttl):
+                logger.warning(f"Lost the lease for room {room_id}, handing it off")
+                await self._give_up(room_id)
+
+        for room_id in list(self._members):
+            await self.manager.publish_presence(room_id)
+
+    async def sync_message(
+        self,
+        room_id: str,
+        last_version: Optional[int],
+        edit_format: str
+    ) -> Dict[str, Any]:
+        return await self._call(room_id, {
+            "op": "sync",
+            "room_id": room_id,
+            "last_version": last_version,
+            "format": edit_format
+        })
+
+    # Queues an edit behind the room's other pending edits and returns
+    # straight away; the author is acked once its batch has been applied
+    def submit_edit(
+        self,
+        room_id: str,
+        user_id: str,
+        user_version: int,
+        diff: Optional[str] = None,
+        ops: Optional[Any] = None,
+        future: Optional[asyncio.Future] = None
+    ) -> None:
+        queue = self._edit_queues.get(room_id)
+
+        if queue is None:
+            queue = self._edit_queues[room_id] = EditQueue(
+                room_id, self._flush_edits, settings.edit_batch_max
+            )
+            queue.start()
+
+        queue.put({"user_id": user_id, "version": user_version, "diff": diff, "ops": ops}, future)
+
+    async def apply_edit(
+        self,
+        room_id: str,
+        user_id: str,
+        user_version: int,
+        diff: Optional[str] = None,
+        ops: Optional[Any] = None
+    ) -> Tuple[bool, int]:
+        future = asyncio.get_running_loop().create_future()
+        self.submit_edit(room_id, user_id, user_version, diff=diff, ops=ops, future=future)
+        return await future
+
+    async def _close_edit_queue(self, room_id: str) -> None:
+        queue = self._edit_queues.pop(room_id, None)
+        if queue is None:
+            return
+
+        await queue.close()
+        self.edit_batches += queue.batches
+        self.queued_edits += queue.edits
+
+    async def _flush_edits(self, room_id: str, batch: List[PendingEdit]) -> None:
+        edits = [edit for edit, _ in batch]
+
+        try:
+            result = await self._call(room_id, {"op": "edits", "room_id": room_id, "edits": edits})
+        except Exception as e:
+            logger.error(f"Failed to apply {len(edits)} edits for room {room_id}: {e}")
+
+            for edit, future in batch:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            for user_id in dict.fromkeys(edit["user_id"] for edit, future in batch if future is None):
+                await self.manager.send_personal_message(user_id, envelope("error", {"error": str(e)}))
+            return
+
+        # One ack per author, carrying the version after its last edit
+        acks: Dict[str, int] = {}
+
+        for (edit, future), outcome in zip(batch, result["results"]):
+            if future is not None and not future.done():
+                future.set_result((outcome["success"], outcome["version"]))
+            if outcome["success"]:
+                acks[edit["user_id"]] = outcome["version"]
+
+        for user_id, version in acks.items():
+            await self.manager.send_personal_message(user_id, envelope("ack", {"version": version}))
+
+    async def _call(self, room_id: str, payload: Dict[str, Any]) -> Any:
+        error: Optional[Exception] = None
+
+        for attempt in range(3):
+            owner = self._owners.get(room_id) or await self._resolve_owner(room_id)
+
+            if owner == self.node_id:
+                try:
+                    return await self._serve(payload)
+                except RoomNotOwnedError as e:
+                    error = e
+            else:
+                try:
+                    self.forwarded += 1
+                    return await self.backplane.request(
+                        owner, payload, timeout=settings.backplane_request_timeout
+                    )
+                except (asyncio.TimeoutError, RuntimeError) as e:
+                    error = e
+
+            # The owner moved or went away; look it up again
+            self._owners.pop(room_id, None)
+            await asyncio.sleep(0.05 * attempt)
+
+        raise RuntimeError(f"Room {room_id} owner unavailable: {error}")
+
+    async def _serve(self, payload: Dict[str, Any]) -> Any:
+        room_id = payload["room_id"]
+
+        if room_id not in self.owned:
+            raise RoomNotOwnedError(f"Node {self.node_id} does not own room {room_id}")
+
+        self.served += 1
+        sync_service = self.sync_factory()
+
+        if payload["op"] == "sync":
+            return await self._sync_message(
+                sync_service, room_id, payload.get("last_version"), payload.get("format", "patch")
+            )
+
+        if payload["op"] == "edits":
+            return await self._apply_edits(sync_service, room_id, payload["edits"])
+
+        if payload["op"] == "edit":
+            result = await self._apply_edits(sync_service, room_id, [payload])
+            return result["results"][0]
+
+        raise ValueError(f"Unknown request: {payload['op']}")
+
+    async def _sync_message(
+        self,
+        sync_service: SyncService,
+        room_id: str,
+        last_version: Optional[int],
+        edit_format: str
+    ) -> Dict[str, Any]:
+        if last_version is not None:
+            catch_up = sync_service.catch_up(room_id, last_version, edit_format)
+
+            if catch_up is not None:
+                return envelope("catchup", catch_up)
+
+        doc_state = await sync_service.full_sync(room_id)
+
+        return envelope("sync", {
+            "code": doc_state["code"],
+            "version": doc_state.get("version", 1),
+            "language": doc_state.get("language", "python"),
+            "name": doc_state.get("name", "")
+        })
+
+    async def _apply_edits(
+        self,
+        sync_service: SyncService,
+        room_id: str,
+        edits: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        need_diff = self.manager.has_format(room_id, "patch") or self.manager.has_remote_users(room_id)
+        results = await sync_service.apply_edits(room_id, edits, need_diff)
+
+        applied = [
+            {"user_id": edit["user_id"], "version": version, "diff": diff, "ops": op}
+            for edit, (success, version, op, diff) in zip(edits, results)
+            if success
+        ]
+
+        if applied:
+            await self.manager.update_version(room_id, applied[-1]["version"])
+            await self.manager.broadcast_edits(room_id, applied)
+
+        return {
+            "results": [
+                {"success": success, "version": version}
+                for success, version, _, _ in results
+            ]
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "node_id": self.node_id,
+            "backplane": type(self.backplane).__name__,
+            "owned_rooms": len(self.owned),
+            "joined_rooms": len(self._members),
+            "forwarded_requests": self.forwarded,
+            "served_requests": self.served,
+            "handoffs": self.handoffs,
+            "edit_batches": self.edit_batches + sum(q.batches for q in self._edit_queues.values()),
+            "queued_edits": self.queued_edits + sum(q.edits for q in self._edit_queues.values())
+        }
+
+
+room_cluster = RoomCluster(manager, create_backplane(), create_sync_service)
@@ -0,0 +1,249 @@
+import random
+from typing import List, Optional, Tuple, Union
+
+# Immutable rope: a treap of text chunks ordered by position. Every node
+# caches the length of its subtree, so offset lookups, inserts and deletes
+# are O(log n). Edits copy only the path they touch, which keeps older
+# versions valid and cheap to hold on to.
+CHUNK_SIZE = 1024
+
+
+class _Node:
+    __slots__ = ("chunk", "priority", "left", "right", "size")
+
+    def __init__(
+        self,
+        chunk: str,
+        priority: float,
+        left: Optional["_Node"] = None,
+        right: Optional["_Node"] = None
+    ):
+        self.chunk = chunk
+        self.priority = priority
+        self.left = left
+        self.right = right
+        self.size = len(chunk) + _size(left) + _size(right)
+
+
+def _size(node: Optional[_Node]) -> int:
+    return node.size if node else 0
+
+
+def _with(node: _Node, left: Optional[_Node], right: Optional[_Node]) -> _Node:
+    return _Node(node.chunk, node.priority, left, right)
+
+
+def _build(text: str) -> Optional[_Node]:
+    # Cartesian tree over random priorities, built left to right in O(n)
+    stack: List[_Node] = []
+
+    for start in range(0, len(text), CHUNK_SIZE):
+        chunk = text[start:start + CHUNK_SIZE]
+        node = _Node(chunk, random.random())
+        last = None
+        while stack and stack[-1].priority < node.priority:
+            last = stack.pop()
+        node.left = last
+        if stack:
+            stack[-1].right = node
+        stack.append(node)
+
+    if not stack:
+        return None
+
+    _recount(stack[0])
+    return stack[0]
+
+
+def _recount(node: Optional[_Node]) -> None:
+    if node is None:
+        return
+    _recount(node.left)
+    _recount(node.right)
+    node.size = len(node.chunk) + _size(node.left) + _size(node.right)
+
+
+def _merge(a: Optional[_Node], b: Optional[_Node]) -> Optional[_Node]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority >= b.priority:
+        return _with(a, a.left, _merge(a.right, b))
+    return _with(b, _merge(a, b.left), b.right)
+
+
+def _split(node: Optional[_Node], pos: int) -> Tuple[Optional[_Node], Optional[_Node]]:
+    if node is None:
+        return None, None
+
+    left_size = _size(node.left)
+
+    if pos <= left_size:
+        a, b = _split(node.left, pos)
+        if b is not None and b.priority > node.priority:
+            # b is topped by a freshly split chunk, sift it down
+            return a, _merge(b, _with(node, None, node.right))
+        return a, _with(node, b, node.right)
+
+    pos -= left_size
+    chunk_size = len(node.chunk)
+
+    if pos >= chunk_size:
+        a, b = _split(node.right, pos - chunk_size)
+        return _with(node, node.left, a), b
+
+    # The tail becomes a new node with its own priority; reusing the old one
+    # lets repeated splits pile equal priorities into a linear chain
+    return (
+        _Node(node.chunk[:pos], node.priority, node.left, None),
+        _merge(_Node(node.chunk[pos:], random.random()), node.right)
+    )
+
+
+# Rewrites a single chunk along a copied path. Returns None when the range
+# crosses a chunk boundary or the chunk would outgrow twice CHUNK_SIZE, so
+# nearby keystrokes keep landing in the same node instead of fragmenting it.
+def _edit_chunk(node: Optional[_Node], pos: int, length: int, text: str) -> Optional[_Node]:
+    if node is None:
+        return None
+
+    left_size = _size(node.left)
+
+    if node.left is not None and pos + length <= left_size:
+        left = _edit_chunk(node.left, pos, length, text)
+        return _with(node, left, node.right) if left else None
+
+    pos -= left_size
+    chunk = node.chunk
+
+    if pos < 0:
+        return None
+
+    if pos > len(chunk) or (length and pos == len(chunk)):
+        right = _edit_chunk(node.right, pos - len(chunk), length, text)
+        return _with(node, node.left, right) if right else None
+
+    if pos + length > len(chunk) or len(chunk) - length + len(text) > 2 * CHUNK_SIZE:
+        return None
+
+    if length == len(chunk) and not text:
+        return None
+
+    return _Node(chunk[:pos] + text + chunk[pos + length:], node.priority, node.left, node.right)
+
+
+def _collect(node: Optional[_Node], start: int, end: int, parts: List[str]) -> None:
+    while node is not None and start < end:
+        left_size = _size(node.left)
+
+        if start < left_size:
+            _collect(node.left, start, min(end, left_size), parts)
+
+        chunk_start = left_size
+        chunk_end = left_size + len(node.chunk)
+
+        if start < chunk_end and end > chunk_start:
+            parts.append(node.chunk[max(start - chunk_start, 0):end - chunk_start])
+
+        if end <= chunk_end:
+            return
+
+        start = max(start - chunk_end, 0)
+        end -= chunk_end
+        node = node.right
+
+
+class Rope:
+    __slots__ = ("_root", "_text")
+
+    def __init__(self, text: str = "", _root: Optional[_Node] = None):
+        if _root is None and text:
+            _root = _build(text)
+            self._text: Optional[str] = text
+        else:
+            self._text = None if _root is not None else ""
+        self._root = _root
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def __str__(self) -> str:
+        if self._text is None:
+            parts: List[str] = []
+            _collect(self._root, 0, len(self), parts)
+            self._text = "".join(parts)
+        return self._text
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Rope):
+            return len(self) == len(other) and str(self) == str(other)
+        if isinstance(other, str):
+            return len(self) == len(other) and str(self) == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __getitem__(self, key: Union[int, slice]) -> str:
+        if isinstance(key, int):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError("Rope index out of range")
+            return self.slice(key, key + 1)
+
+        start, end, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError("Rope slices do not support a step")
+        return self.slice(start, end)
+
+    def slice(self, start: int, end: int) -> str:
+        if self._text is not None:
+            return self._text[start:end]
+        parts: List[str] = []
+        _collect(self._root, max(start, 0), min(end, len(self)), parts)
+        return "".join(parts)
+
+    def insert(self, pos: int, text: str) -> "Rope":
+        if not 0 <= pos <= len(self):
+            raise ValueError("Insert past end of document")
+        if not text:
+            return self
+
+        root = _edit_chunk(self._root, pos, 0, text)
+        if root is not None:
+            return Rope(_root=root)
+
+        left, right = _split(self._root, pos)
+        return Rope(_root=_merge(_merge(left, _build(text)), right))
+
+    def delete(self, pos: int, length: int) -> "Rope":
+        if pos < 0 or pos + length > len(self):
+            raise ValueError("Delete past end of document")
+        if not length:
+            return self
+
+        root = _edit_chunk(self._root, pos, length, "")
+        if root is not None:
+            return Rope(_root=root)
+
+        left, rest = _split(self._root, pos)
+        _, right = _split(rest, length)
+        return Rope(_root=_merge(left, right))
+
+    def apply(self, op: List[Union[int, str]]) -> "Rope":
+        rope = self
+        pos = 0
+
+        for component in op:
+            if isinstance(component, str):
+                rope = rope.insert(pos, component)
+                pos += len(component)
+            elif component > 0:
+                if pos + component > len(rope):
+                    raise ValueError("Retain past end of document")
+                pos += component
+            else:
+                rope = rope.delete(pos, -component)
+
+        return rope
@@ -0,0 +1,309 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from collections import deque
+from typing import Deque, Dict, Any, Optional, Set
+
+from app.config import settings
+from app.services.execution_output import OutputCollector
+from app.services.resource_limits import rlimits
+from app.services.workspace import execution_workspace
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_worker.py")
+HEADER = struct.Struct(">I")
+
+# Headroom over the run timeout for the fork server to reap and reply
+REPLY_GRACE = 5.0
+
+
+def percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class SandboxWorker:
+    def __init__(self, process: asyncio.subprocess.Process):
+        self.process = process
+        self.pid = process.pid
+        self.runs = 0
+
+    @classmethod
+    async def spawn(cls, workspace: str) -> "SandboxWorker":
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-I", WORKER_SCRIPT,
+            ",".join(settings.sandbox_preload_modules), workspace,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE
+        )
+        worker = cls(process)
+
+        try:
+            await asyncio.wait_for(worker._read(), timeout=settings.sandbox_spawn_timeout)
+        except BaseException:
+            await worker.close()
+            raise
+
+        return worker
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    async def _read(self) -> Dict[str, Any]:
+        (size,) = HEADER.unpack(await self.process.stdout.readexactly(HEADER.size))
+        return json.loads(await self.process.stdout.readexactly(size))
+
+    async def request(
+        self,
+        message: Dict[str, Any],
+        timeout: float,
+        output: OutputCollector
+    ) -> Dict[str, Any]:
+        data = json.dumps(message).encode()
+        self.process.stdin.write(HEADER.pack(len(data)) + data)
+        await self.process.stdin.drain()
+
+        async with asyncio.timeout(timeout):
+            while True:
+                reply = await self._read()
+                if "stream" not in reply:
+                    return reply
+                await output.feed(reply["stream"], reply["data"].encode("latin-1"))
+
+    async def close(self) -> None:
+        if self.alive:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+        await self.process.wait()
+
+
+# Keeps fork servers warm so a Python run costs a fork rather than an
+# interpreter start. Compiled binaries are exec'd from the same children so
+# every run gets its rlimits and rusage the same way. Workers are replaced
+# after sandbox_max_runs runs or as soon as a run times out or overflows its
+# output; when no worker comes free within sandbox_acquire_wait_ms the
+# caller falls back to a cold subprocess.
+class SandboxPool:
+    def __init__(self, size: int, max_runs: int, root: Optional[str] = None):
+        self.size = size
+        self.max_runs = max_runs
+        self.root = root
+        self.workspace: Optional[str] = None
+        self.started = False
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: Set[SandboxWorker] = set()
+        self._spawning = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._startup_ms: Deque[float] = deque(maxlen=1024)
+
+        self.runs = 0
+        self.warm_hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.recycled = 0
+        self.breaches = 0
+
+    async def start(self) -> None:
+        if self.started or self.size <= 0:
+            return
+
+        self.workspace = tempfile.mkdtemp(prefix="sandbox_", dir=self.root)
+        self._idle = asyncio.Queue()
+        self.started = True
+
+        spawned = await asyncio.gather(
+            *(self._spawn() for _ in range(self.size)), return_exceptions=True
+        )
+
+        for worker in spawned:
+            if isinstance(worker, SandboxWorker):
+                self._idle.put_nowait(worker)
+            else:
+                logger.warning(f"Failed to start sandbox worker: {worker}")
+
+        logger.info(f"Sandbox pool started with {len(self._workers)}/{self.size} workers")
+
+    async def stop(self) -> None:
+        self.started = False
+
+        for task in list(self._tasks):
+            task.cancel()
+
+        for worker in list(self._workers):
+            await worker.close()
+        self._workers.clear()
+
+        if self.workspace:
+            shutil.rmtree(self.workspace, ignore_errors=True)
+            self.workspace = None
+
+    async def _spawn(self) -> SandboxWorker:
+        worker = await SandboxWorker.spawn(self.workspace)
+        self._workers.add(worker)
+        return worker
+
+    def _replenish(self) -> None:
+        if self.started and len(self._workers) + self._spawning < self.size:
+            self._spawning += 1
+            task = asyncio.create_task(self._refill())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _refill(self) -> None:
+        try:
+            self._idle.put_nowait(await self._spawn())
+        except Exception as e:
+            logger.error(f"Failed to replace sandbox worker: {e}")
+        finally:
+            self._spawning -= 1
+
+    async def _retire(self, worker: SandboxWorker) -> None:
+        self._workers.discard(worker)
+        self.recycled += 1
+        await worker.close()
+        self._replenish()
+
+    async def _acquire(self) -> Optional[SandboxWorker]:
+        while not self._idle.empty():
+            worker = self._idle.get_nowait()
+            if worker.alive:
+                self.warm_hits += 1
+                return worker
+            await self._retire(worker)
+
+        self.misses += 1
+
+        if len(self._workers) + self._spawning < self.size:
+            self._spawning += 1
+            try:
+                return await self._spawn()
+            except Exception as e:
+                logger.warning(f"Failed to start sandbox worker: {e}")
+                return None
+            finally:
+                self._spawning -= 1
+
+        # The pool is full and busy. Waiting out a whole run would stall
+        # this one behind it, so wait only briefly before running it cold.
+        if settings.sandbox_acquire_wait_ms <= 0:
+            return None
+
+        try:
+            worker = await asyncio.wait_for(self._idle.get(), timeout=settings.sandbox_acquire_wait_ms / 1000)
+        except asyncio.TimeoutError:
+            return None
+
+        if not worker.alive:
+            await self._retire(worker)
+            return None
+
+        return worker
+
+    # program is {"code": source} for Python or {"argv": [...]} for a binary
+    async def run(
+        self,
+        program: Dict[str, Any],
+        input_data: str,
+        output: OutputCollector,
+        limits: Dict[str, int]
+    ) -> Optional[Dict[str, Any]]:
+        if not self.started:
+            return None
+
+        worker = await self._acquire()
+        if worker is None:
+            self.fallbacks += 1
+            return None
+
+        healthy = False
+        dispatched_at = time.monotonic()
+
+        try:
+            result = await worker.request(
+                {
+                    **program,
+                    "input": input_data,
+                    "timeout": settings.code_execution_timeout,
+                    "max_output": output.remaining,
+                    "rlimits": rlimits(limits)
+                },
+                timeout=settings.code_execution_timeout + REPLY_GRACE,
+                output=output
+            )
+            healthy = "error" not in result
+        except asyncio.TimeoutError:
+            logger.warning(f"Sandbox worker {worker.pid} stopped responding")
+            result = {"exit_code": None, "breach": "timeout"}
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.warning(f"Sandbox worker {worker.pid} failed: {e}")
+            result = {"error": str(e)}
+        finally:
+            worker.runs += 1
+            # A worker that failed, timed out or was cancelled mid-request
+            # may be out of step with the protocol, so it is never reused
+            if not healthy or worker.runs >= self.max_runs or result.get("breach"):
+                self._workers.discard(worker)
+                task = asyncio.create_task(self._retire(worker))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            else:
+                self._idle.put_nowait(worker)
+
+        if "error" in result:
+            self.fallbacks += 1
+            return None
+
+        self.runs += 1
+        if result.get("started_at") is not None:
+            self._startup_ms.append((result["started_at"] - dispatched_at) * 1000)
+        if result.get("breach"):
+            self.breaches += 1
+
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        acquired = self.warm_hits + self.misses
+
+        return {
+            "size": self.size,
+            "workers": len(self._workers),
+            "idle": self._idle.qsize() if self._idle else 0,
+            "runs": self.runs,
+            "warm_hits": self.warm_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.warm_hits / acquired, 3) if acquired else 0.0,
+            "fallbacks": self.fallbacks,
+            "recycled": self.recycled,
+            "breaches": self.breaches,
+            "startup_ms": {
+                "p50": round(percentile(self._startup_ms, 0.5), 3),
+                "p99": round(percentile(self._startup_ms, 0.99), 3)
+            }
+        }
+
+
+# At least as many workers as runs the scheduler lets through at once, so a
+# run only misses the pool while a worker is being replaced
+def pool_size() -> int:
+    if settings.sandbox_pool_size <= 0:
+        return 0
+    return max(settings.sandbox_pool_size, settings.execution_max_concurrent or os.cpu_count() or 1)
+
+
+sandbox_pool = SandboxPool(
+    pool_size(),
+    settings.sandbox_max_runs,
+    execution_workspace.root
+)
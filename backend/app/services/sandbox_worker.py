@@ -0,0 +1,299 @@
+# Fork server for Python runs, started by SandboxPool as
+#
+#     python -I sandbox_worker.py <preload,modules> <workspace>
+#
+# It imports the common modules once, then reads length-prefixed JSON run
+# requests from stdin and forks a fresh child for each one, so a run pays
+# for a fork instead of an interpreter start. A request carries either
+# Python "code" or the "argv" of a binary to exec, plus the rlimits to set
+# in the child. Output is relayed as it arrives in {"stream", "data"}
+# frames (bytes as latin-1 text), followed by one final frame per run with
+# the exit code and the child's rusage. Only the standard library may be
+# imported here.
+import builtins
+import gc
+import importlib
+import json
+import linecache
+import os
+import random
+import resource
+import selectors
+import shutil
+import signal
+import struct
+import sys
+import tempfile
+import time
+import traceback
+import types
+
+HEADER = struct.Struct(">I")
+STARTED = struct.Struct(">d")
+READ_SIZE = 65536
+MAX_FD = 1024
+
+
+def read_exact(fd: int, size: int) -> bytes:
+    chunks = []
+
+    while size:
+        chunk = os.read(fd, size)
+        if not chunk:
+            raise EOFError
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return b"".join(chunks)
+
+
+def read_frame(fd: int) -> dict:
+    (size,) = HEADER.unpack(read_exact(fd, HEADER.size))
+    return json.loads(read_exact(fd, size))
+
+
+def write_frame(fd: int, message: dict) -> None:
+    data = json.dumps(message, ensure_ascii=False).encode()
+    data = HEADER.pack(len(data)) + data
+
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def set_limits(rlimits: list) -> None:
+    for res, soft, hard in rlimits:
+        _, max_hard = resource.getrlimit(res)
+        if max_hard != resource.RLIM_INFINITY:
+            soft, hard = min(soft, max_hard), min(hard, max_hard)
+        resource.setrlimit(res, (soft, hard))
+
+
+def run_code(code: str, run_dir: str) -> int:
+    filename = os.path.join(run_dir, "main.py")
+    linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+
+    module = types.ModuleType("__main__")
+    module.__file__ = filename
+    module.__builtins__ = builtins
+    sys.modules["__main__"] = module
+    sys.argv = [filename]
+    sys.path.insert(0, run_dir)
+    os.chdir(run_dir)
+
+    # Children share the server's random state unless it is reseeded
+    random.seed()
+
+    try:
+        exec(compile(code, filename, "exec"), module.__dict__)
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException as e:
+        # Drop this frame so the traceback starts at the user's code
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        return 1
+
+
+def child(request: dict, run_dir: str, stdin_r: int, stdout_w: int, stderr_w: int, status_w: int) -> None:
+    exit_code = 1
+
+    try:
+        os.setsid()
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        os.dup2(stdin_r, 0)
+        os.dup2(stdout_w, 1)
+        os.dup2(stderr_w, 2)
+        os.dup2(status_w, 3)
+        os.closerange(4, MAX_FD)
+
+        sys.stdin = open(0, "r", encoding="utf-8", errors="replace", closefd=False)
+        sys.stdout = open(1, "w", encoding="utf-8", closefd=False)
+        sys.stderr = open(2, "w", encoding="utf-8", errors="backslashreplace", closefd=False)
+
+        os.write(3, STARTED.pack(time.monotonic()))
+        os.close(3)
+
+        set_limits(request.get("rlimits", []))
+
+        if "argv" in request:
+            os.chdir(run_dir)
+            try:
+                os.execv(request["argv"][0], request["argv"])
+            except OSError as e:
+                print(f"Failed to start {request['argv'][0]}: {e}", file=sys.stderr)
+                exit_code = 127
+        else:
+            exit_code = run_code(request["code"], run_dir)
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+
+def communicate(
+    pid: int,
+    stdin_w: int,
+    stdout_r: int,
+    stderr_r: int,
+    status_r: int,
+    data: bytes,
+    deadline: float,
+    max_output: int,
+    replies_fd: int
+) -> dict:
+    selector = selectors.DefaultSelector()
+    streams = {stdout_r: "stdout", stderr_r: "stderr"}
+    status = bytearray()
+    output_bytes = 0
+    written = 0
+    breach = None
+
+    if data:
+        os.set_blocking(stdin_w, False)
+        selector.register(stdin_w, selectors.EVENT_WRITE)
+    else:
+        os.close(stdin_w)
+
+    for fd in (stdout_r, stderr_r, status_r):
+        selector.register(fd, selectors.EVENT_READ)
+
+    while selector.get_map():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            breach = "timeout"
+            break
+
+        for key, _ in selector.select(remaining):
+            fd = key.fd
+
+            if fd == stdin_w:
+                try:
+                    written += os.write(fd, data[written:written + READ_SIZE])
+                except BrokenPipeError:
+                    written = len(data)
+                if written >= len(data):
+                    selector.unregister(fd)
+                    os.close(fd)
+                continue
+
+            chunk = os.read(fd, READ_SIZE)
+            if not chunk:
+                selector.unregister(fd)
+                os.close(fd)
+                continue
+
+            if fd == status_r:
+                status += chunk
+                continue
+
+            write_frame(replies_fd, {"stream": streams[fd], "data": chunk.decode("latin-1")})
+            output_bytes += len(chunk)
+            if output_bytes > max_output:
+                breach = "output"
+
+        if breach:
+            break
+
+    for key in list(selector.get_map().values()):
+        os.close(key.fd)
+    selector.close()
+
+    # The child leads its own session, so this also takes out anything it
+    # left running in the background
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+    _, wait_status, rusage = os.wait4(pid, 0)
+    started_at = STARTED.unpack(bytes(status))[0] if len(status) == STARTED.size else None
+
+    return {
+        "exit_code": os.waitstatus_to_exitcode(wait_status),
+        "breach": breach,
+        "started_at": started_at,
+        "usage": {
+            "cpu_user_ms": round(rusage.ru_utime * 1000, 3),
+            "cpu_system_ms": round(rusage.ru_stime * 1000, 3),
+            "max_rss_kb": rusage.ru_maxrss
+        }
+    }
+
+
+def serve(request: dict, workspace: str, replies_fd: int) -> dict:
+    deadline = time.monotonic() + request["timeout"]
+    run_dir = tempfile.mkdtemp(dir=workspace)
+    pipes = [os.pipe() for _ in range(4)]
+    (stdin_r, stdin_w), (stdout_r, stdout_w), (stderr_r, stderr_w), (status_r, status_w) = pipes
+
+    try:
+        pid = os.fork()
+
+        if pid == 0:
+            child(request, run_dir, stdin_r, stdout_w, stderr_w, status_w)
+
+        for fd in (stdin_r, stdout_w, stderr_w, status_w):
+            os.close(fd)
+
+        return communicate(
+            pid, stdin_w, stdout_r, stderr_r, status_r,
+            request.get("input", "").encode(), deadline, request["max_output"], replies_fd
+        )
+    except OSError as e:
+        for pair in pipes:
+            for fd in pair:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        return {"error": str(e)}
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def main() -> None:
+    preload = [name for name in sys.argv[1].split(",") if name]
+    workspace = sys.argv[2]
+
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+    # Keep the preloaded heap out of the collector so children don't
+    # copy it page by page
+    gc.collect()
+    gc.freeze()
+
+    # Move the protocol off fds 0 and 1 so nothing printed by a preloaded
+    # module can corrupt it
+    requests_fd = os.dup(0)
+    replies_fd = os.dup(1)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(2, 1)
+    os.close(devnull)
+
+    write_frame(replies_fd, {"ready": True, "pid": os.getpid()})
+
+    while True:
+        try:
+            request = read_frame(requests_fd)
+        except EOFError:
+            break
+
+        write_frame(replies_fd, serve(request, workspace, replies_fd))
+
+
+if __name__ == "__main__":
+    main()
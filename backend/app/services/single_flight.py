@@ -0,0 +1,49 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+# At most one call in flight per key. Callers arriving while one runs wait
+# for its result instead of running their own. If the caller running it is
+# cancelled, the waiters don't inherit the cancellation: the first to wake
+# takes over and runs the call itself. Any other failure reaches them all.
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._inflight
+
+    # Returns (result, whether it came from another caller's call)
+    async def run(self, key: str, call: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        while key in self._inflight:
+            future = self._inflight[key]
+            try:
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+
+        try:
+            result = await call()
+            future.set_result(result)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieved here so a failure nobody else waited on isn't logged
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+        return result, False
@@ -1,44 +1,104 @@
+import asyncio
 import logging
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, Tuple, List, Callable
 from datetime import datetime
 from diff_match_patch import diff_match_patch
 
-from app.models.database import RoomRepository
+from app.config import settings
+from app.models.database import Database, RoomRepository, OperationRepository
+from app.services import operations
+from app.services.diff_executor import DiffExecutor, diff_executor
+from app.services.document_store import DocumentStore, RoomDocument, document_store
+from app.services.history_service import HistoryService, history_service
+from app.services.metrics import metrics
+from app.services.persistence_service import PersistenceService, persistence_service
 
 logger = logging.getLogger(__name__)
 
+EDIT_SECONDS = metrics.histogram(
+    "codestream_edit_apply_seconds",
+    "Time to parse, transform and apply an edit under the document lock",
+    ("format",)
+)
+EDITS_REJECTED = metrics.counter(
+    "codestream_edits_rejected_total",
+    "Edits rejected by format and reason",
+    ("format", "reason")
+)
+
 
 class SyncService:
-    def __init__(self, room_repo: RoomRepository):
+    def __init__(
+        self,
+        room_repo: RoomRepository,
+        document_store: DocumentStore,
+        persistence: PersistenceService,
+        op_repo: Optional[OperationRepository] = None,
+        executor: Optional[DiffExecutor] = None,
+        history: Optional[HistoryService] = None
+    ):
         self.room_repo = room_repo
+        self.document_store = document_store
+        self.persistence = persistence
+        self.op_repo = op_repo
+        self.executor = executor or diff_executor
+        self.history = history
         self.dmp = diff_match_patch()
-        self._document_cache: Dict[str, str] = {}
-        self._version_cache: Dict[str, int] = {}
+
+    async def open_document(self, room_id: str) -> RoomDocument:
+        on_load = self._load_operations if self.op_repo else None
+        return await self.document_store.acquire(room_id, self.room_repo, on_load=on_load)
+
+    async def _load_operations(self, doc: RoomDocument) -> None:
+        try:
+            operations = await self.op_repo.get_recent_operations(
+                doc.room_id, doc.version, settings.oplog_capacity
+            )
+        except Exception as e:
+            logger.error(f"Failed to load operation log for room {doc.room_id}: {e}")
+            return
+
+        doc.oplog.extend(operations)
+
+    async def close_document(self, room_id: str) -> None:
+        await self.document_store.release(room_id, on_evict=self._flush_on_evict)
+
+    async def _flush_on_evict(self, doc: RoomDocument) -> None:
+        if not await self.persistence.flush_room(doc.room_id):
+            logger.error(f"Failed to persist room {doc.room_id} before eviction")
+
+        if self.history:
+            await self.history.record_room(doc)
 
     async def get_document(self, room_id: str) -> Tuple[str, int]:
-        if room_id in self._document_cache:
-            return self._document_cache[room_id], self._version_cache.get(room_id, 1)
+        doc = self.document_store.get(room_id)
+        if doc:
+            return doc.code, doc.version
 
         room = await self.room_repo.get_room(room_id)
         if room:
-            self._document_cache[room_id] = room.get("code", "")
-            self._version_cache[room_id] = room.get("version", 1)
-            return room["code"], room.get("version", 1)
+            return room.get("code", ""), room.get("version", 1)
 
         return "", 1
 
-    def compute_diff(self, old_text: str, new_text: str) -> str:
-        patches = self.dmp.patch_make(old_text, new_text)
-        return self.dmp.patch_toText(patches)
+    async def compute_diff(self, old_text: str, new_text: str) -> str:
+        return await self.executor.make_patch(old_text, new_text)
 
-    def apply_diff(self, text: str, diff: str) -> Tuple[str, bool]:
+    # Patch text is parsed before the document lock is taken, on the diff
+    # executor when it is large. A patch that does not parse is rejected
+    # like any other invalid edit once the edit is applied.
+    async def _patch_parser(self, user_diff: str) -> Callable[[Optional[operations.Text]], operations.Operation]:
         try:
-            patches = self.dmp.patch_fromText(diff)
-            new_text, results = self.dmp.patch_apply(patches, text)
-            return new_text, all(results)
-        except Exception as e:
-            logger.error(f"Failed to apply diff: {e}")
-            return text, False
+            patches = await self.executor.parse_patches(user_diff)
+        except ValueError as e:
+            error = e
+
+            def parse(base_text: Optional[operations.Text]) -> operations.Operation:
+                raise error
+
+            return parse
+
+        return lambda base_text: operations.from_patches(patches, base_text)
 
     async def apply_user_diff(
         self,
@@ -46,45 +106,201 @@ class SyncService:
         user_diff: str,
         user_version: int,
         user_id: str
-    ) -> Tuple[bool, int, str]:
-        current_code, current_version = await self.get_document(room_id)
-
-        if user_version != current_version:
-            logger.info(
-                f"Version conflict for room {room_id}: "
-                f"user={user_version}, server={current_version}. "
-                "Attempting rebase."
-            )
+    ) -> Tuple[bool, int, operations.Operation, Optional[str]]:
+        return await self._apply_edit(
+            room_id, user_id, user_version,
+            await self._patch_parser(user_diff),
+            diff=user_diff,
+            need_diff=True,
+            edit_format="patch"
+        )
 
-            rebased, success = self.apply_diff(current_code, user_diff)
+    async def apply_user_ops(
+        self,
+        room_id: str,
+        wire_ops: List[Dict[str, Any]],
+        user_version: int,
+        user_id: str,
+        need_diff: bool
+    ) -> Tuple[bool, int, operations.Operation, Optional[str]]:
+        return await self._apply_edit(
+            room_id, user_id, user_version,
+            lambda base_text: operations.from_wire(wire_ops),
+            diff=None,
+            need_diff=need_diff,
+            edit_format="ops"
+        )
 
-            if not success:
-                return False, current_version, current_code
+    # Applies a burst of edits ({"user_id", "version", "diff" or "ops"}) in
+    # order under one hold of the document lock, so the ones that succeed
+    # get consecutive versions
+    async def apply_edits(
+        self,
+        room_id: str,
+        edits: List[Dict[str, Any]],
+        need_diff: bool
+    ) -> List[Tuple[bool, int, operations.Operation, Optional[str]]]:
+        doc = self.document_store.get(room_id)
 
-            current_code = rebased
-            current_version += 1
-        else:
-            new_code, success = self.apply_diff(current_code, user_diff)
+        if doc is None:
+            logger.warning(f"{len(edits)} edits for room {room_id} with no open document")
+            for edit in edits:
+                EDITS_REJECTED.inc("ops" if edit.get("ops") is not None else "patch", "no_document")
+            return [(False, 1, [], None)] * len(edits)
 
-            if not success:
-                return False, current_version, current_code
+        patch_parsers = iter(await asyncio.gather(*(
+            self._patch_parser(edit["diff"])
+            for edit in edits if edit.get("ops") is None
+        )))
+        results = []
 
-            current_code = new_code
-            current_version += 1
+        async with doc.lock:
+            for edit in edits:
+                if edit.get("ops") is not None:
+                    wire_ops = edit["ops"]
+                    results.append(await self._apply_locked(
+                        doc, edit["user_id"], edit["version"],
+                        lambda base_text: operations.from_wire(wire_ops),
+                        diff=None,
+                        need_diff=need_diff,
+                        edit_format="ops"
+                    ))
+                else:
+                    results.append(await self._apply_locked(
+                        doc, edit["user_id"], edit["version"],
+                        next(patch_parsers),
+                        diff=edit["diff"],
+                        need_diff=True,
+                        edit_format="patch"
+                    ))
 
-        self._document_cache[room_id] = current_code
-        self._version_cache[room_id] = current_version
+        return results
 
-        try:
-            await self.room_repo.update_room_code(
-                room_id, current_code, current_version
+    async def _apply_edit(
+        self,
+        room_id: str,
+        user_id: str,
+        user_version: int,
+        parse: Callable[[Optional[operations.Text]], operations.Operation],
+        diff: Optional[str],
+        need_diff: bool,
+        edit_format: str
+    ) -> Tuple[bool, int, operations.Operation, Optional[str]]:
+        doc = self.document_store.get(room_id)
+
+        if doc is None:
+            logger.warning(f"Edit from {user_id} for room {room_id} with no open document")
+            EDITS_REJECTED.inc(edit_format, "no_document")
+            return False, 1, [], None
+
+        async with doc.lock:
+            return await self._apply_locked(doc, user_id, user_version, parse, diff, need_diff, edit_format)
+
+    async def _apply_locked(
+        self,
+        doc: RoomDocument,
+        user_id: str,
+        user_version: int,
+        parse: Callable[[Optional[operations.Text]], operations.Operation],
+        diff: Optional[str],
+        need_diff: bool,
+        edit_format: str
+    ) -> Tuple[bool, int, operations.Operation, Optional[str]]:
+        room_id = doc.room_id
+
+        with EDIT_SECONDS.time(edit_format):
+            try:
+                if user_version == doc.version:
+                    op = parse(doc.text)
+                else:
+                    committed = doc.oplog.since(user_version, doc.version)
+
+                    if committed is None or any(e.get("ops") is None for e in committed):
+                        logger.info(
+                            f"Rejected edit from {user_id} for room {room_id}: "
+                            f"base version {user_version} is not in the operation log "
+                            f"(server={doc.version})"
+                        )
+                        EDITS_REJECTED.inc(edit_format, "stale_base")
+                        return False, doc.version, [], None
+
+                    logger.info(
+                        f"Version conflict for room {room_id}: "
+                        f"user={user_version}, server={doc.version}. "
+                        f"Transforming against {len(committed)} operations."
+                    )
+
+                    op = operations.transform_against(parse(None), [e["ops"] for e in committed])
+                    diff = None
+
+                new_text = doc.text.apply(op)
+            except ValueError as e:
+                logger.info(f"Rejected edit from {user_id} for room {room_id}: {e}")
+                EDITS_REJECTED.inc(edit_format, "invalid")
+                return False, doc.version, [], None
+
+        if diff is None and need_diff:
+            # Cutting the patches out of the document is cheap; formatting
+            # them is what grows with the edit and may be offloaded
+            diff = await self.executor.format_patches(
+                operations.to_patches(doc.text, op, self.dmp.Patch_Margin),
+                operations.edit_size(op)
             )
-        except Exception as e:
-            logger.error(f"Failed to save to database: {e}")
 
-        return True, current_version, current_code
+        doc.text = new_text
+        doc.version += 1
+        doc.updated_at = datetime.utcnow()
+        doc.oplog.append(doc.version, diff, user_id, op)
+
+        self.persistence.mark_dirty(doc, operations.edit_size(op))
+
+        return True, doc.version, op, diff
+
+    def catch_up(
+        self,
+        room_id: str,
+        last_version: int,
+        edit_format: str = "patch"
+    ) -> Optional[Dict[str, Any]]:
+        doc = self.document_store.get(room_id)
+        if doc is None:
+            return None
+
+        entries = doc.oplog.since(last_version, doc.version)
+        if entries is None:
+            return None
+
+        if edit_format == "ops":
+            if any(e.get("ops") is None for e in entries):
+                return None
+            missed = [
+                {"version": e["version"], "ops": operations.to_wire(e["ops"]), "user_id": e["user_id"]}
+                for e in entries
+            ]
+            size = sum(operations.edit_size(e["ops"]) for e in entries)
+        else:
+            if any(e["diff"] is None for e in entries):
+                return None
+            missed = [
+                {"version": e["version"], "diff": e["diff"], "user_id": e["user_id"]}
+                for e in entries
+            ]
+            size = sum(len(e["diff"]) for e in entries)
+
+        if size >= len(doc.text):
+            return None
+
+        return {
+            "from_version": last_version,
+            "version": doc.version,
+            "diffs": missed
+        }
 
     async def full_sync(self, room_id: str) -> Dict[str, Any]:
+        doc = self.document_store.get(room_id)
+        if doc:
+            return doc.to_sync_payload()
+
         room = await self.room_repo.get_room(room_id)
 
         if not room:
@@ -94,9 +310,6 @@ class SyncService:
                 "language": "python"
             }
 
-        self._document_cache[room_id] = room.get("code", "")
-        self._version_cache[room_id] = room.get("version", 1)
-
         return {
             "code": room.get("code", ""),
             "version": room.get("version", 1),
@@ -104,26 +317,10 @@ class SyncService:
             "name": room.get("name", "")
         }
 
-    async def save_snapshot(self, room_id: str) -> bool:
-        if room_id not in self._document_cache:
-            return True
-
-        code = self._document_cache[room_id]
-        room = await self.room_repo.get_room(room_id)
-
-        if not room:
-            return False
-
-        version = room.get("version", 1)
-
-        try:
-            await self.room_repo.update_room_code(room_id, code, version)
-            logger.debug(f"Auto-saved room {room_id}")
-            return True
-        except Exception as e:
-            logger.error(f"Auto-save failed for room {room_id}: {e}")
-            return False
 
-    def invalidate_cache(self, room_id: str) -> None:
-        self._document_cache.pop(room_id, None)
-        self._version_cache.pop(room_id, None)
+def create_sync_service() -> SyncService:
+    db = Database.get_db()
+    op_repo = OperationRepository(db) if settings.oplog_persist else None
+    return SyncService(
+        RoomRepository(db), document_store, persistence_service, op_repo, history=history_service
+    )
@@ -0,0 +1,168 @@
+import json
+import logging
+import time
+import zlib
+from datetime import datetime
+from typing import Dict, Any, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:
+    # Connections asking for msgpack get JSON instead
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from app.config import settings
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ENCODE_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.1
+)
+
+ENCODE_SECONDS = metrics.histogram(
+    "codestream_ws_encode_seconds",
+    "Time to encode one outgoing frame, including compression",
+    ("type", "encoding"),
+    buckets=ENCODE_BUCKETS
+)
+ENCODED_BYTES = metrics.counter(
+    "codestream_ws_encoded_bytes_total",
+    "Size of encoded outgoing frames, counted once per encode (characters for text frames)",
+    ("type", "encoding")
+)
+
+Frame = Union[str, bytes]
+
+ENCODINGS = ("json", "msgpack")
+
+# Binary frames start with one tag byte describing the body; text frames are
+# always plain, uncompressed JSON, so clients that never negotiate anything
+# see exactly what they did before
+TAG_MSGPACK = 0x01
+TAG_DEFLATE = 0x02
+
+
+class FrameError(ValueError):
+    pass
+
+
+if orjson is not None:
+    def dumps(message: Any) -> str:
+        return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    loads = orjson.loads
+else:
+    def dumps(message: Any) -> str:
+        return json.dumps(message, separators=(",", ":"))
+
+    loads = json.loads
+
+
+# Every message sent to a client has this shape
+def envelope(message_type: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "type": message_type,
+        "payload": payload,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+# How one connection's frames are encoded, chosen at the handshake. Frames
+# whose encoded body reaches compress_threshold bytes are deflated when the
+# client asked for compression.
+class WireFormat:
+    def __init__(self, encoding: str = "json", compress_threshold: int = 0, compress_level: int = 1):
+        self.encoding = encoding
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        # Connections with equal keys get byte-identical frames, so a
+        # broadcast encodes once per key rather than once per socket
+        self.key: Tuple[str, int, int] = (encoding, compress_threshold, compress_level)
+
+    def encode(self, message: Dict[str, Any]) -> Frame:
+        start = time.perf_counter()
+        frame = self._encode(message)
+
+        message_type = message.get("type", "unknown")
+        ENCODE_SECONDS.observe(time.perf_counter() - start, message_type, self.encoding)
+        ENCODED_BYTES.inc(message_type, self.encoding, amount=len(frame))
+        return frame
+
+    def _encode(self, message: Dict[str, Any]) -> Frame:
+        if self.encoding == "msgpack":
+            body = msgpack.packb(message, use_bin_type=True)
+            tag = TAG_MSGPACK
+        else:
+            text = dumps(message)
+            if not self.compress_threshold or len(text) < self.compress_threshold:
+                return text
+            body = text.encode("utf-8")
+            tag = 0
+
+        if self.compress_threshold and len(body) >= self.compress_threshold:
+            compressed = zlib.compress(body, self.compress_level)
+            if len(compressed) < len(body):
+                body = compressed
+                tag |= TAG_DEFLATE
+
+        return bytes((tag,)) + body
+
+    def decode(self, frame: Frame) -> Dict[str, Any]:
+        try:
+            if isinstance(frame, str):
+                message = loads(frame)
+            else:
+                message = decode_binary(frame)
+        except FrameError:
+            raise
+        except Exception as e:
+            raise FrameError(f"Undecodable frame: {e}") from e
+
+        if not isinstance(message, dict):
+            raise FrameError("Frame is not an object")
+        return message
+
+
+def decode_binary(frame: bytes) -> Any:
+    if not frame:
+        raise FrameError("Empty binary frame")
+
+    tag, body = frame[0], frame[1:]
+
+    if tag & ~(TAG_MSGPACK | TAG_DEFLATE):
+        raise FrameError(f"Unknown frame tag {tag:#x}")
+
+    if tag & TAG_DEFLATE:
+        body = zlib.decompressobj().decompress(body, settings.ws_max_frame_bytes)
+
+    if tag & TAG_MSGPACK:
+        if msgpack is None:
+            raise FrameError("msgpack frames are not supported by this server")
+        return msgpack.unpackb(body, raw=False)
+
+    return loads(body)
+
+
+def negotiate(encoding: str, compress: bool) -> WireFormat:
+    if encoding not in ENCODINGS:
+        encoding = "json"
+
+    if encoding == "msgpack" and msgpack is None:
+        logger.warning("msgpack requested but not installed, using JSON")
+        encoding = "json"
+
+    return WireFormat(
+        encoding,
+        settings.ws_compress_threshold if compress else 0,
+        settings.ws_compress_level
+    )
+
+
+JSON_WIRE = WireFormat()
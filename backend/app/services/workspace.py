@@ -0,0 +1,87 @@
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, Any, Iterator, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+MEMORY_ROOT = "/dev/shm"
+
+
+# Where runs put their files. "disk" uses the temp directory, "memory" a
+# RAM-backed one, so source files, binaries and per-run directories never
+# touch the disk. With memfd, sources skip the filesystem entirely and the
+# child opens them through /proc/self/fd.
+class Workspace:
+    def __init__(self, kind: str = "disk", directory: str = "", use_memfd: bool = False):
+        base = directory or None
+
+        if not directory and kind == "memory":
+            if os.path.isdir(MEMORY_ROOT) and os.access(MEMORY_ROOT, os.W_OK):
+                base = MEMORY_ROOT
+            else:
+                logger.warning(f"{MEMORY_ROOT} is not available, using a disk workspace")
+                kind = "disk"
+
+        self.kind = kind
+        self.use_memfd = use_memfd and hasattr(os, "memfd_create")
+        self.root = tempfile.mkdtemp(prefix="codestream_", dir=base)
+        self.runs = 0
+        logger.info(f"Created {kind} execution workspace: {self.root}")
+
+    # A private directory for one run, removed with everything in it after
+    @contextlib.contextmanager
+    def run_dir(self) -> Iterator[str]:
+        path = tempfile.mkdtemp(dir=self.root)
+        self.runs += 1
+
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    # Yields the path a child process should open for the source and the
+    # fds it has to inherit for that path to resolve
+    @contextlib.contextmanager
+    def source(self, run_dir: str, filename: str, content: str) -> Iterator[Tuple[str, Tuple[int, ...]]]:
+        if not self.use_memfd:
+            path = os.path.join(run_dir, filename)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+            yield path, ()
+            return
+
+        fd = os.memfd_create(filename)
+
+        try:
+            data = content.encode("utf-8")
+            while data:
+                data = data[os.write(fd, data):]
+            yield f"/proc/self/fd/{fd}", (fd,)
+        finally:
+            os.close(fd)
+
+    def subdirectory(self, prefix: str) -> str:
+        return tempfile.mkdtemp(prefix=prefix, dir=self.root)
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "root": self.root,
+            "memfd": self.use_memfd,
+            "runs": self.runs
+        }
+
+
+execution_workspace = Workspace(
+    settings.execution_workspace,
+    settings.execution_workspace_dir,
+    settings.execution_use_memfd
+)
@@ -0,0 +1,161 @@
+"""Edits across several nodes sharing one room through the backplane.
+
+Starts --nodes ConnectionManager/RoomCluster pairs in one process, each
+with its own document store, connected by the in-process broker or by a
+Redis-protocol server (--redis-url). Every node holds --clients sockets in
+the same room; edits are submitted round-robin from all nodes, so most are
+forwarded to the room's owner. Reports submit-to-delivery latency for
+sockets on the owner and on the other nodes, and checks every socket ends
+up with the owner's document.
+
+    cd backend && python -m benchmarks.backplane --nodes 2 --clients 5
+    cd backend && python -m benchmarks.backplane --redis-url redis://localhost:6379/0
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+from app.services import operations
+from app.services.backplane import Backplane, InProcessBackplane, InProcessBroker, RedisBackplane
+from app.services.connection_manager import ConnectionManager
+from app.services.document_store import DocumentStore
+from app.services.persistence_service import PersistenceService
+from app.services.room_cluster import RoomCluster
+from app.services.sync_service import SyncService
+from benchmarks.common import ROOM_ID, MemoryRoomRepository
+
+
+class ReplayWebSocket:
+    def __init__(self, submitted: Dict[int, float], latencies: List[float]):
+        self.submitted = submitted
+        self.latencies = latencies
+        self.text = ""
+        self.version = 0
+
+    async def accept(self) -> None:
+        await asyncio.sleep(0)
+
+    async def close(self, code: int = 1000) -> None:
+        pass
+
+    async def send_text(self, data: str) -> None:
+        message = json.loads(data)
+
+        if message["type"] != "ops":
+            return
+
+        payload = message["payload"]
+        if payload["version"] != self.version + 1:
+            raise RuntimeError(f"Out of order frame {payload['version']} after {self.version}")
+
+        self.text = operations.apply(self.text, operations.from_wire(payload["ops"]))
+        self.version = payload["version"]
+
+        submitted_at = self.submitted.get(payload["version"])
+        if submitted_at is not None:
+            self.latencies.append((time.perf_counter() - submitted_at) * 1e6)
+
+
+class Node:
+    def __init__(self, backplane: Backplane, repository: MemoryRoomRepository):
+        self.manager = ConnectionManager()
+        self.sync = SyncService(repository, DocumentStore(), PersistenceService())
+        self.cluster = RoomCluster(self.manager, backplane, lambda: self.sync)
+        self.sockets: List[ReplayWebSocket] = []
+        self.latencies: List[float] = []
+
+
+def summarize(samples: List[float]) -> str:
+    if not samples:
+        return "no samples"
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return f"p50 {statistics.median(samples):>9.1f}us  p99 {p99:>9.1f}us  n={len(samples)}"
+
+
+def make_backplane(args, broker: InProcessBroker, i: int) -> Backplane:
+    if args.redis_url:
+        return RedisBackplane(args.redis_url, node_id=f"bench-node-{i}")
+    return InProcessBackplane(broker, node_id=f"bench-node-{i}")
+
+
+async def run(args) -> bool:
+    broker = InProcessBroker()
+    repository = MemoryRoomRepository("")
+    nodes = [Node(make_backplane(args, broker, i), repository) for i in range(args.nodes)]
+    submitted: Dict[int, float] = {}
+
+    for node in nodes:
+        await node.cluster.start()
+
+    for i, node in enumerate(nodes):
+        for j in range(args.clients):
+            ws = ReplayWebSocket(submitted, node.latencies)
+            await node.manager.connect(ws, ROOM_ID, f"user-{i}-{j}", f"user-{i}-{j}", "ops")
+            await node.cluster.join(ROOM_ID)
+            sync = await node.cluster.sync_message(ROOM_ID, None, "ops")
+            ws.text = sync["payload"]["code"]
+            ws.version = sync["payload"]["version"]
+            node.sockets.append(ws)
+
+    # Let presence announcements settle so every node relays the room
+    await asyncio.sleep(0.2)
+
+    owner_id = nodes[0].cluster._owners[ROOM_ID]
+    owner = next(node for node in nodes if node.cluster.node_id == owner_id)
+    doc = owner.sync.document_store.get(ROOM_ID)
+
+    for seq in range(args.edits):
+        node = nodes[seq % len(nodes)]
+        ws = node.sockets[seq % args.clients]
+        # Edits are submitted one at a time, so each lands as the next version
+        submitted[doc.version + 1] = time.perf_counter()
+        success, _ = await node.cluster.apply_edit(
+            ROOM_ID, f"user-{seq % len(nodes)}-{seq % args.clients}", ws.version,
+            ops=operations.to_wire(operations.normalize([len(ws.text), f"{seq} "]))
+        )
+        if not success:
+            print(f"  edit {seq} rejected")
+
+    await asyncio.sleep(0.5)
+
+    expected = str(doc.text)
+    converged = all(ws.text == expected for node in nodes for ws in node.sockets)
+
+    print(f"{args.nodes} nodes x {args.clients} clients, {args.edits} edits, "
+          f"{'redis' if args.redis_url else 'in-process'} backplane")
+    for node in nodes:
+        role = "owner " if node is owner else "remote"
+        print(f"  {node.cluster.node_id} ({role})  {summarize(node.latencies)}  {node.cluster.stats()['forwarded_requests']} forwarded")
+    print(f"  converged: {converged}  document length {len(expected)}")
+
+    # Nothing to persist; the repository is in memory
+    doc.persisted_version = doc.version
+
+    for node in nodes:
+        for ws in node.sockets:
+            await node.manager.disconnect(ws)
+            await node.cluster.leave(ROOM_ID)
+        await node.cluster.stop()
+
+    return converged
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=5)
+    parser.add_argument("--edits", type=int, default=500)
+    parser.add_argument("--redis-url", default="")
+    args = parser.parse_args()
+
+    if not await run(args):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
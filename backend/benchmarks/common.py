@@ -0,0 +1,19 @@
+from app.services.document_store import DocumentStore, RoomDocument
+from app.services.persistence_service import PersistenceService
+from app.services.sync_service import SyncService
+
+ROOM_ID = "bench"
+
+
+class MemoryRoomRepository:
+    def __init__(self, code: str):
+        self.room = {"room_id": ROOM_ID, "code": code, "version": 1, "name": "bench"}
+
+    async def get_room(self, room_id: str):
+        return dict(self.room)
+
+
+async def open_room(code: str):
+    sync = SyncService(MemoryRoomRepository(code), DocumentStore(), PersistenceService())
+    doc: RoomDocument = await sync.open_document(ROOM_ID)
+    return sync, doc
@@ -0,0 +1,128 @@
+"""Event loop lag while a room takes large pastes, inline vs offloaded diffs.
+
+Opens a --doc-kb document and applies --edits pastes of --paste-kb each,
+alternating between patch-text edits (parsed by the server) and structured
+ops edits whose patch text the server formats for patch clients. A ticker
+task wakes every millisecond alongside and records how late each wake-up
+was, which is what every other room on the worker would feel. Each run uses
+its own DiffExecutor: "inline" runs all diff work on the loop, "thread" and
+"process" offload anything at least --threshold bytes. Reports the lag
+percentiles, edits per second and the executor's offload counters.
+
+    cd backend && python -m benchmarks.diff_offload --paste-kb 16 128 512
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import List
+
+from diff_match_patch import diff_match_patch
+
+from app.services import operations
+from app.services.diff_executor import DiffExecutor
+from app.services.document_store import DocumentStore
+from app.services.persistence_service import PersistenceService
+from app.services.sync_service import SyncService
+from benchmarks.common import ROOM_ID, MemoryRoomRepository
+
+
+def make_text(kb: int, rng: random.Random) -> str:
+    lines = []
+    size = 0
+    while size < kb * 1024:
+        line = f"    value_{rng.randint(0, 9999)} = compute(items, {rng.random():.4f})  # é\n"
+        lines.append(line)
+        size += len(line)
+    return "".join(lines)
+
+
+async def ticker(lags: List[float], done: asyncio.Event) -> None:
+    loop = asyncio.get_running_loop()
+    while not done.is_set():
+        expected = loop.time() + 0.001
+        await asyncio.sleep(0.001)
+        lags.append(max(loop.time() - expected, 0.0))
+
+
+async def run(mode: str, doc_kb: int, paste_kb: int, edits: int, threshold: int, workers: int) -> str:
+    rng = random.Random(paste_kb)
+    dmp = diff_match_patch()
+
+    executor = DiffExecutor(mode, workers, threshold, threshold)
+    sync = SyncService(
+        MemoryRoomRepository(make_text(doc_kb, rng)), DocumentStore(), PersistenceService(),
+        executor=executor
+    )
+    doc = await sync.open_document(ROOM_ID)
+
+    # Build every edit up front against a copy of the document, so the
+    # client's side of a patch edit is not counted as server lag
+    text = doc.text
+    batches = []
+    for i in range(edits):
+        op = operations.normalize([rng.randint(0, len(text)), make_text(paste_kb, rng)])
+        version = doc.version + i
+
+        if i % 2:
+            edit = {"user_id": "bench", "version": version, "ops": operations.to_wire(op)}
+        else:
+            edit = {"user_id": "bench", "version": version, "diff": operations.to_patch_text(dmp, text, op)}
+
+        batches.append([edit])
+        text = text.apply(op)
+
+    # Warm the pool up so worker start-up is not counted as lag or work
+    await executor.run("warmup", len, "", size=1, threshold=0)
+    before = executor.stats()
+
+    lags: List[float] = []
+    done = asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, done))
+    await asyncio.sleep(0.01)
+
+    start = time.perf_counter()
+    for i, batch in enumerate(batches):
+        result = await sync.apply_edits(ROOM_ID, batch, need_diff=True)
+        if not result[0][0]:
+            print(f"  edit {i} rejected")
+
+        # Let the ticker see the gap between edits, as a socket read would
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+
+    done.set()
+    await tick_task
+    executor.stop()
+
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99)] if lags else 0.0
+    worst = lags[-1] if lags else 0.0
+    stats = {key: value - before[key] for key, value in executor.stats().items() if key not in ("mode", "workers")}
+
+    return (
+        f"{edits / elapsed:>7.1f} edits/s  "
+        f"lag p99 {p99 * 1000:>7.2f}ms max {worst * 1000:>7.2f}ms  "
+        f"offloaded {stats['offloaded']:>3}/{stats['offloaded'] + stats['inline']:<3} "
+        f"saved {stats['loop_ms_saved']:>8.1f}ms overhead {stats['overhead_ms']:>7.1f}ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--doc-kb", type=int, default=512)
+    parser.add_argument("--paste-kb", type=int, nargs="+", default=[16, 128, 512])
+    parser.add_argument("--edits", type=int, default=20)
+    parser.add_argument("--threshold", type=int, default=32 * 1024)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--modes", nargs="+", default=["inline", "thread", "process"])
+    args = parser.parse_args()
+
+    for paste_kb in args.paste_kb:
+        print(f"{args.doc_kb}KB document, {args.edits} pastes of {paste_kb}KB, offload at {args.threshold} bytes")
+        for mode in args.modes:
+            print(f"  {mode:<8} {await run(mode, args.doc_kb, paste_kb, args.edits, args.threshold, args.workers)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
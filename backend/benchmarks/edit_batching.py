@@ -0,0 +1,119 @@
+"""Edit throughput per room, one edit at a time vs batched edit queues.
+
+Connects --writers sockets to one room on a single node and has each of
+them send --edits structured-op edits, each based on the newest version
+the writer has seen. "per edit" mirrors the old handler: every writer
+waits for its edit to be applied, broadcast and acked before sending the
+next, and the room applies edits one by one. "batched" sends edits as fast
+as they arrive and lets the room's EditQueue drain and apply whatever has
+queued up in one pass. Reports applied edits per second, the frames each
+socket received and the average batch size.
+
+    cd backend && python -m benchmarks.edit_batching --writers 1 10 50 --edits 200
+"""
+import argparse
+import asyncio
+import time
+from typing import List
+
+from app.config import settings
+from app.services import operations
+from app.services.backplane import InProcessBackplane, InProcessBroker
+from app.services.connection_manager import ConnectionManager
+from app.services.document_store import DocumentStore
+from app.services.persistence_service import PersistenceService
+from app.services.room_cluster import RoomCluster
+from app.services.sync_service import SyncService
+from benchmarks.common import ROOM_ID, MemoryRoomRepository
+
+
+class CountingWebSocket:
+    def __init__(self):
+        self.frames = 0
+
+    async def accept(self) -> None:
+        pass
+
+    async def close(self, code: int = 1000) -> None:
+        pass
+
+    async def send_text(self, data: str) -> None:
+        self.frames += 1
+
+
+async def run(writers: int, edits: int, batched: bool) -> str:
+    settings.edit_batch_max = 64 if batched else 1
+
+    manager = ConnectionManager()
+    sync = SyncService(MemoryRoomRepository(""), DocumentStore(), PersistenceService())
+    cluster = RoomCluster(manager, InProcessBackplane(InProcessBroker(), node_id="bench"), lambda: sync)
+    await cluster.start()
+
+    sockets: List[CountingWebSocket] = []
+    for i in range(writers):
+        ws = CountingWebSocket()
+        await manager.connect(ws, ROOM_ID, f"user-{i}", f"user-{i}", "ops")
+        await cluster.join(ROOM_ID)
+        sockets.append(ws)
+
+    doc = sync.document_store.get(ROOM_ID)
+    loop = asyncio.get_running_loop()
+
+    async def writer(i: int) -> None:
+        pending = []
+
+        for seq in range(edits):
+            op = operations.to_wire(operations.normalize([0, f"{i}:{seq} "]))
+
+            if batched:
+                future = loop.create_future()
+                cluster.submit_edit(ROOM_ID, f"user-{i}", doc.version, ops=op, future=future)
+                pending.append(future)
+                # One receive per message, as the socket loop does
+                await asyncio.sleep(0)
+            else:
+                await cluster.apply_edit(ROOM_ID, f"user-{i}", doc.version, ops=op)
+
+        results = await asyncio.gather(*pending)
+        rejected = sum(1 for success, _ in results if not success)
+        if rejected:
+            print(f"  writer {i}: {rejected} edits rejected")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(writer(i) for i in range(writers)))
+    elapsed = time.perf_counter() - start
+
+    # Let the outbound queues finish writing
+    await asyncio.sleep(0.05)
+
+    applied = doc.version - 1
+    stats = cluster.stats()
+    frames = sum(ws.frames for ws in sockets) / len(sockets)
+
+    doc.persisted_version = doc.version
+    for ws in sockets:
+        await manager.disconnect(ws)
+        await cluster.leave(ROOM_ID)
+    await cluster.stop()
+
+    return (
+        f"{applied / elapsed:>9.0f} edits/s  "
+        f"{frames:>8.0f} frames/socket  "
+        f"avg batch {stats['queued_edits'] / max(stats['edit_batches'], 1):>5.1f}"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--edits", type=int, default=200)
+    args = parser.parse_args()
+
+    for writers in args.writers:
+        print(f"{writers} writers x {args.edits} edits")
+        print(f"  per edit  {await run(writers, args.edits, batched=False)}")
+        print(f"  batched   {await run(writers, args.edits, batched=True)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+"""Compare server CPU per edit for patch-text diffs and structured ops.
+
+Replays the same stream of single-keystroke edits against 1k-line and
+50k-line rooms through SyncService.apply_user_diff (patch text) and
+SyncService.apply_user_ops (structured ops). The pre-OT fuzzy
+diff_match_patch.patch_apply path is timed as a reference.
+
+    cd backend && python -m benchmarks.edit_formats --edits 300
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import List, Tuple
+
+from diff_match_patch import diff_match_patch
+
+from app.services import operations
+from benchmarks.common import ROOM_ID, open_room
+
+LINE = "    total = compute(value, index) + offset  # line\n"
+
+
+def make_edits(text: str, count: int, rng: random.Random) -> List[Tuple[operations.Operation, str]]:
+    dmp = diff_match_patch()
+    edits = []
+
+    for _ in range(count):
+        pos = rng.randint(0, len(text))
+        op = operations.normalize([pos, rng.choice("abcxyz ")])
+        edits.append((op, operations.to_patch_text(dmp, text, op)))
+        text = operations.apply(text, op)
+
+    return edits
+
+
+def summarize(samples: List[float]) -> str:
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return f"mean {statistics.mean(samples):>9.1f}us  p99 {p99:>9.1f}us"
+
+
+async def bench_patch(text: str, edits) -> List[float]:
+    sync, doc = await open_room(text)
+    samples = []
+    for _, diff in edits:
+        start = time.perf_counter()
+        success, *_ = await sync.apply_user_diff(ROOM_ID, diff, doc.version, "bench")
+        samples.append((time.perf_counter() - start) * 1e6)
+        assert success
+    return samples
+
+
+async def bench_ops(text: str, edits) -> List[float]:
+    sync, doc = await open_room(text)
+    samples = []
+    for op, _ in edits:
+        wire = operations.to_wire(op)
+        start = time.perf_counter()
+        success, *_ = await sync.apply_user_ops(ROOM_ID, wire, doc.version, "bench", need_diff=False)
+        samples.append((time.perf_counter() - start) * 1e6)
+        assert success
+    return samples
+
+
+def bench_fuzzy(text: str, edits) -> List[float]:
+    dmp = diff_match_patch()
+    samples = []
+    for _, diff in edits:
+        start = time.perf_counter()
+        text, _ = dmp.patch_apply(dmp.patch_fromText(diff), text)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[1_000, 50_000])
+    parser.add_argument("--edits", type=int, default=300)
+    args = parser.parse_args()
+
+    for lines in args.lines:
+        text = LINE * lines
+        edits = make_edits(text, args.edits, random.Random(lines))
+
+        print(f"{lines} lines ({len(text) // 1024} KiB), {args.edits} edits")
+        print(f"  patch text      {summarize(await bench_patch(text, edits))}")
+        print(f"  structured ops  {summarize(await bench_ops(text, edits))}")
+        print(f"  fuzzy (legacy)  {summarize(bench_fuzzy(text, edits))}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
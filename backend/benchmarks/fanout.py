@@ -0,0 +1,116 @@
+"""Room fan-out latency with one slow client.
+
+Broadcasts a stream of edit frames to a room of in-memory sockets where
+one socket takes --slow-ms to accept each frame. Reports delivery latency
+seen by the healthy sockets for the old sequential send loop and for
+ConnectionManager's per-connection outbound queues, plus what happened to
+the slow consumer.
+
+    cd backend && python -m benchmarks.fanout --clients 20 --slow-ms 50
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import List
+
+from app.config import settings
+from app.services.connection_manager import ConnectionManager
+
+ROOM_ID = "bench"
+
+
+class FakeWebSocket:
+    def __init__(self, delay: float, latencies: List[float]):
+        self.delay = delay
+        self.latencies = latencies
+        self.close_code = None
+
+    async def accept(self) -> None:
+        await asyncio.sleep(0)
+
+    async def close(self, code: int = 1000) -> None:
+        self.close_code = code
+
+    async def send_text(self, data: str) -> None:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        sent_at = json.loads(data).get("sent_at")
+        if sent_at is not None:
+            self.latencies.append((time.perf_counter() - sent_at) * 1e6)
+
+
+def summarize(samples: List[float]) -> str:
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return f"p50 {statistics.median(samples):>10.1f}us  p99 {p99:>10.1f}us  n={len(samples)}"
+
+
+def frame(i: int, sent_at: float) -> dict:
+    return {"type": "diff", "payload": {"diff": "@@ -1,1 +1,2 @@\n x\n+y\n", "version": i}, "sent_at": sent_at}
+
+
+# Frames are due every interval; latency counts from when a frame was due,
+# so a broadcaster that falls behind shows up in the numbers
+async def wait_until(deadline: float) -> None:
+    await asyncio.sleep(max(deadline - time.perf_counter(), 0))
+
+
+async def bench_sequential(args) -> List[float]:
+    latencies: List[float] = []
+    sockets = [FakeWebSocket(args.slow_ms / 1000, [])]
+    sockets += [FakeWebSocket(0, latencies) for _ in range(args.clients)]
+    start = time.perf_counter()
+
+    for i in range(args.frames):
+        due = start + i * args.interval_ms / 1000
+        await wait_until(due)
+        message = json.dumps(frame(i, due))
+        for ws in sockets:
+            await ws.send_text(message)
+
+    return latencies
+
+
+async def bench_queued(args):
+    settings.outbound_queue_size = args.queue_size
+    settings.outbound_overflow_policy = args.policy
+    manager = ConnectionManager()
+    latencies: List[float] = []
+
+    slow = FakeWebSocket(args.slow_ms / 1000, [])
+    await manager.connect(slow, ROOM_ID, "slow", "slow")
+    for i in range(args.clients):
+        await manager.connect(FakeWebSocket(0, latencies), ROOM_ID, f"user-{i}", f"user-{i}")
+
+    start = time.perf_counter()
+    for i in range(args.frames):
+        due = start + i * args.interval_ms / 1000
+        await wait_until(due)
+        await manager.broadcast_to_room(ROOM_ID, frame(i, due))
+
+    await asyncio.sleep(0.05)
+    return latencies, manager.outbound[slow].stats(), slow.close_code
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--slow-ms", type=float, default=50)
+    parser.add_argument("--interval-ms", type=float, default=5)
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument("--policy", default="drop_stale")
+    args = parser.parse_args()
+
+    print(f"{args.clients} healthy clients + 1 slow ({args.slow_ms}ms/frame), {args.frames} frames")
+    print(f"  sequential send  {summarize(await bench_sequential(args))}")
+
+    latencies, slow_stats, close_code = await bench_queued(args)
+    print(f"  outbound queues  {summarize(latencies)}")
+    print(f"  slow consumer    {slow_stats}  close_code={close_code}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
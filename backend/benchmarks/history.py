@@ -0,0 +1,97 @@
+"""Room history storage and rebuild cost by keyframe interval.
+
+Simulates a session on a --lines line document: --entries history entries,
+each --edits small typing edits after the previous one. For every keyframe
+interval in --keyframes, encodes the session the way the history service
+does (a compressed keyframe every K entries and compressed deltas built from
+the composed ops in between) and reports the bytes stored against plain and
+compressed full copies of every entry, plus the time to rebuild the
+slowest entry (a keyframe and K deltas) and the average entry.
+
+    cd backend && python -m benchmarks.history --lines 2000 --keyframes 1 10 20 50
+"""
+import argparse
+import random
+import time
+import zlib
+from typing import List, Tuple
+
+from app.services import operations
+from app.services.history_service import encode_delta, encode_keyframe, materialize_chain
+
+
+def make_session(lines: int, entries: int, edits: int) -> List[Tuple[str, operations.Operation]]:
+    rng = random.Random(lines)
+    text = "".join(
+        f"    value_{rng.randint(0, 9999)} = compute(items[{i}], {rng.random():.4f})\n"
+        for i in range(lines)
+    )
+
+    session = [(text, [])]
+    for _ in range(entries - 1):
+        composed: operations.Operation = []
+        for _ in range(edits):
+            pos = rng.randint(0, len(text))
+            if rng.random() < 0.8 or len(text) - pos < 5:
+                op = operations.normalize([pos, rng.choice(["x", " = ", "(", "foo", "\n    "])])
+            else:
+                op = operations.normalize([pos, -rng.randint(1, 5)])
+            text = operations.apply(text, op)
+            composed = operations.compose(composed, op)
+        session.append((text, composed))
+
+    return session
+
+
+def measure(session: List[Tuple[str, operations.Operation]], keyframe_interval: int, level: int) -> str:
+    chains: List[List[bytes]] = []
+    stored = 0
+
+    for i, (text, op) in enumerate(session):
+        if i % (keyframe_interval + 1) == 0:
+            data = encode_keyframe(text, level)
+            chains.append([data])
+        else:
+            data = encode_delta(op, level)
+            chains.append(chains[-1] + [data])
+        stored += len(data)
+
+    start = time.perf_counter()
+    for chain, (text, _) in zip(chains, session):
+        assert materialize_chain(chain) == text
+    average_ms = (time.perf_counter() - start) / len(session) * 1000
+
+    slowest = max(chains, key=len)
+    start = time.perf_counter()
+    materialize_chain(slowest)
+    slowest_ms = (time.perf_counter() - start) * 1000
+
+    plain = sum(len(text.encode("utf-8")) for text, _ in session)
+    compressed = sum(len(zlib.compress(text.encode("utf-8"), level)) for text, _ in session)
+
+    return (
+        f"{stored / 1024:>9.1f}KB ({stored / plain:>6.2%} of full copies, "
+        f"{stored / compressed:>6.2%} of compressed copies)  "
+        f"rebuild avg {average_ms:>6.2f}ms worst {slowest_ms:>6.2f}ms ({len(slowest) - 1} deltas)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[200, 2000])
+    parser.add_argument("--entries", type=int, default=200)
+    parser.add_argument("--edits", type=int, default=20)
+    parser.add_argument("--keyframes", type=int, nargs="+", default=[1, 10, 20, 50])
+    parser.add_argument("--level", type=int, default=6)
+    args = parser.parse_args()
+
+    for lines in args.lines:
+        session = make_session(lines, args.entries, args.edits)
+        print(f"{lines} lines, {args.entries} entries of {args.edits} edits")
+
+        for keyframe_interval in args.keyframes:
+            print(f"  keyframe every {keyframe_interval:>3}  {measure(session, keyframe_interval, args.level)}")
+
+
+if __name__ == "__main__":
+    main()
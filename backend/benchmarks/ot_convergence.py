@@ -0,0 +1,217 @@
+"""Simulate N editors typing concurrently in one room through SyncService.
+
+Each editor runs the standard OT client loop (one diff in flight, later
+local edits composed into a buffer and transformed against incoming diffs) over a simulated
+network with random per-message latency, and reports how often diffs
+crossed in flight and what rebasing them cost. After the run every editor
+must hold exactly the server document; the script exits non-zero
+otherwise. The seeded checks of transform, compose and the patch round
+trip, plus a few fixed runs of this simulation, are in
+tests/test_operations.py.
+
+    cd backend && python -m benchmarks.ot_convergence --editors 2 5 10 20
+"""
+import argparse
+import asyncio
+import heapq
+import itertools
+import random
+import sys
+import time
+from typing import Any, Callable, List, Optional
+
+from diff_match_patch import diff_match_patch
+
+from app.services import operations
+from benchmarks.common import ROOM_ID, open_room
+
+ALPHABET = "abcdefgh \n"
+
+
+def random_edit(text: str, rng: random.Random) -> operations.Operation:
+    pos = rng.randint(0, len(text))
+    kind = rng.random()
+
+    if kind < 0.6 or not text:
+        return operations.normalize([pos, "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 6)))])
+
+    length = rng.randint(1, min(8, len(text) - min(pos, len(text) - 1)))
+    pos = min(pos, len(text) - length)
+    if kind < 0.85:
+        return operations.normalize([pos, -length])
+    return operations.normalize([pos, -length, rng.choice(ALPHABET) * rng.randint(1, 4)])
+
+
+class Editor:
+    def __init__(self, user_id: str, text: str, version: int):
+        self.user_id = user_id
+        self.text = text
+        self.server_text = text
+        self.version = version
+        self.pending: Optional[operations.Operation] = None
+        self.buffer: Optional[operations.Operation] = None
+
+    def edit(self, rng: random.Random) -> None:
+        op = random_edit(self.text, rng)
+        self.text = operations.apply(self.text, op)
+        self.buffer = operations.compose(self.buffer, op) if self.buffer is not None else op
+
+    def next_diff(self, dmp: diff_match_patch) -> Optional[tuple]:
+        if self.pending is not None or self.buffer is None:
+            return None
+        self.pending, self.buffer = self.buffer, None
+        return operations.to_patch_text(dmp, self.server_text, self.pending), self.version
+
+    def on_ack(self, version: int) -> None:
+        self.server_text = operations.apply(self.server_text, self.pending)
+        self.version = version
+        self.pending = None
+
+    def on_remote(self, dmp: diff_match_patch, diff: str, version: int) -> None:
+        op = operations.from_patches(dmp.patch_fromText(diff))
+        self.server_text = operations.apply(self.server_text, op)
+        self.version = version
+
+        if self.pending is not None:
+            op, self.pending = operations.transform(op, self.pending)
+        if self.buffer is not None:
+            op, self.buffer = operations.transform(op, self.buffer)
+
+        self.text = operations.apply(self.text, op)
+
+    def on_sync(self, code: str, version: int) -> None:
+        self.text = self.server_text = code
+        self.version = version
+        self.pending = None
+        self.buffer = None
+
+
+class Simulation:
+    def __init__(self, editors: int, edits: int, seed: int, latency_ms: float):
+        self.rng = random.Random(seed)
+        self.dmp = diff_match_patch()
+        self.editor_count = editors
+        self.edits = edits
+        self.latency = latency_ms / 1000
+        self.now = 0.0
+        self.events: List[Any] = []
+        self.sequence = itertools.count()
+        self.channel_clock = {}
+
+        self.submitted = 0
+        self.conflicts = 0
+        self.rejections = 0
+        self.apply_seconds = 0.0
+
+    def schedule(self, delay: float, callback: Callable) -> None:
+        heapq.heappush(self.events, (self.now + delay, next(self.sequence), callback))
+
+    def send(self, channel: str, callback: Callable) -> None:
+        # Per-channel FIFO, like a single WebSocket
+        at = max(self.now + self.rng.expovariate(1 / self.latency), self.channel_clock.get(channel, 0.0))
+        self.channel_clock[channel] = at
+        heapq.heappush(self.events, (at, next(self.sequence), callback))
+
+    async def run(self) -> bool:
+        initial = "def main():\n    pass\n" * 20
+        sync, doc = await open_room(initial)
+
+        editors = [Editor(f"user{i}", initial, doc.version) for i in range(self.editor_count)]
+        remaining = [self.edits] * len(editors)
+
+        def type_key(editor_index: int) -> Callable:
+            def callback():
+                editor = editors[editor_index]
+                editor.edit(self.rng)
+                remaining[editor_index] -= 1
+                flush(editor)
+                if remaining[editor_index]:
+                    self.schedule(self.rng.expovariate(20), type_key(editor_index))
+            return callback
+
+        def flush(editor: Editor) -> None:
+            message = editor.next_diff(self.dmp)
+            if message:
+                self.submitted += 1
+                self.send(f"up:{editor.user_id}", receive_diff(editor, *message))
+
+        def receive_diff(editor: Editor, diff: str, version: int) -> Callable:
+            async def callback():
+                if version != doc.version:
+                    self.conflicts += 1
+
+                start = time.perf_counter()
+                success, new_version, _, applied = await sync.apply_user_diff(
+                    ROOM_ID, diff, version, editor.user_id
+                )
+                self.apply_seconds += time.perf_counter() - start
+
+                if not success:
+                    self.rejections += 1
+                    code, current = doc.code, doc.version
+                    self.send(f"down:{editor.user_id}", lambda: (editor.on_sync(code, current), flush(editor)))
+                    return
+
+                for other in editors:
+                    if other is not editor:
+                        self.send(f"down:{other.user_id}", deliver(other, applied, new_version))
+                self.send(f"down:{editor.user_id}", ack(editor, new_version))
+            return callback
+
+        def deliver(editor: Editor, diff: str, version: int) -> Callable:
+            return lambda: editor.on_remote(self.dmp, diff, version)
+
+        def ack(editor: Editor, version: int) -> Callable:
+            return lambda: (editor.on_ack(version), flush(editor))
+
+        for i in range(len(editors)):
+            self.schedule(self.rng.random() * 0.05, type_key(i))
+
+        while self.events:
+            self.now, _, callback = heapq.heappop(self.events)
+            result = callback()
+            if asyncio.iscoroutine(result):
+                await result
+
+        return all(e.text == doc.code and e.version == doc.version for e in editors)
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--editors", type=int, nargs="+", default=[2, 5, 10, 20])
+    parser.add_argument("--edits", type=int, default=100, help="edits per editor")
+    parser.add_argument("--seeds", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'editors':>8} {'diffs':>8} {'conflict%':>10} {'reject%':>8} {'apply us':>9} {'converged':>10}")
+
+    for count in args.editors:
+        submitted = conflicts = rejections = 0
+        apply_seconds = 0.0
+        converged = 0
+
+        for seed in range(args.seeds):
+            sim = Simulation(count, args.edits, seed, args.latency_ms)
+            if await sim.run():
+                converged += 1
+            else:
+                failed = True
+                print(f"  seed {seed} with {count} editors diverged", file=sys.stderr)
+            submitted += sim.submitted
+            conflicts += sim.conflicts
+            rejections += sim.rejections
+            apply_seconds += sim.apply_seconds
+
+        print(
+            f"{count:>8} {submitted:>8} {100 * conflicts / submitted:>9.1f}% "
+            f"{100 * rejections / submitted:>7.2f}% {1e6 * apply_seconds / submitted:>9.1f} "
+            f"{converged:>4}/{args.seeds}"
+        )
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,97 @@
+"""Outbound cursor frames per room, per-event broadcast vs presence ticks.
+
+Every user in an in-memory room moves their cursor --rate times a second
+for --seconds. Counts the frames the room's sockets receive when each
+move is broadcast straight away, and when moves go through
+PresenceService and leave as one "cursors" frame per tick.
+
+    cd backend && python -m benchmarks.presence --users 5 20 50
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+
+from app.config import settings
+from app.services.connection_manager import ConnectionManager
+from app.services.presence_service import PresenceService
+
+ROOM_ID = "bench"
+
+
+class CountingWebSocket:
+    def __init__(self):
+        self.frames = 0
+        self.cursor_entries = 0
+
+    async def accept(self) -> None:
+        pass
+
+    async def close(self, code: int = 1000) -> None:
+        pass
+
+    async def send_text(self, data: str) -> None:
+        message = json.loads(data)
+        if message["type"] == "cursor":
+            self.frames += 1
+            self.cursor_entries += 1
+        elif message["type"] == "cursors":
+            self.frames += 1
+            self.cursor_entries += len(message["payload"]["cursors"])
+
+
+async def run(users: int, args, batched: bool):
+    settings.presence_tick_ms = args.tick_ms
+    manager = ConnectionManager()
+    presence = PresenceService(manager)
+    sockets = [CountingWebSocket() for _ in range(users)]
+
+    for i, ws in enumerate(sockets):
+        await manager.connect(ws, ROOM_ID, f"user-{i}", f"user-{i}")
+
+    interval = 1 / args.rate
+    start = time.perf_counter()
+    moves = 0
+
+    for step in range(int(args.seconds * args.rate)):
+        await asyncio.sleep(max(start + step * interval - time.perf_counter(), 0))
+        for i in range(users):
+            position = {"line": i + 1, "column": step % 80 + 1}
+            if batched:
+                presence.update_cursor(ROOM_ID, f"user-{i}", f"user-{i}", "#3B82F6", position)
+            else:
+                await manager._broadcast_message(ROOM_ID, {
+                    "type": "cursor",
+                    "payload": {"user_id": f"user-{i}", "position": position},
+                    "timestamp": datetime.utcnow().isoformat()
+                })
+            moves += 1
+
+    await asyncio.sleep(args.tick_ms / 1000 * 3)
+    for ws in sockets:
+        await manager.disconnect(ws)
+
+    return moves, sum(ws.frames for ws in sockets), sum(ws.cursor_entries for ws in sockets)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[5, 20, 50])
+    parser.add_argument("--rate", type=float, default=60)
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--tick-ms", type=int, default=40)
+    args = parser.parse_args()
+
+    print(f"{args.rate:g} moves/s per user for {args.seconds:g}s, {args.tick_ms}ms tick")
+    for users in args.users:
+        moves, direct, _ = await run(users, args, batched=False)
+        _, batched, entries = await run(users, args, batched=True)
+        print(
+            f"  {users:>3} users  {moves:>6} moves  per-event {direct:>8} frames  "
+            f"ticked {batched:>6} frames ({entries} cursor entries)  {direct / max(batched, 1):.0f}x fewer"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
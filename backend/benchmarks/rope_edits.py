@@ -0,0 +1,98 @@
+"""Per-edit cost of the rope-backed document as the room grows.
+
+Applies the same single-keystroke inserts and deletes to documents from
+10 KiB to 10 MiB, once by rebuilding a str (the old representation) and
+once through Rope.apply, then times the full SyncService.apply_user_ops
+path. Rope numbers should stay flat while the str rebuild grows with the
+document.
+
+    cd backend && python -m benchmarks.rope_edits --edits 500
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import List
+
+from app.services import operations
+from app.services.rope import Rope
+from benchmarks.common import ROOM_ID, open_room
+
+LINE = "    total = compute(value, index) + offset  # line\n"
+
+
+def make_edits(size: int, count: int, rng: random.Random) -> List[operations.Operation]:
+    edits = []
+
+    for _ in range(count):
+        pos = rng.randint(0, size - 1)
+        if rng.random() < 0.7:
+            edits.append(operations.normalize([pos, rng.choice("abcxyz ")]))
+            size += 1
+        else:
+            edits.append(operations.normalize([pos, -1]))
+            size -= 1
+
+    return edits
+
+
+def timed(samples: List[float], start: float) -> None:
+    samples.append((time.perf_counter() - start) * 1e6)
+
+
+def bench_str(text: str, edits) -> List[float]:
+    samples = []
+    for op in edits:
+        start = time.perf_counter()
+        text = operations.apply(text, op)
+        timed(samples, start)
+    return samples
+
+
+def bench_rope(text: str, edits) -> List[float]:
+    rope = Rope(text)
+    samples = []
+    for op in edits:
+        start = time.perf_counter()
+        rope = rope.apply(op)
+        timed(samples, start)
+    return samples
+
+
+async def bench_sync(text: str, edits) -> List[float]:
+    sync, doc = await open_room(text)
+    samples = []
+    for op in edits:
+        wire = operations.to_wire(op)
+        start = time.perf_counter()
+        success, *_ = await sync.apply_user_ops(ROOM_ID, wire, doc.version, "bench", need_diff=True)
+        timed(samples, start)
+        assert success
+    return samples
+
+
+def summarize(samples: List[float]) -> str:
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return f"mean {statistics.mean(samples):>9.1f}us  p99 {p99:>9.1f}us"
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kib", type=int, nargs="+", default=[10, 100, 1_024, 10_240])
+    parser.add_argument("--edits", type=int, default=500)
+    args = parser.parse_args()
+
+    for kib in args.kib:
+        text = LINE * max(kib * 1024 // len(LINE), 1)
+        edits = make_edits(len(text), args.edits, random.Random(kib))
+
+        print(f"{len(text) // 1024} KiB, {args.edits} edits")
+        print(f"  str rebuild     {summarize(bench_str(text, edits))}")
+        print(f"  rope            {summarize(bench_rope(text, edits))}")
+        print(f"  apply_user_ops  {summarize(await bench_sync(text, edits))}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""Python run latency, cold subprocess vs warm sandbox pool.
+
+Runs a short program --runs times through ExecutionService, first with
+the cold path (a fresh interpreter per run) and then through SandboxPool's
+pre-forked workers, sequentially and with --concurrency runs in flight.
+Reports end-to-end latency and the pool's hit rate and startup latency.
+
+    cd backend && python -m benchmarks.sandbox --runs 200 --pool-size 4
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from app.config import settings
+from app.models.schemas import Language
+from app.services.execution_service import ExecutionService
+from app.services.sandbox_pool import SandboxPool, percentile
+
+PROGRAM = """
+from collections import Counter
+words = input().split()
+print(Counter(words).most_common(3))
+"""
+INPUT = "the quick brown fox jumps over the lazy dog the fox\n"
+
+
+def summarize(samples: List[float]) -> str:
+    return (
+        f"p50 {statistics.median(samples):>8.2f}ms  "
+        f"p99 {percentile(samples, 0.99):>8.2f}ms  n={len(samples)}"
+    )
+
+
+async def timed_run(service: ExecutionService, samples: List[float]) -> None:
+    start = time.perf_counter()
+    result = await service.execute(PROGRAM, Language.PYTHON, INPUT)
+    samples.append((time.perf_counter() - start) * 1000)
+    if result.error or "the" not in result.output:
+        raise RuntimeError(f"Unexpected result: {result.output!r} {result.error!r}")
+
+
+async def bench(service: ExecutionService, runs: int, concurrency: int) -> List[float]:
+    samples: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with semaphore:
+            await timed_run(service, samples)
+
+    await asyncio.gather(*(one() for _ in range(runs)))
+    return samples
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    cold = ExecutionService()
+    pool = SandboxPool(args.pool_size, settings.sandbox_max_runs)
+    warm = ExecutionService(pool)
+    await pool.start()
+
+    try:
+        print(f"{args.runs} runs, pool of {args.pool_size}")
+        print(f"  cold  sequential      {summarize(await bench(cold, args.runs, 1))}")
+        print(f"  warm  sequential      {summarize(await bench(warm, args.runs, 1))}")
+        print(f"  cold  concurrency {args.concurrency:<3} {summarize(await bench(cold, args.runs, args.concurrency))}")
+        print(f"  warm  concurrency {args.concurrency:<3} {summarize(await bench(warm, args.runs, args.concurrency))}")
+
+        stats = pool.stats()
+        print(
+            f"  pool  hit rate {stats['hit_rate']:.1%}  recycled {stats['recycled']}  "
+            f"startup p50 {stats['startup_ms']['p50']}ms p99 {stats['startup_ms']['p99']}ms"
+        )
+    finally:
+        await pool.stop()
+        cold.cleanup()
+        warm.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,119 @@
+"""Bytes on the wire and encode cost per frame for each negotiable format.
+
+Builds the diff, cursors and sync frames the server sends for a room of
+--users users editing a --lines line document, then encodes each one
+--repeat times with every wire format: stdlib json.dumps (the encoder
+before app.services.wire_format), plain JSON text through the wire format's
+encoder (orjson when installed), JSON deflated above --threshold, and
+msgpack with and without compression when msgpack is installed. Compression only kicks
+in for frames at least --threshold bytes long, so small frames show the
+uncompressed size under the deflate columns too.
+
+    cd backend && python -m benchmarks.wire_format --lines 100 5000 --users 20
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Tuple
+
+from diff_match_patch import diff_match_patch
+
+from app.services.wire_format import WireFormat, msgpack, orjson
+
+
+def make_messages(lines: int, users: int) -> List[Tuple[str, Dict[str, Any]]]:
+    rng = random.Random(lines)
+    code = "".join(
+        f"    value_{rng.randint(0, 9999)} = compute(items[{i}], {rng.random():.4f})  # step {i}\n"
+        for i in range(lines)
+    )
+    edited = code[:len(code) // 2] + "x = 1\n" + code[len(code) // 2:]
+
+    dmp = diff_match_patch()
+    diff = dmp.patch_toText(dmp.patch_make(code, edited))
+
+    cursors = [
+        {
+            "user_id": f"user-{i}",
+            "username": f"User {i}",
+            "color": "#3B82F6",
+            "position": {"line": rng.randint(1, lines), "column": rng.randint(1, 60)},
+            "selection": None
+        }
+        for i in range(users)
+    ]
+
+    timestamp = datetime.utcnow().isoformat()
+
+    return [
+        ("diff", {
+            "type": "diff",
+            "payload": {"diff": diff, "user_id": "user-0", "version": 42},
+            "timestamp": timestamp
+        }),
+        ("cursors", {
+            "type": "cursors",
+            "payload": {"cursors": cursors},
+            "timestamp": timestamp
+        }),
+        ("sync", {
+            "type": "sync",
+            "payload": {
+                "room_id": "bench", "code": code, "version": 42,
+                "language": "python", "users": cursors
+            },
+            "timestamp": timestamp
+        })
+    ]
+
+
+def measure(encode: Callable[[Dict[str, Any]], Any], message: Dict[str, Any], repeat: int) -> Tuple[int, float]:
+    frame = encode(message)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encode(message)
+    encode_us = (time.perf_counter() - start) / repeat * 1_000_000
+
+    size = len(frame.encode("utf-8")) if isinstance(frame, str) else len(frame)
+    return size, encode_us
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[100, 5_000])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--threshold", type=int, default=4096)
+    parser.add_argument("--level", type=int, default=1)
+    args = parser.parse_args()
+
+    formats = [
+        ("json.dumps", json.dumps),
+        ("orjson" if orjson is not None else "json", WireFormat("json").encode),
+        ("json+deflate", WireFormat("json", args.threshold, args.level).encode)
+    ]
+    if msgpack is not None:
+        formats.append(("msgpack", WireFormat("msgpack").encode))
+        formats.append(("msgpack+deflate", WireFormat("msgpack", args.threshold, args.level).encode))
+    else:
+        print("msgpack is not installed, skipping its formats")
+
+    for lines in args.lines:
+        print(f"{lines} lines, {args.users} users, deflate level {args.level} at {args.threshold} bytes")
+
+        for kind, message in make_messages(lines, args.users):
+            baseline, _ = measure(formats[0][1], message, 1)
+
+            for label, encode in formats:
+                size, encode_us = measure(encode, message, args.repeat)
+                print(
+                    f"  {kind:<8} {label:<16} {size:>9} bytes "
+                    f"({size / baseline:>6.1%})  encode {encode_us:>9.1f}us"
+                )
+
+
+if __name__ == "__main__":
+    main()
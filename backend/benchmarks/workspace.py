@@ -0,0 +1,124 @@
+"""Execution workspace cost, disk vs RAM-backed directory vs memfd sources.
+
+For each workspace kind, performs --runs run lifecycles sequentially and
+then with --concurrency in flight: create the per-run directory, write the
+source, read it back the way a compiler would, write a --binary-kb output
+file, and remove the directory. With --execute, each run instead goes
+through ExecutionService's cold Python path, so the numbers include the
+interpreter start that the workspace sits next to.
+
+    cd backend && python -m benchmarks.workspace --runs 1000 --concurrency 8
+    cd backend && python -m benchmarks.workspace --runs 100 --execute
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from typing import List
+
+from app.models.schemas import Language
+from app.services.execution_service import ExecutionService
+from app.services.sandbox_pool import percentile
+from app.services.workspace import Workspace
+
+PROGRAM = """
+import sys
+total = sum(int(x) for x in sys.stdin.read().split())
+print(total)
+""" + "# padding to a typical solution size\n" * 60
+INPUT = " ".join(str(i) for i in range(100)) + "\n"
+
+
+def summarize(samples: List[float], elapsed: float) -> str:
+    return (
+        f"p50 {statistics.median(samples):>8.3f}ms  "
+        f"p99 {percentile(samples, 0.99):>8.3f}ms  "
+        f"{len(samples) / elapsed:>9.0f} runs/s"
+    )
+
+
+def lifecycle(workspace: Workspace, binary: bytes) -> float:
+    start = time.perf_counter()
+
+    with workspace.run_dir() as run_dir:
+        with workspace.source(run_dir, "main.py", PROGRAM) as (source_path, _):
+            with open(source_path, "rb") as f:
+                f.read()
+
+            with open(os.path.join(run_dir, "main.exe"), "wb") as f:
+                f.write(binary)
+
+    return (time.perf_counter() - start) * 1000
+
+
+async def bench_lifecycle(workspace: Workspace, runs: int, concurrency: int, binary: bytes) -> str:
+    samples: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with semaphore:
+            if concurrency == 1:
+                samples.append(lifecycle(workspace, binary))
+            else:
+                samples.append(await asyncio.to_thread(lifecycle, workspace, binary))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(runs)))
+    return summarize(samples, time.perf_counter() - start)
+
+
+async def bench_execute(workspace: Workspace, runs: int, concurrency: int) -> str:
+    service = ExecutionService(workspace=workspace)
+    samples: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            result = await service.execute(PROGRAM, Language.PYTHON, INPUT)
+            samples.append((time.perf_counter() - start) * 1000)
+            if result.output.strip() != "4950":
+                raise RuntimeError(f"Unexpected result: {result.output!r} {result.error!r}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(runs)))
+    return summarize(samples, time.perf_counter() - start)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--binary-kb", type=int, default=64)
+    parser.add_argument("--execute", action="store_true")
+    args = parser.parse_args()
+
+    binary = os.urandom(args.binary_kb * 1024)
+    workspaces = [
+        ("disk", Workspace("disk")),
+        ("memory", Workspace("memory")),
+        ("memfd", Workspace("memory", use_memfd=True))
+    ]
+
+    print(f"{args.runs} runs, {'cold Python execution' if args.execute else 'workspace lifecycle only'}")
+
+    try:
+        for label, workspace in workspaces:
+            if label != workspace.kind and not workspace.use_memfd:
+                print(f"  {label:<7} unavailable here, skipped")
+                continue
+
+            for concurrency in (1, args.concurrency):
+                if args.execute:
+                    result = await bench_execute(workspace, args.runs, concurrency)
+                else:
+                    result = await bench_lifecycle(workspace, args.runs, concurrency, binary)
+                print(f"  {label:<7} concurrency {concurrency:<3} {result}")
+    finally:
+        for _, workspace in workspaces:
+            workspace.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,32 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.routers import admin
+
+
+def test_admin_endpoints_need_the_token(monkeypatch):
+    monkeypatch.setattr(settings, "admin_token", "s3cret")
+    app = FastAPI()
+    app.include_router(admin.router)
+    client = TestClient(app)
+
+    assert client.get("/admin/event-loop").status_code == 401
+    assert client.put(
+        "/admin/event-loop/profiler", json={"threshold_ms": 1},
+        headers={"Authorization": "Bearer wrong"}
+    ).status_code == 401
+    assert client.delete("/admin/event-loop/profiler/entries").status_code == 401
+
+    response = client.get("/admin/event-loop", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
+    assert "profiler" in response.json()
+
+
+def test_admin_endpoints_are_refused_without_a_configured_token(monkeypatch):
+    monkeypatch.setattr(settings, "admin_token", "")
+    app = FastAPI()
+    app.include_router(admin.router)
+    client = TestClient(app)
+
+    assert client.get("/admin/event-loop", headers={"Authorization": "Bearer "}).status_code == 401
@@ -0,0 +1,50 @@
+import asyncio
+import os
+
+from app.services.compile_cache import CompileCache
+
+
+def test_waiter_takes_over_when_leader_is_cancelled(tmp_path):
+    cache = CompileCache(str(tmp_path), 1024 * 1024, [])
+    # Skips asking g++ for its version when building keys
+    cache._compiler = "test"
+
+    compiles = []
+
+    async def fake_compile(key: str, source: str) -> None:
+        compiles.append(key)
+        if len(compiles) == 1:
+            # The leader's compile never finishes on its own
+            await asyncio.Event().wait()
+
+        with open(cache.path_for(key), "wb") as f:
+            f.write(b"binary")
+        cache._entries[key] = 6
+        cache.total_bytes += 6
+
+    cache._compile = fake_compile
+
+    async def scenario():
+        leader = asyncio.create_task(cache.acquire("int main() {}"))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.acquire("int main() {}"))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        try:
+            await leader
+        except asyncio.CancelledError:
+            pass
+        else:
+            raise AssertionError("leader was not cancelled")
+
+        key, path, _ = await asyncio.wait_for(waiter, timeout=1)
+        cache.release(key)
+        return key, path
+
+    key, path = asyncio.run(scenario())
+
+    assert compiles == [key, key]
+    assert os.path.exists(path)
+    assert not cache._inflight
+    assert not cache._pins
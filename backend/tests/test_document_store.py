@@ -0,0 +1,79 @@
+import asyncio
+
+from app.services.document_store import DocumentStore
+
+
+class SlowRoomRepository:
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.slow_rooms = set()
+
+    async def get_room(self, room_id: str):
+        if room_id in self.slow_rooms:
+            await self.gate.wait()
+        return {"room_id": room_id, "code": f"# {room_id}\n", "version": 1}
+
+
+def test_slow_load_does_not_block_other_rooms():
+    async def scenario():
+        store = DocumentStore()
+        repo = SlowRoomRepository()
+        repo.slow_rooms.add("slow")
+
+        slow = asyncio.create_task(store.acquire("slow", repo))
+        await asyncio.sleep(0)
+
+        doc = await asyncio.wait_for(store.acquire("fast", repo), timeout=1)
+        assert doc.code == "# fast\n"
+        await asyncio.wait_for(store.release("fast"), timeout=1)
+        assert store.get("fast") is None
+
+        # A second join of the loading room waits for that one load
+        again = asyncio.create_task(store.acquire("slow", repo))
+        repo.gate.set()
+        first, second = await asyncio.gather(slow, again)
+        assert first is second and first.connections == 2
+
+    asyncio.run(scenario())
+
+
+def test_rejoin_during_eviction_keeps_the_document():
+    async def scenario():
+        store = DocumentStore()
+        repo = SlowRoomRepository()
+        flushing = asyncio.Event()
+        finish = asyncio.Event()
+        flushed_versions = []
+
+        async def on_evict(doc):
+            flushed_versions.append(doc.version)
+            flushing.set()
+            await finish.wait()
+
+        doc = await store.acquire("room", repo)
+        evicting = asyncio.create_task(store.release("room", on_evict=on_evict))
+        await flushing.wait()
+
+        # Neither a rejoin nor another room waits for the flush
+        rejoined = await asyncio.wait_for(store.acquire("room", repo), timeout=1)
+        other = await asyncio.wait_for(store.acquire("other", repo), timeout=1)
+        assert rejoined is doc and other is not doc
+
+        finish.set()
+        await evicting
+        assert store.get("room") is doc and doc.connections == 1
+
+        # An edit made during a later flush is flushed again before eviction
+        finish.clear()
+        flushing.clear()
+        evicting = asyncio.create_task(store.release("room", on_evict=on_evict))
+        await flushing.wait()
+        doc.version += 1
+        finish.set()
+        await evicting
+
+        assert store.get("room") is None
+        assert flushed_versions == [1, 1, 2]
+        assert not store._room_locks
+
+    asyncio.run(scenario())
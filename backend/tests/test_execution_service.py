@@ -0,0 +1,19 @@
+import asyncio
+
+import pytest
+
+from app.models.schemas import Language
+from app.services.execution_service import ExecutionService
+from app.services.resource_limits import UsageReport
+
+
+@pytest.mark.skipif(not UsageReport.supported, reason="needs fork and resource")
+def test_cold_run_reports_exit_code_and_usage():
+    service = ExecutionService()
+
+    result = asyncio.run(service.execute("import sys\nprint(input())\nsys.exit(3)", Language.PYTHON, "hi\n"))
+
+    assert result.output == "hi\n"
+    assert result.exit_code == 3
+    assert result.usage is not None
+    assert result.usage.max_rss_kb > 0
@@ -0,0 +1,105 @@
+import asyncio
+import random
+
+import pytest
+from diff_match_patch import diff_match_patch
+
+from app.services import operations
+from benchmarks.common import ROOM_ID, open_room
+from benchmarks.ot_convergence import Simulation
+
+ALPHABET = "ab \né"
+SEEDS = range(200)
+
+
+def random_text(rng: random.Random) -> str:
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 40)))
+
+
+# Walks the whole text, so an op can retain, delete and insert in several places
+def random_op(text: str, rng: random.Random) -> operations.Operation:
+    op: operations.Operation = []
+    pos = 0
+
+    while pos < len(text):
+        n = rng.randint(1, min(5, len(text) - pos))
+        kind = rng.random()
+        if kind < 0.5:
+            op.append(n)
+        elif kind < 0.75:
+            op.append(-n)
+        else:
+            op.append(random_text(rng)[:n] or "x")
+            continue
+        pos += n
+
+    if rng.random() < 0.3:
+        op.append(random_text(rng) or "y")
+
+    return operations.normalize(op)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_transform_converges(seed):
+    rng = random.Random(seed)
+    text = random_text(rng)
+    a, b = random_op(text, rng), random_op(text, rng)
+
+    a_prime, b_prime = operations.transform(a, b)
+
+    assert operations.apply(operations.apply(text, a), b_prime) == operations.apply(operations.apply(text, b), a_prime)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_compose_matches_sequential_apply(seed):
+    rng = random.Random(seed)
+    text = random_text(rng)
+    a = random_op(text, rng)
+    b = random_op(operations.apply(text, a), rng)
+
+    assert operations.apply(text, operations.compose(a, b)) == operations.apply(operations.apply(text, a), b)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_patch_round_trip(seed):
+    rng = random.Random(seed)
+    dmp = diff_match_patch()
+    text = random_text(rng) * 3
+    op = random_op(text, rng)
+
+    patch_text = operations.to_patch_text(dmp, text, op)
+    parsed = operations.from_patches(dmp.patch_fromText(patch_text), text)
+
+    assert operations.apply(text, parsed) == operations.apply(text, op)
+    assert operations.to_patch_text(dmp, text, parsed) == patch_text
+
+    # Patches made by a client's diff_match_patch, not by to_patches
+    new_text = operations.apply(text, op)
+    made = operations.from_patches(dmp.patch_make(text, new_text), text)
+    assert operations.apply(text, made) == new_text
+
+
+def test_concurrent_ops_are_rebased_onto_the_log():
+    async def scenario():
+        sync, doc = await open_room("hello world\n")
+        base = doc.version
+
+        first = await sync.apply_user_ops(ROOM_ID, operations.to_wire([5, ","]), base, "a", need_diff=False)
+        second = await sync.apply_user_ops(ROOM_ID, operations.to_wire([11, "!"]), base, "b", need_diff=True)
+        return doc, base, first, second
+
+    doc, base, first, second = asyncio.run(scenario())
+
+    assert first[:3] == (True, base + 1, [5, ","])
+    assert second[:3] == (True, base + 2, [12, "!"])
+    assert second[3] is not None
+    assert doc.code == "hello, world!\n"
+
+
+@pytest.mark.parametrize("editors,seed", [(2, 0), (3, 1), (5, 2), (8, 3)])
+def test_editors_converge_through_sync_service(editors, seed):
+    sim = Simulation(editors, 40, seed, latency_ms=40.0)
+
+    assert asyncio.run(sim.run())
+    # Enough edits crossed in flight to go through the rebase path
+    assert sim.conflicts > 0
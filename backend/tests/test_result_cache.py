@@ -0,0 +1,42 @@
+import asyncio
+
+from app.models.schemas import CodeExecutionResponse
+from app.services.result_cache import ResultCache
+
+
+def test_waiter_takes_over_when_leader_is_cancelled():
+    cache = ResultCache(60, 1024 * 1024)
+    runs = []
+
+    async def run() -> CodeExecutionResponse:
+        runs.append(len(runs))
+        if len(runs) == 1:
+            # The leader's run never finishes on its own
+            await asyncio.Event().wait()
+        return CodeExecutionResponse(output="42\n", execution_time=0.01, exit_code=0)
+
+    async def scenario():
+        leader = asyncio.create_task(cache.get_or_run("key", run))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_run("key", run))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        try:
+            await leader
+        except asyncio.CancelledError:
+            pass
+        else:
+            raise AssertionError("leader was not cancelled")
+
+        result = await asyncio.wait_for(waiter, timeout=1)
+        again = await cache.get_or_run("key", run)
+        return result, again
+
+    result, again = asyncio.run(scenario())
+
+    assert runs == [0, 1]
+    assert result.output == "42\n" and not result.cached
+    assert again.cached
+    assert not cache._inflight
+    assert cache.misses == 2 and cache.hits == 1
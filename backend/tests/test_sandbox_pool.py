@@ -0,0 +1,27 @@
+import asyncio
+import time
+
+from app.config import settings
+from app.services.sandbox_pool import SandboxPool
+
+
+def test_busy_pool_falls_back_cold_without_waiting_out_a_run(monkeypatch):
+    monkeypatch.setattr(settings, "sandbox_acquire_wait_ms", 5)
+    pool = SandboxPool(1, 10)
+
+    async def scenario():
+        # One worker, already handed out to another run
+        pool.started = True
+        pool._idle = asyncio.Queue()
+        pool._workers.add(object())
+
+        start = time.monotonic()
+        worker = await pool._acquire()
+        return worker, time.monotonic() - start
+
+    worker, elapsed = asyncio.run(scenario())
+
+    assert worker is None
+    assert elapsed < 1
+    assert pool.misses == 1
+    assert pool.warm_hits == 0
@@ -0,0 +1,42 @@
+import asyncio
+
+from app.services.document_store import DocumentStore, RoomDocument
+from app.services.persistence_service import PersistenceService
+from app.services.snapshot_service import SnapshotService
+
+
+def test_snapshot_flushes_through_the_write_behind_service(monkeypatch):
+    store = DocumentStore()
+    persistence = PersistenceService()
+    snapshots = SnapshotService(store, persistence)
+    writes = []
+
+    async def write_batch(batch):
+        for doc, _ in batch:
+            writes.append((doc.room_id, doc.version))
+            doc.persisted_version = doc.version
+        return len(batch)
+
+    monkeypatch.setattr(persistence, "_write_batch", write_batch)
+
+    tracked = RoomDocument("tracked", "a")
+    untracked = RoomDocument("untracked", "b")
+    clean = RoomDocument("clean", "c")
+    for doc in (tracked, untracked, clean):
+        store._documents[doc.room_id] = doc
+
+    tracked.version += 1
+    persistence.mark_dirty(tracked, 1)
+    # Changed without going through the write-behind service
+    untracked.version += 1
+
+    async def scenario():
+        tick = await snapshots.run_tick()
+        # The write-behind loop's next flush finds nothing left to write
+        await persistence.flush()
+        return tick
+
+    tick = asyncio.run(scenario())
+
+    assert sorted(writes) == [("tracked", 2), ("untracked", 2)]
+    assert tick["saved"] == 2 and tick["skipped"] == 1 and tick["failed"] == 0
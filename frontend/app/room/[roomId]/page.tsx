@@ -104,14 +104,36 @@ export default function RoomPage() {
   }, []);
 
   const handleExecutionResult = useCallback(
-    (result: { output: string; error: string; execution_time: number }) => {
-      setOutput(result.output);
-      setError(result.error || "");
+    (result: { output: string; error: string; execution_time: number; streamed?: boolean }) => {
+      // Streamed runs already delivered their output; error only adds notes
+      // like a timeout or truncation
+      if (result.streamed) {
+        if (result.error) setError((prev) => (prev ? `${prev}\n${result.error}` : result.error));
+      } else {
+        setOutput(result.output);
+        setError(result.error || "");
+      }
       setExecutionTime(result.execution_time);
       setIsRunning(false);
     }, []
   );
 
+  const handleExecutionOutput = useCallback(
+    (payload: { chunks: [string, string][] }) => {
+      for (const [stream, text] of payload.chunks) {
+        if (stream === "stderr") setError((prev) => prev + text);
+        else setOutput((prev) => prev + text);
+      }
+    }, []
+  );
+
+  const handleExecutionStatus = useCallback(
+    (status: { type: string; user_id: string; position?: number }) => {
+      if (status.user_id !== userId) return;
+      setOutput(status.type === "execution_queued" ? `Queued (position ${status.position})...` : "");
+    }, [userId]
+  );
+
   const { isConnected, sendDiff, sendCursor, runCode, users } = useWebSocket({
     roomId, userId, username,
     onSync: handleSync,
@@ -120,6 +142,8 @@ export default function RoomPage() {
     onUserJoin: handleUserJoin,
     onUserLeave: handleUserLeave,
     onExecutionResult: handleExecutionResult,
+    onExecutionOutput: handleExecutionOutput,
+    onExecutionStatus: handleExecutionStatus,
   });
 
   const handleCodeChange = useCallback(
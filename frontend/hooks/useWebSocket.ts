@@ -16,6 +16,30 @@ export interface WebSocketMessage {
   timestamp: string;
 }
 
+// Binary frames carry a one-byte tag: 0x01 msgpack body, 0x02 deflated.
+// This client only negotiates compression, so bodies are always JSON.
+const TAG_MSGPACK = 0x01;
+const TAG_DEFLATE = 0x02;
+
+async function decodeFrame(data: string | ArrayBuffer): Promise<WebSocketMessage> {
+  if (typeof data === "string") {
+    return JSON.parse(data);
+  }
+
+  const bytes = new Uint8Array(data);
+  const tag = bytes[0];
+  if (tag & TAG_MSGPACK) {
+    throw new Error("msgpack frames are not supported by this client");
+  }
+
+  const body = bytes.subarray(1);
+  if (tag & TAG_DEFLATE) {
+    const stream = new Blob([body]).stream().pipeThrough(new DecompressionStream("deflate"));
+    return JSON.parse(await new Response(stream).text());
+  }
+  return JSON.parse(new TextDecoder().decode(body));
+}
+
 export interface UseWebSocketOptions {
   roomId: string;
   userId: string;
@@ -28,7 +52,9 @@ export interface UseWebSocketOptions {
   onCursorUpdate?: (user: User) => void;
   onCodeUpdate?: (diff: string, userId: string, version: number) => void;
   onSync?: (code: string, version: number, language: string) => void;
-  onExecutionResult?: (result: { output: string; error: string; execution_time: number }) => void;
+  onExecutionResult?: (result: { output: string; error: string; execution_time: number; streamed?: boolean }) => void;
+  onExecutionOutput?: (output: { job_id: string; seq: number; chunks: [string, string][] }) => void;
+  onExecutionStatus?: (status: { type: string; job_id: string; user_id: string; position?: number }) => void;
   reconnectInterval?: number;
   maxReconnectAttempts?: number;
 }
@@ -38,7 +64,7 @@ export interface UseWebSocketReturn {
   sendMessage: (type: string, payload: any) => void;
   sendDiff: (diff: string, version: number) => void;
   sendCursor: (position: { line: number; column: number }, selection?: any) => void;
-  runCode: (code: string, language: string, input?: string) => void;
+  runCode: (code: string, language: string, input?: string, cache?: boolean) => void;
   users: User[];
   currentVersion: number;
 }
@@ -56,6 +82,8 @@ export function useWebSocket({
   onCodeUpdate,
   onSync,
   onExecutionResult,
+  onExecutionOutput,
+  onExecutionStatus,
   reconnectInterval = 3000,
   maxReconnectAttempts = 10,
 }: UseWebSocketOptions): UseWebSocketReturn {
@@ -63,17 +91,25 @@ export function useWebSocket({
   const [isConnected, setIsConnected] = useState(false);
   const [users, setUsers] = useState<User[]>([]);
   const [currentVersion, setCurrentVersion] = useState(1);
+  const versionRef = useRef<number | null>(null);
   const reconnectAttempts = useRef(0);
   const reconnectTimeoutRef = useRef<NodeJS.Timeout>();
+  // Decompression is async, so frames are handled through one chain to keep
+  // them in the order they arrived
+  const decodeChainRef = useRef<Promise<void>>(Promise.resolve());
 
   const connect = useCallback(() => {
     if (wsRef.current?.readyState === WebSocket.OPEN) {
       return;
     }
 
-    const wsUrl = `${process.env.NEXT_PUBLIC_WS_URL || "ws://localhost:8000"}/ws/${roomId}?user_id=${userId}&username=${encodeURIComponent(username)}`;
+    // On reconnect, ask only for the diffs we missed
+    const resume = versionRef.current !== null ? `&last_version=${versionRef.current}` : "";
+    const compress = typeof DecompressionStream !== "undefined" ? "&compress=true" : "";
+    const wsUrl = `${process.env.NEXT_PUBLIC_WS_URL || "ws://localhost:8000"}/ws/${roomId}?user_id=${userId}&username=${encodeURIComponent(username)}${resume}${compress}`;
     
     const ws = new WebSocket(wsUrl);
+    ws.binaryType = "arraybuffer";
     wsRef.current = ws;
 
     ws.onopen = () => {
@@ -84,55 +120,85 @@ export function useWebSocket({
     };
 
     ws.onmessage = (event) => {
-      try {
-        const message: WebSocketMessage = JSON.parse(event.data);
+      decodeChainRef.current = decodeChainRef.current.then(async () => {
+        try {
+          const message = await decodeFrame(event.data);
         
-        switch (message.type) {
-          case "room_state":
-          case "sync":
-            const payload = message.payload;
-            if (payload.code !== undefined) {
-              setCurrentVersion(payload.version || 1);
-              onSync?.(payload.code, payload.version || 1, payload.language || "python");
-            }
-            if (payload.users) {
-              setUsers(payload.users);
-            }
-            break;
-
-          case "users_update":
-            setUsers(message.payload.users);
-            break;
-
-          case "user_joined":
-            onUserJoin?.(message.payload);
-            break;
-
-          case "user_left":
-            onUserLeave?.(message.payload.user_id);
-            break;
-
-          case "cursor":
-            onCursorUpdate?.(message.payload);
-            break;
-
-          case "diff":
-            onCodeUpdate?.(message.payload.diff, message.payload.user_id, message.payload.version);
-            break;
-
-          case "execution_result":
-            onExecutionResult?.(message.payload);
-            break;
-
-          case "ack":
-            setCurrentVersion(message.payload.version);
-            break;
-        }
+          switch (message.type) {
+            case "room_state":
+            case "sync":
+              const payload = message.payload;
+              if (payload.code !== undefined) {
+                versionRef.current = payload.version || 1;
+                setCurrentVersion(payload.version || 1);
+                onSync?.(payload.code, payload.version || 1, payload.language || "python");
+              }
+              if (payload.users) {
+                setUsers(payload.users);
+              }
+              break;
 
-        onMessage?.(message);
-      } catch (error) {
-        console.error("Failed to parse WebSocket message:", error);
-      }
+            case "users_update":
+              setUsers(message.payload.users);
+              break;
+
+            case "user_joined":
+              onUserJoin?.(message.payload);
+              break;
+
+            case "user_left":
+              onUserLeave?.(message.payload.user_id);
+              break;
+
+            case "cursor":
+              onCursorUpdate?.(message.payload);
+              break;
+
+            case "cursors":
+              for (const cursor of message.payload.cursors) {
+                onCursorUpdate?.(cursor);
+              }
+              break;
+
+            case "diff":
+              versionRef.current = message.payload.version;
+              onCodeUpdate?.(message.payload.diff, message.payload.user_id, message.payload.version);
+              break;
+
+            // A burst of edits applied together has the same shape as a catchup
+            case "edits":
+            case "catchup":
+              for (const missed of message.payload.diffs) {
+                onCodeUpdate?.(missed.diff, missed.user_id, missed.version);
+              }
+              versionRef.current = message.payload.version;
+              setCurrentVersion(message.payload.version);
+              break;
+
+            case "execution_result":
+              onExecutionResult?.(message.payload);
+              break;
+
+            case "execution_output":
+              onExecutionOutput?.(message.payload);
+              break;
+
+            case "execution_queued":
+            case "execution_started":
+              onExecutionStatus?.({ type: message.type, ...message.payload });
+              break;
+
+            case "ack":
+              versionRef.current = message.payload.version;
+              setCurrentVersion(message.payload.version);
+              break;
+          }
+
+          onMessage?.(message);
+        } catch (error) {
+          console.error("Failed to parse WebSocket message:", error);
+        }
+      });
     };
 
     ws.onclose = () => {
@@ -151,7 +217,7 @@ export function useWebSocket({
     ws.onerror = (error) => {
       console.error("WebSocket error:", error);
     };
-  }, [roomId, userId, username, onMessage, onConnect, onDisconnect, onUserJoin, onUserLeave, onCursorUpdate, onCodeUpdate, onSync, onExecutionResult, reconnectInterval, maxReconnectAttempts]);
+  }, [roomId, userId, username, onMessage, onConnect, onDisconnect, onUserJoin, onUserLeave, onCursorUpdate, onCodeUpdate, onSync, onExecutionResult, onExecutionOutput, onExecutionStatus, reconnectInterval, maxReconnectAttempts]);
 
   const sendMessage = useCallback((type: string, payload: any) => {
     if (wsRef.current?.readyState === WebSocket.OPEN) {
@@ -167,8 +233,8 @@ export function useWebSocket({
     sendMessage("cursor", { position, selection });
   }, [sendMessage]);
 
-  const runCode = useCallback((code: string, language: string, input?: string) => {
-    sendMessage("run", { code, language, input: input || "" });
+  const runCode = useCallback((code: string, language: string, input?: string, cache?: boolean) => {
+    sendMessage("run", { code, language, input: input || "", cache: !!cache });
   }, [sendMessage]);
 
   // Connect on mount